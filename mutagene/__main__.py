@@ -13,6 +13,7 @@ from mutagene.cli.fetch_menu import FetchMenu
 from mutagene.cli.profile_menu import ProfileMenu
 from mutagene.cli.motif_menu import MotifMenu
 from mutagene.cli.signature_menu import SignatureMenu
+from mutagene.cli.extract_menu import ExtractMenu
 from mutagene.cli.rank_menu import RankMenu
 from mutagene.cli.benchmark_menu import BenchmarkMenu
 
@@ -46,13 +47,14 @@ class MutaGeneApp(object):
 
         subparsers = parser.add_subparsers(
             help="",
-            metavar='{fetch, profile, rank, motif, signature}',
+            metavar='{fetch, profile, rank, motif, signature, extract}',
             description="""\
         fetch - Load data such as genomes and cancer datasets from demote sources (alias: download)
         profile - Create a mutational profile given a sample with mutations
         rank - Predict driver mutations by ranking observed mutations with respect to their expected mutability
         motif - Test samples for presence of mutational motifs
-        signature - Identify activity of existing mutational signatures in samples or derive new signatures (aliases: identify, decompose)\
+        signature - Identify activity of existing mutational signatures in samples (aliases: identify, decompose)
+        extract - Derive new mutational signatures from a cohort of samples with NMF (aliases: denovo, nmf)\
             """, dest='command', title='Choose MutaGene subpackage')
 
         parser_mapping = {
@@ -61,6 +63,7 @@ class MutaGeneApp(object):
             'rank': {'class': RankMenu, 'aliases': ['driver']},
             'motif': {'class': MotifMenu, 'aliases': []},
             'signature': {'class': SignatureMenu, 'aliases': ['identify', 'decompose']},
+            'extract': {'class': ExtractMenu, 'aliases': ['denovo', 'nmf']},
             'benchmark': {'class': BenchmarkMenu, 'aliases': []},
         }
 
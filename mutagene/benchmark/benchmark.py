@@ -4,10 +4,18 @@ import numpy as np
 # from .io import read_profile
 # from .io import format_profile
 from mutagene.signatures.identify import decompose_mutational_profile_counts
+from mutagene.signatures.results import DecompositionResult
 
 
 def convert_to_list(name_to_idx, d):
-    v = [0] * N
+    v = [0] * len(name_to_idx)
+    if isinstance(d, DecompositionResult):
+        for name, score in zip(d.names, d.exposures):
+            idx = name_to_idx.get(name)
+            if idx is not None:
+                v[idx] = score
+        return v
+
     for value in d:
         idx = name_to_idx.get(value['name'])
         if idx is None:
@@ -18,6 +26,10 @@ def convert_to_list(name_to_idx, d):
 
 
 def get_scores(d):
+    if isinstance(d, DecompositionResult):
+        metrics = d.metrics
+        return tuple(metrics.get(name, 0) for name in ('LogLik', 'Frobenius', 'FrobeniusZero', 'DivergenceJS', 'DivergenceKL'))
+
     ll = 0
     frob = 0
     frob0 = 0
@@ -11,6 +11,7 @@ from multiprocessing import Pool
 from mutagene.io.profile import write_profile, read_profile_file
 from mutagene.io.decomposition import write_decomposition, read_decomposition
 from mutagene.signatures.identify import decompose_mutational_profile_counts
+from mutagene.signatures.signature_set import SignatureSet
 from mutagene.benchmark.deconstructsigs import deconstruct_sigs, deconstruct_sigs_custom
 
 
@@ -75,6 +76,7 @@ def gen_sample_2combinations(data_root, signature_ids, W, ratio=0.7, noise_level
 
 def run_benchmark_2combinations(data_root, N, signature_ids, W, force=False):
     methods = ['MLE', 'MLEZ', 'AICc', 'BIC', 'AICcZ', 'BICZ']
+    signature_set = SignatureSet.from_signatures((W, signature_ids))
 
     for fname in glob.glob("{}/2comb/{}_**/*.profile".format(data_root, N), recursive=True):
         print(fname)
@@ -87,12 +89,11 @@ def run_benchmark_2combinations(data_root, N, signature_ids, W, force=False):
 
             _, _, results = decompose_mutational_profile_counts(
                 profile,
-                (W, signature_ids),
+                signature_set,
                 method,
-                debug=False,
-                others_threshold=0.0)
-            exposure_dict = {x['name']: x['score'] for x in results}
-            exposure = [exposure_dict[name] for name in signature_ids]
+                others_threshold=0.0,
+                diagnostics=False)
+            exposure = results.exposures
             write_decomposition(info, np.array(exposure), signature_ids)
 
 
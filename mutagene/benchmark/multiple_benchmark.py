@@ -9,6 +9,7 @@ from sklearn.metrics import (
 
 from mutagene.io.profile import read_profile_file, write_profile, read_signatures
 from mutagene.signatures.identify import NegLogLik
+from mutagene.signatures.signature_set import SignatureSet
 from mutagene.benchmark.deconstructsigs import deconstruct_sigs_custom
 from mutagene.benchmark.generate_benchmark import *
 # from mutagene.identify import decompose_mutational_profile_counts
@@ -19,7 +20,8 @@ def multiple_benchmark_helper(j):
 
     # for i in [5, 10, 30]:
     for i in [30, ]:
-        W, signature_names = read_signatures(i)
+        signature_set = read_signatures(i)
+        W, signature_names = signature_set
         N = W.shape[1]
 
         # r = random.randrange(2, i // 3 + 2)
@@ -58,11 +60,11 @@ def multiple_benchmark_helper(j):
         for method, method_fname in [("MLE", mle_info), ("MLEZ", mlez_info)]:
             _, _, results = decompose_mutational_profile_counts(
                 profile,
-                (W, signature_names),
+                signature_set,
                 method,
-                debug=False,
-                others_threshold=0.0)
-            write_decomposition(method_fname, results, signature_names)
+                others_threshold=0.0,
+                diagnostics=False)
+            write_decomposition(method_fname, np.array(results.exposures), signature_names)
 
 
 def multiple_benchmark():
@@ -74,7 +76,8 @@ def multiple_benchmark():
 
 
 def multiple_benchmark_run_helper(data):
-    fname, signature_ids, W, force = data
+    fname, signature_set, force = data
+    signature_ids = signature_set.names
     # methods = ['MLE', 'MLEZ', 'AICc', 'BIC', 'AICcZ', 'BICZ']
     methods = ['AICc', 'AICcZ']
 
@@ -90,19 +93,20 @@ def multiple_benchmark_run_helper(data):
 
         _, _, results = decompose_mutational_profile_counts(
             profile,
-            (W, signature_ids),
+            signature_set,
             method,
-            debug=False,
-            others_threshold=0.0)
-        exposure_dict = {x['name']: x['score'] for x in results}
-        exposure = [exposure_dict[name] for name in signature_ids]
+            others_threshold=0.0,
+            diagnostics=False)
+        exposure = results.exposures
         write_decomposition(info, np.array(exposure), signature_ids)
 
 
 def multiple_benchmark_run(N, signature_ids, W, force=False):
+    signature_set = SignatureSet.from_signatures((W, signature_ids))
+
     def get_iterator():
         for fname in glob.glob("data/benchmark/multiple/{:02d}_*.profile".format(N), recursive=True):
-                yield (fname, signature_ids, W, force)
+                yield (fname, signature_set, force)
 
     random.seed(13425)
     with Pool(10) as p:
@@ -0,0 +1,50 @@
+import glob
+import time
+
+import numpy as np
+
+from mutagene.io.profile import read_profile_file
+from mutagene.signatures.identify import decompose_multisample_mutational_profile_counts
+from mutagene.signatures.signature_set import SignatureSet
+
+
+def compare_solvers(data_root, signature_names, W, methods=('MLE', 'MLEZ', 'AICc', 'BIC')):
+    """
+    Compare EM and SLSQP solvers on all profiles found in data_root (e.g. generated with pairwise_gen or multiple_gen)
+    Reports running time and agreement of exposures and log likelihoods in {data_root}/solvers.txt
+    """
+    fnames = sorted(glob.glob("{}/**/*.profile".format(data_root), recursive=True))
+    profiles = []
+    for fname in fnames:
+        profile = read_profile_file(fname)
+        if profile is not None and len(profile) == W.shape[0]:
+            profiles.append(profile)
+
+    if len(profiles) == 0:
+        print("No profiles found in {}".format(data_root))
+        return
+
+    profiles = np.array(profiles)
+    signature_set = SignatureSet.from_signatures((W, signature_names))
+    print("Comparing solvers on {} profiles".format(profiles.shape[0]))
+
+    with open("{}/solvers.txt".format(data_root), 'w') as o:
+        o.write("method\tnprofiles\tslsqp_time\tem_time\tspeedup\tmean_abs_diff\tmax_abs_diff\tmean_loglik_diff\tem_iterations\n")
+        for method in methods:
+            results = {}
+            for solver in ('slsqp', 'em'):
+                start = time.time()
+                exposures, _, metrics = decompose_multisample_mutational_profile_counts(
+                    profiles, signature_set, method, solver=solver)
+                results[solver] = (time.time() - start, exposures, metrics)
+
+            slsqp_time, slsqp_exposures, slsqp_metrics = results['slsqp']
+            em_time, em_exposures, em_metrics = results['em']
+            diff = np.abs(slsqp_exposures - em_exposures)
+            loglik_diff = em_metrics['LogLik'] - slsqp_metrics['LogLik']
+
+            row = (
+                method, profiles.shape[0], slsqp_time, em_time, slsqp_time / em_time,
+                diff.mean(), diff.max(), loglik_diff.mean(), em_metrics['Iterations'].mean())
+            o.write("{}\t{}\t{:.3f}\t{:.3f}\t{:.1f}\t{:.6f}\t{:.6f}\t{:.6f}\t{:.1f}\n".format(*row))
+            print("{}\t{} profiles\tSLSQP {:.3f}s\tEM {:.3f}s\tspeedup {:.1f}x\tmean |diff| {:.6f}\tmax |diff| {:.6f}\tmean LL diff {:.6f}\tEM iterations {:.1f}".format(*row))
@@ -21,6 +21,8 @@ from mutagene.benchmark.multiple_benchmark import (
     aggregate_multiple_benchmarks
 )
 
+from mutagene.benchmark.solvers import compare_solvers
+
 from mutagene.io.profile import read_signatures
 
 import logging
@@ -37,7 +39,8 @@ class BenchmarkMenu(object):
             'multiple_gen',
             'multiple_run',
             'multiple_run_ds',
-            'aggregate'], help="Multiple or pairwise mode, etc", type=str)
+            'aggregate',
+            'solvers'], help="Multiple or pairwise mode, etc", type=str)
         required_group.add_argument("--signatures", "-i", nargs='*', help="Signatures (5, 10, 30, ...), default 30", type=str, default=["30"])
 
         # dirname = os.path.dirname(os.path.realpath(__file__))
@@ -81,6 +84,11 @@ class BenchmarkMenu(object):
         elif args.mode == 'aggregate':
             aggregate_benchmarks(args.root)
 
+        elif args.mode == 'solvers':
+            for i in args.signatures:
+                W, signature_names = read_signatures(i)
+                compare_solvers(args.root, signature_names, W)
+
         else:
             print("Unknown benchmark action mode")
             self.parser.print_usage()
@@ -0,0 +1,160 @@
+import argparse
+import os
+import sys
+import logging
+
+import numpy as np
+
+from mutagene.io.profile import read_profile_file, write_signatures
+from mutagene.profiles.profile import get_multisample_mutational_profile
+from mutagene.io.context_window import read_mutations
+from mutagene.profiles.channels import CHANNEL_SCHEMES
+from mutagene.signatures.identify import decompose_multisample_mutational_profile_counts
+from mutagene.signatures.nmf import extract_signatures, NMF_OBJECTIVES
+from mutagene.io.decomposition import write_decomposition
+
+
+logger = logging.getLogger(__name__)
+
+genome_error_message = """requires genome name argument -g hg19, hg38, mm10, see http://hgdownload.cse.ucsc.edu/downloads.html for more
+                          Use mutagene fetch to download genome assemblies"""
+
+
+def parse_ranks(ranks):
+    """ Ranks given as a number (5), a range (2-10) or a list (2,4,6) """
+    result = []
+    for item in ranks.split(","):
+        if "-" in item:
+            start, end = item.split("-")
+            result.extend(range(int(start), int(end) + 1))
+        else:
+            result.append(int(item))
+    return sorted(set(result))
+
+
+class ExtractMenu(object):
+    def __init__(self, parser):
+        required_group = parser.add_argument_group('Required arguments')
+        required_group.add_argument("--infile", "-i", help="Input file in VCF or MAF format with mutations of a cohort of samples", type=argparse.FileType('r'))
+        required_group.add_argument('--genome', "-g", help="Location of genome assembly file in 2bit format", type=str, default='hg19')
+        required_group.add_argument("--profiles", "-p", nargs='*', help="Mutational profiles of samples (mutation counts), used instead of input file of mutations", type=str)
+
+        optional_group = parser.add_argument_group('Optional arguments')
+        optional_group.add_argument('--input-format', "-f", help="Input format: MAF, VCF", type=str, choices=['MAF', 'VCF', 'TCGI'], default='MAF')
+        optional_group.add_argument('--channels', help="Layout of channels of profiles of mutations: 96 (trinucleotide context), 192 (trinucleotide context and transcriptional strand of MAF Transcript_Strand) or 1536 (pentanucleotide context), layout of profile files is detected from their channels", type=str, choices=list(CHANNEL_SCHEMES), default='96')
+        optional_group.add_argument(
+            '--outfile', "-o", nargs='?', type=argparse.FileType('w'), default=sys.stdout,
+            help="Name of output file with extracted signatures, will be generated in TSV format")
+        optional_group.add_argument('--exposures', "-e", type=argparse.FileType('w'), help="Name of output file with exposures of extracted signatures in samples, TSV format")
+        optional_group.add_argument('--stats', type=argparse.FileType('w'), help="Name of output file with stability and objective of each rank, TSV format")
+
+        advanced_group = parser.add_argument_group('Advanced arguments')
+        advanced_group.add_argument('--rank', "-k", help="Number of signatures: a number (5), a range (2-10) or a list (2,4,6). The most stable rank is selected from several ranks", type=str, default="2-10")
+        advanced_group.add_argument('--restarts', "-r", help="Number of NMF runs from random initializations for each rank", type=int, default=100)
+        advanced_group.add_argument('--objective', help="Objective of NMF (kl: Poisson likelihood, frobenius: least squares)", type=str, choices=NMF_OBJECTIVES, default='kl')
+        advanced_group.add_argument('--stability-threshold', help="Largest rank with average stability of signatures above the threshold is selected", type=float, default=0.8)
+        advanced_group.add_argument('--tolerance', help="Convergence tolerance of NMF, relative change of the objective", type=float, default=1e-6)
+        advanced_group.add_argument('--max-iterations', help="Maximum number of iterations of NMF", type=int, default=2000)
+        advanced_group.add_argument('--chunk-size', help="Number of samples updated at a time, limits memory used by each NMF run", type=int, default=1000)
+        advanced_group.add_argument('--seed', help="Seed of random initializations", type=int, default=None)
+        advanced_group.add_argument('--jobs', "-j", help="Number of parallel processes running NMF restarts (0: all available CPUs)", type=int, default=1)
+
+        # for backwards compatibility with 0.8.X add a hidden action that would just take anything as a valid input
+        optional_group.add_argument('action', nargs="?", metavar="")
+
+    def callback(self, args):
+        self.extract(args)
+
+    def read_profiles(self, args):
+        """ Returns tuple: list of samples and samples x channels matrix of mutation counts, None if input could not be read """
+        if args.profiles:
+            samples = [os.path.splitext(os.path.basename(fname))[0] for fname in args.profiles]
+            profiles = [read_profile_file(fname) for fname in args.profiles]
+            # parse errors are returned as None or a tuple of None
+            invalid = [fname for fname, profile in zip(args.profiles, profiles) if not isinstance(profile, list)]
+            if len(invalid) > 0:
+                logger.warning("Profiles could not be read: {}".format(", ".join(invalid)))
+                return None, None
+            if len(set(len(profile) for profile in profiles)) > 1:
+                logger.warning("Profiles have different layouts of channels")
+                return None, None
+            return samples, np.array(profiles)
+
+        try:
+            mutations, _, _ = read_mutations(args.input_format, args.infile, args.genome, window_size=1, scheme=args.channels)
+        except Exception as e:
+            e_message = getattr(e, 'message', repr(e))
+            logger.warning(
+                "Parsing {0} failed. "
+                "Check that the input file is in {0} format "
+                "or specify a different format using option -f \n"
+                "{1}".format(args.input_format, e_message))
+
+            if logger.root.level == logging.DEBUG:
+                raise
+            return None, None
+
+        return list(mutations.keys()), get_multisample_mutational_profile(mutations, counts=True, scheme=args.channels)
+
+    def extract(self, args):
+        if not args.infile and not args.profiles:
+            logger.warning("Provide input file in VCF or MAF format (-i) and a corresponding genome assembly (-g) or mutational profiles (-p)")
+            return
+        if args.infile and not args.genome:
+            logger.warning(genome_error_message)
+            return
+
+        try:
+            ranks = parse_ranks(args.rank)
+        except ValueError:
+            logger.warning("Rank should be a number, a range or a list of numbers separated by commas e.g. 2-10")
+            return
+        if len(ranks) == 0 or ranks[0] < 1:
+            logger.warning("Rank should be at least 1")
+            return
+
+        if args.restarts < 1:
+            logger.warning("Number of restarts should be at least 1")
+            return
+
+        if args.jobs < 0:
+            logger.warning("Number of parallel processes can not be negative")
+            return
+
+        samples, V = self.read_profiles(args)
+        if samples is None:
+            return
+        nonempty = V.sum(axis=1) > 0
+        samples = [sample for sample, keep in zip(samples, nonempty) if keep]
+        V = V[nonempty]
+        if V.shape[0] < max(ranks):
+            logger.warning("Number of samples with mutations ({}) should not be less than the rank".format(V.shape[0]))
+            return
+
+        rank, results = extract_signatures(
+            V, ranks,
+            n_restarts=args.restarts,
+            objective=args.objective,
+            stability_threshold=args.stability_threshold,
+            jobs=args.jobs,
+            random_state=args.seed,
+            tol=args.tolerance,
+            max_iter=args.max_iterations,
+            chunk_size=args.chunk_size)
+        logger.info("Selected rank {} with stability {:.3f}".format(rank, results[rank]['mean_stability']))
+
+        W = results[rank]['signatures']
+        signature_names = ["Signature-{}".format(i + 1) for i in range(rank)]
+        write_signatures(args.outfile, W, signature_names)
+
+        if args.stats:
+            args.stats.write("rank\tstability\tmin_stability\tobjective\n")
+            for k in sorted(results):
+                args.stats.write("{}\t{:.4f}\t{:.4f}\t{:.4f}\n".format(
+                    k, results[k]['mean_stability'], np.min(results[k]['stability']), results[k]['objective']))
+
+        if args.exposures:
+            exposures, mutations, _ = decompose_multisample_mutational_profile_counts(
+                V, (W, signature_names), 'MLE', enable_dummy=False, solver='em', diagnostics=False)
+            samples_results = {sample: (exposures[i], mutations[i]) for i, sample in enumerate(samples)}
+            write_decomposition(args.exposures, samples_results, signature_names)
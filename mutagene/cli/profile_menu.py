@@ -1,7 +1,9 @@
 import argparse
+import os
 import sys
 import logging
 from mutagene.profiles.profile import calc_profile
+from mutagene.io.profiles_store import import_profiles_directory, read_metadata_file
 
 
 logger = logging.getLogger(__name__)
@@ -11,11 +13,16 @@ genome_error_message = """requires genome name argument -g hg19, hg38, mm10, see
 
 class ProfileMenu(object):
     def __init__(self, parser):
-        parser.add_argument("--infile", "-i", nargs='*', help="Input file format", type=argparse.FileType('r'))
+        parser.add_argument("--infile", "-i", nargs='*', help="Input files in VCF or MAF format (- for standard input), mutations of all files are pooled in the profile", type=str)
         parser.add_argument('--outfile', "-o", nargs='?', type=argparse.FileType('w'), default=sys.stdout,
                             help="Name of output file, will be generated in TSV format")
         parser.add_argument('--genome', "-g", help="Location of genome assembly file", type=str)
         parser.add_argument('--input-format', "-f", help="Input format: auto, MAF, VCF", type=str, default='auto')
+        parser.add_argument('--matrix', "-m", type=argparse.FileType('w'), help="Name of output file with profiles of each input file, TSV format with a column per file")
+        parser.add_argument('--jobs', "-j", help="Number of parallel processes reading input files (0: all available CPUs)", type=int, default=1)
+        parser.add_argument('--import-profiles', help="Directory of profiles of samples (SAMPLE.counts, SAMPLE.mutations and SAMPLE.stats files, e.g. data/ICGC) imported to a store of profiles", type=str)
+        parser.add_argument('--profiles-store', help="Name of store of profiles written by --import-profiles", type=str)
+        parser.add_argument('--metadata', help="Metadata of samples imported to the store: TSV file with header, first column is sample ID", type=str)
 
         # for backwards compatibility with 0.8.X add a hidden action that would just take anything as a valid input
         parser.add_argument('action', nargs="?", metavar="")
@@ -26,10 +33,42 @@ class ProfileMenu(object):
 
     def calculate(self, args):
         # print("Calculating...")
+        if args.import_profiles:
+            self.import_profiles(args)
+            return
         if not args.infile:
             logger.warning("Provide input file in VCF or MAF format (-i) and a corresponding genome assembly (-g)")
             return
         if not args.genome:
             logger.warning(genome_error_message)
             return
-        calc_profile(args.infile, args.outfile, args.genome, args.input_format)
+        if args.jobs < 0:
+            logger.warning("Number of parallel processes can not be negative")
+            return
+        missing = [fname for fname in args.infile if fname != '-' and not os.path.isfile(fname)]
+        if len(missing) > 0:
+            logger.warning("Input files not found: {}".format(", ".join(missing)))
+            return
+        infiles = [sys.stdin if fname == '-' else fname for fname in args.infile]
+        calc_profile(infiles, args.outfile, args.genome, args.input_format, jobs=args.jobs, matrix=args.matrix)
+
+    def import_profiles(self, args):
+        if not args.profiles_store:
+            logger.warning("Provide name of the store of profiles (--profiles-store)")
+            return
+        if not os.path.isdir(args.import_profiles):
+            logger.warning("Directory {} not found".format(args.import_profiles))
+            return
+        metadata = None
+        if args.metadata:
+            try:
+                metadata = read_metadata_file(args.metadata)
+            except (OSError, StopIteration) as e:
+                logger.warning("Metadata file could not be read: {}".format(e))
+                return
+        try:
+            n = import_profiles_directory(args.import_profiles, args.profiles_store, metadata)
+        except (OSError, ValueError) as e:
+            logger.warning("Profiles could not be imported: {}".format(e))
+            return
+        logger.info("Imported profiles of {} samples to {}".format(n, args.profiles_store))
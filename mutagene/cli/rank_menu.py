@@ -9,6 +9,7 @@ from mutagene.io.cohorts import read_cohort_size_from_profile_file, list_cohorts
 from mutagene.io.profile import read_profile_file
 from mutagene.io.context_window import read_mutations
 from mutagene.profiles.profile import get_pooled_multisample_mutational_profile
+from mutagene.io.profiles_store import ProfilesStore, parse_store_criteria
 from mutagene.io.protein_mutations_MAF import read_protein_mutations_MAF
 
 
@@ -33,6 +34,8 @@ class RankMenu(object):
 
         advanced_group = parser.add_argument_group('Advanced arguments')
         advanced_group.add_argument('--profile', "-p", help="Override profile to calculate mutability, may also describe cohort size", type=str)
+        advanced_group.add_argument('--profiles-store', help="Override profile and cohort size with pooled profiles of a store of a cohort (see mutagene profile --import-profiles)", type=str)
+        advanced_group.add_argument('--store-where', nargs='*', metavar="COLUMN=VALUE", help="Only pool samples of the profiles store with given values of metadata columns, e.g. project=BRCA-US")
         advanced_group.add_argument('--nsamples', "-n", type=int, help="Override cohort size")
         advanced_group.add_argument('--threshold-driver', "-td", help="BScore threshold between Driver and Pontential Driver mutations", type=float, default=THRESHOLD_DRIVER)
         advanced_group.add_argument('--threshold-passenger', "-tp", help="BScore threshold between Pontential Driver and Passenger mutations", type=float, default=THRESHOLD_PASSENGER)
@@ -82,8 +85,10 @@ class RankMenu(object):
 
         cohort_size = len(mutations.keys())
         logger.info("Cohort size: {}".format(cohort_size))
-        profile = get_pooled_multisample_mutational_profile(mutations, counts=True)
         cohort_aa_mutations = None
+        if args.cohort is None and not args.profile and not args.profiles_store:
+            # pooled profile of the input is only needed if it is not overridden below
+            profile = get_pooled_multisample_mutational_profile(mutations, counts=True)
 
         # optionals:
         # overriding profile, cohort size and observed mutations based on precalc cohort
@@ -92,6 +97,21 @@ class RankMenu(object):
             logger.info("Precalculated cohort and profile loaded")
             logger.info("Cohort size: {}".format(cohort_size))
 
+        # overriding profile and cohort size with a store of profiles:
+        if args.profiles_store:
+            try:
+                store = ProfilesStore(args.profiles_store)
+                samples, profiles = store.get_profiles(where=parse_store_criteria(args.store_where))
+            except (OSError, ValueError) as e:
+                logger.warning("Profiles store could not be read: {}".format(e))
+                return
+            if len(samples) == 0:
+                logger.warning("No samples of the profiles store match the criteria")
+                return
+            profile = profiles.sum(axis=0).tolist()
+            cohort_size = len(samples)
+            logger.info("Profile pooled from {} samples of the store".format(cohort_size))
+
         # overriding profile:
         if args.profile:
             profile = read_profile_file(args.profile)
@@ -1,16 +1,24 @@
 import argparse
+import sqlite3
 import sys
 import logging
 
-from tqdm import tqdm
+import numpy as np
 
-from mutagene.io.profile import read_signatures
+from mutagene.io.profile import read_signatures, read_signatures_table, get_named_subset
 from mutagene.profiles.profile import get_multisample_mutational_profile
-from mutagene.profiles.profile import generate_resampled_profiles
 from mutagene.io.context_window import read_mutations
-from mutagene.signatures.identify import decompose_mutational_profile_counts
-from mutagene.signatures.identify import IDENTIFY_MIN_FUNCTIONS
-from mutagene.io.decomposition import write_decomposition
+from mutagene.io.profiles_store import ProfilesStore, parse_store_criteria
+from mutagene.profiles.channels import CHANNEL_SCHEMES, get_channel_scheme
+from mutagene.signatures.signature_set import SignatureSet
+from mutagene.signatures.identify import decompose_multisample_mutational_profile_counts
+from mutagene.signatures.identify import IDENTIFY_MIN_FUNCTIONS, IDENTIFY_SOLVERS, EM_FUNCTIONS, FISTA_FUNCTIONS
+from mutagene.signatures.identify import SELECTION_FUNCTIONS, PRESCREEN_METHODS, is_cacheable
+from mutagene.signatures.selection import SELECTION_DIRECTIONS
+from mutagene.signatures.bootstrap import bootstrap_multisample_decomposition
+from mutagene.signatures.fisher import get_fisher_intervals
+from mutagene.io.decomposition import DecompositionWriter
+from mutagene.io.decomposition_cache import DecompositionCache, DECOMPOSITION_CACHE_SIZE
 
 
 logger = logging.getLogger(__name__)
@@ -24,13 +32,17 @@ class SignatureMenu(object):
         required_group = parser.add_argument_group('Required arguments')
         required_group.add_argument("--infile", "-i", help="Input file in VCF or MAF format", type=argparse.FileType('r'))
         required_group.add_argument('--genome', "-g", help="Location of genome assembly file in 2bit format", type=str, default='hg19')
+        required_group.add_argument("--profiles-store", help="Store of mutational profiles of a cohort (see mutagene profile --import-profiles), used instead of input file of mutations", type=str)
         required_group.add_argument(
             "--signatures", "-s",
             choices=["5", "10", "30", "49", "53", "MGA", "MGB", "COSMICv2", "COSMICv3", "KUCAB"],
             help="Collection of signatures to use", type=str, default="COSMICv2")
+        required_group.add_argument("--signatures-file", help="Signatures given as a TSV table with a row per channel (e.g. A[C>A]A, T:A[C>A]A or AA[C>A]AA, as written by mutagene extract) and a column per signature, used instead of a collection", type=str)
 
         optional_group = parser.add_argument_group('Optional arguments')
         optional_group.add_argument('--input-format', "-f", help="Input format: MAF, VCF", type=str, choices=['MAF', 'VCF', 'TCGI'], default='MAF')
+        optional_group.add_argument('--channels', help="Layout of channels of profiles: 96 (trinucleotide context), 192 (trinucleotide context and transcriptional strand of MAF Transcript_Strand, VCF and TCGI mutations are on the + strand) or 1536 (pentanucleotide context). Signatures should have the same channels", type=str, choices=list(CHANNEL_SCHEMES), default='96')
+        optional_group.add_argument('--store-where', nargs='*', metavar="COLUMN=VALUE", help="Only samples of the profiles store with given values of metadata columns, e.g. project=BRCA-US")
         optional_group.add_argument(
             '--outfile', "-o", nargs='?', type=argparse.FileType('w'), default=sys.stdout,
             help="Name of output file, will be generated in TSV format")
@@ -42,20 +54,40 @@ class SignatureMenu(object):
         advanced_group.add_argument('--method', "-m", help="Method defines the function minimized in the optimization procedure", type=str, default='MLE', nargs='?')
         advanced_group.add_argument('--no-unexplained-variance', "-U", help="Do not account for unexplained variance (non-context dependent mutational processes and unknown signatures)", action='store_false')
         advanced_group.add_argument('--mutations-threshold', "-t", help="Only report signatures with mutations above the threshold", type=int, default=0)
-        advanced_group.add_argument('--keep-only', "-k", help="Keep only the signatures in the list, separated by commas e.g. 1,3,5", type=str, default=None)
+        advanced_group.add_argument('--unordered', help="Write each sample as soon as it is done instead of in the order of the input (adaptive bootstrap finishes samples out of order)", action='store_true')
+        advanced_group.add_argument('--keep-only', "-k", help="Keep only the signatures in the list, separated by commas e.g. 1,3,5; 'representatives' keeps one signature of each cluster of similar signatures, 'cluster:X' keeps the cluster of signature X", type=str, default=None)
+        advanced_group.add_argument('--solver', help="Optimization backend (slsqp: constrained minimization, em: expectation maximization for MLE, AICc and BIC methods, fista: accelerated projected gradient for Frobenius, FrobeniusZero, Cos, KL and JS methods)", type=str, choices=IDENTIFY_SOLVERS, default='slsqp')
+        advanced_group.add_argument('--tolerance', help="Convergence tolerance of EM and FISTA solvers", type=float, default=1e-6)
+        advanced_group.add_argument('--max-iterations', help="Maximum number of iterations of EM and FISTA solvers", type=int, default=5000)
+        advanced_group.add_argument('--global-optimization', "-G", help="Fit each sample from multiple random initial guesses and keep the best solution (slower, avoids local minima)", action='store_true')
+        advanced_group.add_argument('--seed', help="Seed of random starts of global optimization and replicates of the pre-screening, results are only cached with a seed", type=int, default=None)
+        advanced_group.add_argument('--starts', help="Maximum number of initial guesses per sample in global optimization mode, the search stops early when several starts agree on the optimum", type=int, default=20)
+        advanced_group.add_argument('--selection', help="Stepwise selection of signatures for AICc and BIC methods: signatures are added (forward), removed (backward) or both while the criterion improves", type=str, choices=SELECTION_DIRECTIONS, default=None)
+        advanced_group.add_argument('--prescreen', help="Fit each sample only with signatures passing a fast screen: nnls (default) or clusters (fit representatives of clusters of similar signatures first, then all members of clusters with exposure). Signatures the screen missed are added back if they improve the fit", nargs='?', const='nnls', choices=PRESCREEN_METHODS, default=None)
+        advanced_group.add_argument('--prescreen-margin', help="Number of signatures rejected by the screen that are still kept for the fit", type=int, default=3)
+        advanced_group.add_argument('--prescreen-replicates', help="Number of bootstrap replicates of the profile screened in addition to the profile", type=int, default=0)
+        advanced_group.add_argument('--batch-size', help="Number of samples fitted at a time, results of a batch are written as soon as it is done", type=int, default=1000)
+        advanced_group.add_argument('--jobs', "-j", help="Number of parallel processes used to fit samples and bootstrap replicates (0: all available CPUs)", type=int, default=1)
+
+        advanced_group.add_argument('--no-cache', help="Do not use results of previous runs cached for identical profiles, signatures and options (and do not cache results)", action='store_true')
+        advanced_group.add_argument('--cache-size', help="Size limit of the cache of results in MB, least recently used results are evicted", type=float, default=DECOMPOSITION_CACHE_SIZE / 2 ** 20)
 
         bootstrap_group = parser.add_argument_group('Bootstrap-specific arguments')
         bootstrap_group.add_argument('--bootstrap', "-b", help="Use the bootstrap to calculate confidence intervals", action='store_true')
-        bootstrap_group.add_argument('--bootstrap-replicates', "-br", help="Number of bootstrap replicates", type=int, default=100)
-        bootstrap_group.add_argument('--bootstrap-confidence-level', "-bcl", help="Confidence level", type=int, default=95)
+        bootstrap_group.add_argument('--bootstrap-replicates', "-br", help="Number of bootstrap replicates (maximum number in adaptive mode)", type=int, default=100)
+        bootstrap_group.add_argument('--bootstrap-confidence-level', "-bcl", help="Confidence level (of bootstrap or Fisher information intervals)", type=int, default=95)
+        bootstrap_group.add_argument('--ci-method', help="Method of confidence intervals: bootstrap (with -b) or fisher (observed Fisher information at the fit, no resampling, MLE, AIC, AICc and BIC methods only)", type=str, choices=['bootstrap', 'fisher'], default='bootstrap')
         bootstrap_group.add_argument('--bootstrap-method', "-bm", help="Bootstrap method (t: t-distribution, p: percentile)", type=str, choices=['t', 'p'], default='p')
+        bootstrap_group.add_argument('--bootstrap-adaptive', "-ba", help="Generate replicates in blocks until confidence intervals converge, report the number of replicates used for each sample", action='store_true')
+        bootstrap_group.add_argument('--bootstrap-block', "-bb", help="Number of replicates in a block of adaptive bootstrap", type=int, default=50)
+        bootstrap_group.add_argument('--bootstrap-tolerance', "-bt", help="Adaptive bootstrap stops when confidence bounds of exposures move less than the tolerance after a block", type=float, default=0.005)
         self.parser = parser
 
     def identify(self, args):
-        if not args.infile:
-            logger.warning("Provide input file in VCF or MAF format (-i) and a corresponding genome assembly (-g)")
+        if not args.infile and not args.profiles_store:
+            logger.warning("Provide input file in VCF or MAF format (-i) and a corresponding genome assembly (-g) or a store of profiles (--profiles-store)")
             return
-        if not args.genome:
+        if args.infile and not args.genome:
             logger.warning(genome_error_message)
             return
         if not args.signatures:
@@ -66,10 +98,58 @@ class SignatureMenu(object):
             logger.warning('Unknown method provided')
             return
 
+        if args.solver == 'em' and IDENTIFY_MIN_FUNCTIONS[args.method.lower()] not in EM_FUNCTIONS:
+            logger.warning('EM solver is only available for MLE, AICc and BIC methods')
+            return
+
+        if args.solver == 'fista' and IDENTIFY_MIN_FUNCTIONS[args.method.lower()] not in FISTA_FUNCTIONS:
+            logger.warning('FISTA solver is only available for Frobenius, FrobeniusZero, Cos, KL and JS methods')
+            return
+
+        if args.selection is not None and IDENTIFY_MIN_FUNCTIONS[args.method.lower()] not in SELECTION_FUNCTIONS:
+            logger.warning('Stepwise selection of signatures is only available for AICc and BIC methods')
+            return
+
+        if args.prescreen and (args.selection is not None or args.global_optimization):
+            logger.warning("Pre-screening of signatures can not be combined with stepwise selection and global optimization")
+            return
+
+        if args.prescreen_margin < 0 or args.prescreen_replicates < 0:
+            logger.warning("Pre-screening margin and number of replicates can not be negative")
+            return
+
+        if args.cache_size < 0:
+            logger.warning("Size limit of the cache can not be negative")
+            return
+
+        if args.jobs < 0:
+            logger.warning("Number of parallel processes can not be negative")
+            return
+
+        if args.batch_size < 1:
+            logger.warning("Batch size should be at least 1")
+            return
+
+        if args.global_optimization and args.starts < 1:
+            logger.warning("Number of starts of global optimization should be at least 1")
+            return
+
         if args.bootstrap_replicates < 10:
             logger.warning("Number of bootstrap replicates too low. Specify at least 10 replicates")
             return
 
+        if args.bootstrap_adaptive and args.bootstrap_block < 10:
+            logger.warning("Number of replicates in a block of adaptive bootstrap too low. Specify at least 10 replicates")
+            return
+
+        if args.ci_method == 'fisher' and IDENTIFY_MIN_FUNCTIONS[args.method.lower()] not in EM_FUNCTIONS:
+            logger.warning('Fisher information confidence intervals are only available for MLE, AIC, AICc and BIC methods')
+            return
+
+        if args.ci_method == 'fisher' and args.bootstrap:
+            logger.warning('Fisher information confidence intervals are calculated without the bootstrap, do not use -b with --ci-method fisher')
+            return
+
         if args.bootstrap_confidence_level < 70:
             logger.warning("Specify confidence level of at least 70% and less than 99%")
             return
@@ -82,7 +162,7 @@ class SignatureMenu(object):
                 return
             logger.warning("We will only analyze signatures in this list: {}".format(", ".join(only)))
 
-        if 'input_format' not in args:
+        if 'input_format' not in args and args.infile:
             # guess format from file name
             name = args.infile.name.upper()
             if name.endswith("MAF"):
@@ -93,57 +173,168 @@ class SignatureMenu(object):
                 logger.warning("Input format was not specified. Assuming it is MAF")
                 args.input_format = "MAF"
 
-        W, signature_names = read_signatures(args.signatures, only=only)
+        scheme = get_channel_scheme(args.channels)
+        if args.signatures_file:
+            try:
+                W, signature_names = read_signatures_table(args.signatures_file)
+            except (OSError, ValueError) as e:
+                logger.warning("Signatures file could not be read: {}".format(e))
+                return
+            if only is not None:
+                # named subsets are resolved on names prefixed by the name of the set, as for collections
+                catalog = SignatureSet(W, ["file-" + name for name in signature_names], name="file")
+                only = get_named_subset(catalog, only)
+                keep = [i for i, name in enumerate(signature_names) if name in only]
+                W, signature_names = W[:, keep], [signature_names[i] for i in keep]
+            signature_set = SignatureSet(W, signature_names, name=args.signatures_file)
+        else:
+            signature_set = read_signatures(args.signatures, only=only)
+        # signatures are prepared once and passed as SignatureSet to every fit
+        W, signature_names = signature_set
+
+        if W.shape[0] != scheme.n_channels and not args.profiles_store:
+            logger.warning("Signatures have {} channels, profiles have {} channels (see --channels)".format(W.shape[0], scheme.n_channels))
+            return
+
+        if args.profiles_store:
+            try:
+                samples, profiles = ProfilesStore(args.profiles_store).get_profiles(where=parse_store_criteria(args.store_where))
+            except (OSError, ValueError) as e:
+                logger.warning("Profiles store could not be read: {}".format(e))
+                return
+            logger.info("Loaded profiles of {} samples from the store".format(len(samples)))
+            if profiles.shape[1] != W.shape[0]:
+                logger.warning("Signatures have {} channels, profiles of the store have {} channels".format(W.shape[0], profiles.shape[1]))
+                return
+        else:
+            try:
+                mutations, _, processing_stats = read_mutations(args.input_format, args.infile, args.genome, window_size=1, scheme=scheme)
+            except Exception as e:
+                e_message = getattr(e, 'message', repr(e))
+                logger.warning(
+                    "Parsing {0} failed. "
+                    "Check that the input file is in {0} format "
+                    "or specify a different format using option -f \n"
+                    "{1}".format(args.input_format, e_message))
+
+                if logger.root.level == logging.DEBUG:
+                    raise
+                return
+
+            samples = list(mutations.keys())
+            profiles = get_multisample_mutational_profile(mutations, counts=True, scheme=scheme)
+
+        cache = None
+        if not args.no_cache and not is_cacheable(args.seed, args.global_optimization, args.prescreen, args.prescreen_replicates):
+            logger.info("Results of random starts or pre-screening replicates are not cached without a seed (--seed)")
+        elif not args.no_cache:
+            try:
+                cache = DecompositionCache(max_size=int(args.cache_size * 2 ** 20))
+            except (OSError, sqlite3.Error) as e:
+                logger.warning("Cache of results could not be opened, all samples will be fitted: {}".format(e))
 
+        writer = DecompositionWriter(
+            args.outfile, signature_names,
+            mutations_threshold=args.mutations_threshold,
+            bootstrap_method=args.bootstrap_method,
+            bootstrap_level=args.bootstrap_confidence_level,
+            order=None if args.unordered else samples)
+
+        fit_options = {
+            'enable_dummy': args.no_unexplained_variance,
+            'solver': args.solver,
+            'tol': args.tolerance,
+            'max_iter': args.max_iterations,
+            'jobs': args.jobs,
+            'selection': args.selection,
+            'prescreen': args.prescreen,
+            'prescreen_margin': args.prescreen_margin,
+            'prescreen_replicates': args.prescreen_replicates,
+        }
+
+        # samples are fitted in batches, rows of a batch are written as soon as the batch is done
+        batches_metrics = []
         try:
-            mutations, _, processing_stats = read_mutations(args.input_format, args.infile, args.genome, window_size=1)
-        except Exception as e:
-            e_message = getattr(e, 'message', repr(e))
-            logger.warning(
-                "Parsing {0} failed. "
-                "Check that the input file is in {0} format "
-                "or specify a different format using option -f \n"
-                "{1}".format(args.input_format, e_message))
-
-            if logger.root.level == logging.DEBUG:
-                raise
-            return
-
-        samples_profiles = get_multisample_mutational_profile(mutations, counts=True)
-        samples_results = {}
-
-        for sample, profile in samples_profiles.items():
-            _, _, results = decompose_mutational_profile_counts(
-                profile,
-                (W, signature_names),
-                args.method,
-                others_threshold=0.0,
-                enable_dummy=args.no_unexplained_variance)
-            samples_results[sample] = results
+            for start in range(0, len(samples), args.batch_size):
+                batch = samples[start:start + args.batch_size]
+                V = profiles[start:start + args.batch_size]
+                exposures, mutations, metrics = decompose_multisample_mutational_profile_counts(
+                    V,
+                    signature_set,
+                    args.method,
+                    diagnostics=False,
+                    global_optimization=args.global_optimization,
+                    n_starts=args.starts,
+                    random_state=args.seed,
+                    cache=cache,
+                    **fit_options)
+                batches_metrics.append(metrics)
+                self.write_batch(args, writer, signature_set, batch, V, exposures, mutations, metrics, fit_options)
+                logger.debug("Samples done: {} of {}".format(start + len(batch), len(samples)))
+        finally:
+            if cache is not None:
+                cache.close()
+        writer.close()
 
-        if not args.bootstrap:
-            write_decomposition(args.outfile, samples_results, signature_names, mutations_threshold=args.mutations_threshold)
+        if len(samples) > 0:
+            metrics = {name: np.concatenate([m[name] for m in batches_metrics]) for name in batches_metrics[0] if name != 'Unexplained'}
+            if 'Cached' in metrics:
+                logger.info("{} samples taken from cache or identical to other samples".format(np.sum(metrics['Cached'])))
+            logger.info("{} solver iterations per sample: mean {:.1f}, max {}".format(
+                'em' if args.selection else args.solver, np.mean(metrics['Iterations']), np.max(metrics['Iterations'])))
+            if args.selection:
+                logger.info("Stepwise selection subsets fitted per sample: mean {:.1f}, max {}".format(
+                    np.mean(metrics['Fits']), np.max(metrics['Fits'])))
+            elif args.global_optimization:
+                logger.info("Global optimization starts per sample: mean {:.1f}, max {}".format(
+                    np.mean(metrics['Starts']), np.max(metrics['Starts'])))
+            if args.prescreen:
+                logger.info("Signatures pruned by the screen per sample: mean {:.1f}, min {}".format(
+                    np.mean(metrics['Pruned']), np.min(metrics['Pruned'])))
+
+    def write_batch(self, args, writer, signature_set, samples, profiles, exposures, mutations, metrics, fit_options):
+        """ Write results of a batch of samples: point estimates, with Fisher information or bootstrap confidence intervals """
+        signature_names = signature_set.names
+        samples_results = {sample: (exposures[i], mutations[i]) for i, sample in enumerate(samples)}
+        H = np.hstack([exposures, metrics['Unexplained']])
+
+        if args.ci_method == 'fisher':
+            W_fit = signature_set.get_matrix(args.no_unexplained_variance)
+            for i, sample in enumerate(samples):
+                low, high = get_fisher_intervals(profiles[i], H[i], W_fit, args.bootstrap_confidence_level)
+                writer.write_intervals(
+                    sample, samples_results[sample], low[:len(signature_names)], high[:len(signature_names)],
+                    np.ceil(profiles[i].sum()))
+        elif not args.bootstrap:
+            for sample in samples:
+                writer.write(sample, samples_results[sample])
         else:
-            bootstrap_samples_results = {}
-            for sample, profile in samples_profiles.items():
-                bootstrap_results = []
-                for resampled_profile in tqdm(generate_resampled_profiles(profile, args.bootstrap_replicates), total=args.bootstrap_replicates):
-                    _, _, results = decompose_mutational_profile_counts(
-                        resampled_profile,
-                        (W, signature_names),
-                        args.method,
-                        others_threshold=0.0,
-                        enable_dummy=args.no_unexplained_variance)
-                    bootstrap_results.append(results)
-                bootstrap_samples_results[sample] = bootstrap_results
-
-            write_decomposition(
-                args.outfile, samples_results, signature_names,
-                mutations_threshold=args.mutations_threshold,
-                bootstrap_method=args.bootstrap_method,
-                profile=samples_profiles,
-                bootstrap_results=bootstrap_samples_results,
-                bootstrap_level=args.bootstrap_confidence_level)
+            samples_profiles = dict(zip(samples, profiles))
+
+            def write_sample(sample, bootstrap_results, replicates):
+                # each sample is written as soon as its replicates are done, replicates are not kept
+                if args.bootstrap_adaptive:
+                    logger.info("Sample {}: {} bootstrap replicates".format(sample, replicates))
+                writer.write(
+                    sample, samples_results[sample], samples_profiles[sample], bootstrap_results,
+                    replicates if args.bootstrap_adaptive else None)
+
+            # replicates are warm-started from the point estimates of exposures
+            bootstrap_multisample_decomposition(
+                samples_profiles,
+                samples_results,
+                signature_set,
+                args.method,
+                H0={sample: H[i] for i, sample in enumerate(samples)},
+                replicates=args.bootstrap_replicates,
+                method=args.bootstrap_method,
+                level=args.bootstrap_confidence_level,
+                adaptive=args.bootstrap_adaptive,
+                block_size=args.bootstrap_block,
+                ci_tol=args.bootstrap_tolerance,
+                callback=write_sample,
+                batch_size=args.batch_size,
+                **fit_options)
 
     def callback(self, args):
         self.identify(args)
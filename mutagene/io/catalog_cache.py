@@ -0,0 +1,154 @@
+import hashlib
+import json
+import os
+import tempfile
+
+import numpy as np
+
+import logging
+logger = logging.getLogger(__name__)
+
+# increment when the layout of cached files changes
+CACHE_FORMAT_VERSION = 1
+
+
+def get_cache_root():
+    """ Root directory of caches: $MUTAGENE_CACHE_DIR or $XDG_CACHE_HOME/mutagene or ~/.cache/mutagene """
+    root = os.environ.get('MUTAGENE_CACHE_DIR')
+    if not root:
+        root = os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache'), 'mutagene')
+    return root
+
+
+def get_cache_dir():
+    """ Directory for compiled signature catalogs (see get_cache_root) """
+    return os.path.join(get_cache_root(), 'signatures')
+
+
+def _file_hash(fname):
+    h = hashlib.sha1()
+    with open(fname, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _get_source_info(fname, with_hash=True):
+    stat = os.stat(fname)
+    info = {'size': stat.st_size, 'mtime': stat.st_mtime_ns}
+    if with_hash:
+        info['sha1'] = _file_hash(fname)
+    return info
+
+
+def _check_sources(meta, sources):
+    """
+    Check that the cache was compiled from the current source files
+    Files with unchanged size and mtime are trusted, otherwise their hash is compared
+    Returns tuple: whether cache is valid and whether mtimes in meta were updated
+    """
+    cached_sources = meta.get('sources', {})
+    if meta.get('version') != CACHE_FORMAT_VERSION or sorted(cached_sources.keys()) != sorted(sources):
+        return False, False
+
+    updated = False
+    for fname in sources:
+        cached = cached_sources[fname]
+        info = _get_source_info(fname, with_hash=False)
+        if info['size'] != cached['size']:
+            return False, False
+        if info['mtime'] != cached['mtime']:
+            if _file_hash(fname) != cached['sha1']:
+                return False, False
+            # file was touched or copied, but its content is the same
+            cached['mtime'] = info['mtime']
+            updated = True
+    return True, updated
+
+
+def _write_atomic(fname, write):
+    fd, tmp_fname = tempfile.mkstemp(dir=os.path.dirname(fname), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            write(f)
+        os.replace(tmp_fname, fname)
+    except BaseException:
+        os.unlink(tmp_fname)
+        raise
+
+
+def read_cached_catalog(name, sources, reader, cache_dir=None):
+    """
+    Read signature catalog compiled to a binary matrix (.npy) and its metadata (.json) in the cache directory
+    The matrix is memory-mapped read-only
+
+    name = name of the catalog used as cache file name
+    sources = list of source files of the catalog, the cache is rebuilt when any of them changes
+    reader = function without arguments that parses the source files: returns tuple of W matrix and list of names
+
+    Returns tuple: 96 channels x K signatures matrix and list of K signature names
+    """
+    cache_dir = cache_dir or get_cache_dir()
+    matrix_fname = os.path.join(cache_dir, name + ".npy")
+    meta_fname = os.path.join(cache_dir, name + ".json")
+    sources = [os.path.realpath(fname) for fname in sources]
+
+    try:
+        with open(meta_fname) as f:
+            meta = json.load(f)
+        valid, updated = _check_sources(meta, sources)
+        if valid:
+            W = np.load(matrix_fname, mmap_mode='r')
+            if updated:
+                _write_atomic(meta_fname, lambda f: f.write(json.dumps(meta).encode()))
+            return W, meta['names']
+    except (OSError, ValueError, KeyError) as e:
+        logger.debug("Signature catalog {} not found in cache: {}".format(name, e))
+
+    W, names = reader()
+    W = np.ascontiguousarray(W, dtype=float)
+
+    meta = {
+        'version': CACHE_FORMAT_VERSION,
+        'names': list(names),
+        'sources': {fname: _get_source_info(fname) for fname in sources},
+    }
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        # matrix is written first: metadata matching the sources always refers to a complete matrix
+        _write_atomic(matrix_fname, lambda f: np.save(f, W))
+        _write_atomic(meta_fname, lambda f: f.write(json.dumps(meta).encode()))
+    except OSError as e:
+        logger.debug("Could not write signature catalog {} to cache: {}".format(name, e))
+    return W, names
+
+
+def read_cached_derived(name, key, W, compute, cache_dir=None):
+    """
+    Read array derived from signature catalog W (e.g. similarity of signatures) cached alongside the catalog
+    as name.key.npy, the array is recomputed when the catalog matrix changes
+
+    compute = function of W returning the array
+    """
+    cache_dir = cache_dir or get_cache_dir()
+    array_fname = os.path.join(cache_dir, "{}.{}.npy".format(name, key))
+    meta_fname = os.path.join(cache_dir, "{}.{}.json".format(name, key))
+    matrix_hash = hashlib.sha1(np.ascontiguousarray(W, dtype=float).tobytes()).hexdigest()
+
+    try:
+        with open(meta_fname) as f:
+            meta = json.load(f)
+        if meta.get('version') == CACHE_FORMAT_VERSION and meta.get('matrix') == matrix_hash:
+            return np.load(array_fname, mmap_mode='r')
+    except (OSError, ValueError) as e:
+        logger.debug("{} of signature catalog {} not found in cache: {}".format(key, name, e))
+
+    a = np.ascontiguousarray(compute(W))
+    meta = {'version': CACHE_FORMAT_VERSION, 'matrix': matrix_hash}
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        _write_atomic(array_fname, lambda f: np.save(f, a))
+        _write_atomic(meta_fname, lambda f: f.write(json.dumps(meta).encode()))
+    except OSError as e:
+        logger.debug("Could not write {} of signature catalog {} to cache: {}".format(key, name, e))
+    return a
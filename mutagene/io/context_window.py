@@ -7,7 +7,10 @@ from tqdm import tqdm
 from collections import defaultdict
 from itertools import cycle
 
+import numpy as np
+
 from mutagene.dna import chromosome_name_mapping
+from mutagene.profiles.channels import CODE_DTYPE, INVALID_CHANNEL, get_channel_scheme
 from mutagene.motifs import nucleotides, complementary_nucleotide
 
 import logging
@@ -71,8 +74,8 @@ def get_context_twobit_window(mutations, twobit_file, window_size):
 
         if nuc != 'N' and nuc != x:
             if cn[nuc] == x:
-                nuc3 = cn[nuc5]
-                nuc5 = cn[nuc3]
+                # flanks of the complementary strand: reverse complement
+                nuc5, nuc3 = cn[nuc3], cn[nuc5]
                 # print('debug: complementary REF sequence detected')
             else:
                 # print("{}:{}  {}>{}   {}[{}]{}".format(chromosome, pos, x, y, nuc5, nuc, nuc3))
@@ -84,7 +87,80 @@ def get_context_twobit_window(mutations, twobit_file, window_size):
     return contexts
 
 
-def read_TCGI_with_context_window(infile, asm, window_size):
+def get_window_size(window_size, scheme=None):
+    """ Context window wide enough for flanks of channels of the scheme (see mutagene.profiles.channels) """
+    if window_size is None:
+        return None
+    return max(window_size, get_channel_scheme(scheme).flank)
+
+
+def get_mutation_context(k, x, y, seq_with_coords):
+    """
+    Flanks of k nucleotides and alleles of a mutation on the forward strand of the genome, taken from its context window
+    (the same for every width of flanks): mutations with reference allele given on the complementary strand
+    are complemented, flanks are N if the reference allele does not match the genome
+    Returns tuple: 5' flank, 3' flank, reference and alternative nucleotide
+    """
+    w = len(seq_with_coords) // 2
+    if w < k:
+        return "N" * k, "N" * k, x, y
+    seq = "".join(nucleotide for _, _, nucleotide, _ in seq_with_coords[w - k:w + k + 1])
+    if seq[k] == "N" or seq[k] == x:
+        return seq[:k], seq[k + 1:], x, y
+    cn = complementary_nucleotide
+    if seq[k] == cn.get(x):
+        # reference allele is given on the complementary strand
+        return seq[:k], seq[k + 1:], cn[x], cn.get(y, "N")
+    return "N" * k, "N" * k, x, y
+
+
+def encode_samples_mutations(raw_mutations, asm, window_size, scheme=None):
+    """
+    Channel codes of mutations of samples (dictionary keyed by sample of lists of chrom, pos, transcript_strand, x, y)
+    in channels of the scheme (see mutagene.profiles.channels), contexts are read from assembly asm and
+    mutations of all samples are encoded at once (see ChannelScheme.encode_array)
+
+    Returns tuple: dictionary of arrays of channel codes of valid mutations of each sample, dictionary of lists of
+    valid mutations with context windows and number of mutations with unknown nucleotides; None if there are no contexts
+    """
+    scheme = get_channel_scheme(scheme)
+    samples = []
+    records = []
+    p5s, p3s, xs, ys, strands = [], [], [], [], []
+    for sample, sample_mutations in raw_mutations.items():
+        if len(sample_mutations) == 0:
+            continue
+        contexts = get_context_twobit_window(sample_mutations, asm, get_window_size(window_size, scheme))
+        if contexts is None or len(contexts) == 0:
+            return None
+
+        for (chrom, pos, transcript_strand, x, y) in sample_mutations:
+            _, seq_with_coords = contexts.get((chrom, pos), (("N", "N"), []))
+            p5, p3, ref, alt = get_mutation_context(scheme.flank, x, y, seq_with_coords)
+            samples.append(sample)
+            records.append((chrom, pos, transcript_strand, x, y, seq_with_coords))
+            p5s.append(p5)
+            p3s.append(p3)
+            xs.append(ref)
+            ys.append(alt)
+            strands.append(transcript_strand)
+
+    # channel codes of mutations on either strand, invalid for unknown nucleotides
+    codes = scheme.encode_array(p5s, p3s, xs, ys, strands)
+    valid = codes != INVALID_CHANNEL
+
+    mutations = defaultdict(list)
+    mutations_with_context = defaultdict(list)
+    for sample, code, record, ok in zip(samples, codes, records, valid):
+        if ok:
+            mutations[sample].append(code)
+            mutations_with_context[sample].append(record)
+    # arrays of channel codes of mutations of each sample (see mutagene.profiles.channels)
+    mutations = {sample: np.array(sample_codes, dtype=CODE_DTYPE) for sample, sample_codes in mutations.items()}
+    return mutations, mutations_with_context, int(np.sum(~valid))
+
+
+def read_TCGI_with_context_window(infile, asm, window_size, scheme=None):
     """
     Tabular file; no particular column order required but must contain header line with four mandatory column names:
     (CHR, POS, REF, ALT) corresponding to the chromosome, position, reference and alternate allele columns, respectively
@@ -101,8 +177,7 @@ def read_TCGI_with_context_window(infile, asm, window_size):
 
     returns mutations, mutations_with_context, processing_stats
     """
-    cn = complementary_nucleotide
-    mutations = defaultdict(lambda: defaultdict(float))
+    mutations = defaultdict(list)
     N_skipped = 0
 
     processing_stats = {'loaded': 0, 'skipped': 0, 'nsamples': 0, 'format': 'unknown'}
@@ -163,33 +238,12 @@ def read_TCGI_with_context_window(infile, asm, window_size):
         transcript_strand = '+'
         raw_mutations[sample].append((chrom, pos, transcript_strand, x, y))
 
-    mutations_with_context = defaultdict(list)
-
-    for sample, sample_mutations in raw_mutations.items():
-        if len(sample_mutations) > 0:
-            contexts = get_context_twobit_window(sample_mutations, asm, window_size)
-
-            if contexts is None or len(contexts) == 0:
-                return None, None
-
-            for (chrom, pos, transcript_strand, x, y) in sample_mutations:
-                (p5, p3), seq_with_coords = contexts.get((chrom, pos), (("N", "N"), []))
-
-                if len(set([p5, x, y, p3]) - set(nucleotides)) > 0:
-                    # print("Skipping invalid nucleotides")
-                    N_skipped += 1
-                    continue
-
-                if x in "CT":
-                    mutations[sample][p5 + p3 + x + y] += 1.0
-                else:
-                    # complementary mutation
-                    mutations[sample][cn[p3] + cn[p5] + cn[x] + cn[y]] += 1.0
-                mutations_with_context[sample].append((chrom, pos, transcript_strand, x, y, seq_with_coords))
-
-    N_loaded = 0
-    for sample, sample_mutations in mutations.items():
-        N_loaded += int(sum(sample_mutations.values()))
+    samples_mutations = encode_samples_mutations(raw_mutations, asm, window_size, scheme)
+    if samples_mutations is None:
+        return None, None
+    mutations, mutations_with_context, skipped = samples_mutations
+    N_skipped += skipped
+    N_loaded = sum(len(codes) for codes in mutations.values())
 
     processing_stats = {
         'loaded': N_loaded,
@@ -201,20 +255,22 @@ def read_TCGI_with_context_window(infile, asm, window_size):
 
 
 def read_mutations(file_format, *args, **kwargs):
-    """ Wrapper for read_X_with_context_window """
+    """
+    Wrapper for read_X_with_context_window
+    Mutations are encoded as channel codes of scheme (keyword argument, see mutagene.profiles.channels), 96 channels by default
+    """
     function_name = "read_{}_with_context_window".format(file_format)
     return globals()[function_name](*args, **kwargs)
 
 
-def read_MAF_with_context_window(infile, asm, window_size):
+def read_MAF_with_context_window(infile, asm, window_size, scheme=None):
     """
         Read MAF file and extract context of mutations for assembly asm and window +/- window_size around each mutation
         MAF format description: https://docs.gdc.cancer.gov/Data/File_Formats/MAF_Format/
 
         returns mutations, mutations_with_context, processing_stats
     """
-    cn = complementary_nucleotide
-    mutations = defaultdict(lambda: defaultdict(float))
+    mutations = defaultdict(list)
     N_skipped = 0
 
     processing_stats = {'loaded': 0, 'skipped': 0, 'nsamples': 0, 'format': 'unknown'}
@@ -305,33 +361,12 @@ def read_MAF_with_context_window(infile, asm, window_size):
 
         raw_mutations[sample].append((chrom, pos, transcript_strand, x, y))
 
-    mutations_with_context = defaultdict(list)
-
-    for sample, sample_mutations in raw_mutations.items():
-        if len(sample_mutations) > 0:
-            contexts = get_context_twobit_window(sample_mutations, asm, window_size)
-
-            if contexts is None or len(contexts) == 0:
-                return None, None
-
-            for (chrom, pos, transcript_strand, x, y) in sample_mutations:
-                (p5, p3), seq_with_coords = contexts.get((chrom, pos), (("N", "N"), []))
-
-                if len(set([p5, x, y, p3]) - set(nucleotides)) > 0:
-                    # print("Skipping invalid nucleotides")
-                    N_skipped += 1
-                    continue
-
-                if x in "CT":
-                    mutations[sample][p5 + p3 + x + y] += 1.0
-                else:
-                    # complementary mutation
-                    mutations[sample][cn[p3] + cn[p5] + cn[x] + cn[y]] += 1.0
-                mutations_with_context[sample].append((chrom, pos, transcript_strand, x, y, seq_with_coords))
-
-    N_loaded = 0
-    for sample, sample_mutations in mutations.items():
-        N_loaded += int(sum(sample_mutations.values()))
+    samples_mutations = encode_samples_mutations(raw_mutations, asm, window_size, scheme)
+    if samples_mutations is None:
+        return None, None
+    mutations, mutations_with_context, skipped = samples_mutations
+    N_skipped += skipped
+    N_loaded = sum(len(codes) for codes in mutations.values())
 
     processing_stats = {
         'loaded': N_loaded,
@@ -343,14 +378,11 @@ def read_MAF_with_context_window(infile, asm, window_size):
     return mutations, mutations_with_context, processing_stats
 
 
-def read_VCF_with_context_window(infile, asm, window_size):
+def read_VCF_with_context_window(infile, asm, window_size, scheme=None):
     """
     Read VCF file and extract context of mutations for assembly asm and window +/- window_size around each mutation
     returns mutations, mutations_with_context, processing_stats
     """
-    cn = complementary_nucleotide
-    mutations = defaultdict(lambda: defaultdict(float))
-    mutations_with_context = defaultdict(list)
     raw_mutations = defaultdict(list)
 
     N_skipped = 0
@@ -394,33 +426,12 @@ def read_VCF_with_context_window(infile, asm, window_size):
     # print("RAW", raw_mutations)
     # print("INDELS", N_skipped)
 
-    for sample, sample_mutations in raw_mutations.items():
-        if len(sample_mutations) > 0:
-            contexts = get_context_twobit_window(sample_mutations, asm, window_size)
-            if contexts is None or len(contexts) == 0:
-                return None, None
-
-            for (chrom, pos, transcript_strand, x, y) in sample_mutations:
-                (p5, p3), seq_with_coords = contexts.get((chrom, pos), (("N", "N"), []))
-                # print("RESULT: {} {}".format(p5, p3))
-
-                if len(set([p5, x, y, p3]) - set(nucleotides)) > 0:
-                    # print(chrom, pos, p5, p3, x)
-                    # print("Skipping invalid nucleotides")
-                    N_skipped += 1
-                    continue
-
-                if x in "CT":
-                    mutations[sample][p5 + p3 + x + y] += 1.0
-                else:
-                    # complementary mutation
-                    mutations[sample][cn[p3] + cn[p5] + cn[x] + cn[y]] += 1.0
-
-                mutations_with_context[sample].append((chrom, pos, transcript_strand, x, y, seq_with_coords))
-
-    N_loaded = 0
-    for sample, sample_mutations in mutations.items():
-        N_loaded += int(sum(sample_mutations.values()))
+    samples_mutations = encode_samples_mutations(raw_mutations, asm, window_size, scheme)
+    if samples_mutations is None:
+        return None, None
+    mutations, mutations_with_context, skipped = samples_mutations
+    N_skipped += skipped
+    N_loaded = sum(len(codes) for codes in mutations.values())
 
     nsamples = len(mutations.keys())
     processing_stats = {
@@ -4,41 +4,45 @@ from scipy import stats
 from collections import defaultdict
 import pandas as pd
 
+from mutagene.signatures.results import DecompositionResult
 
-def _get_stats(results):
-    """
-        Convert dictionary decomposition results into a pandas dataframe compatible with bootstrap stats results
+
+def _get_exposure_mutations(results, signature_ids=None):
     """
-    if type(results) is np.ndarray:
-        h = results
-    else:
-        exposure_dict = {x['name']: x['score'] for x in results if x['mutations'] != ''}
-        mutations_dict = {x['name']: x['mutations'] for x in results if x['mutations'] != ''}
-        signatures = list(exposure_dict.keys())
+        Exposures and mutations from decomposition results as dictionaries keyed by signature name
 
-        exposure = [exposure_dict[name] for name in signatures]
-        mutations = [mutations_dict[name] for name in signatures]
+        results are either DecompositionResult (as returned by decompose_mutational_profile_counts),
+        a tuple of exposures and mutations arrays ordered as signature_ids or a list of dictionaries (one per signature)
+    """
+    if isinstance(results, DecompositionResult):
+        return results.exposure_dict(), results.mutations_dict()
 
-        h = np.array(exposure)
-        m = np.array(mutations, np.int)
+    if isinstance(results, tuple):
+        h, m = results
+        return dict(zip(signature_ids, h)), dict(zip(signature_ids, m))
 
-    df = pd.DataFrame(
-        dict(
-            zip(
-                "signature\texposure\tmutations".split(),
-                [signatures, h, m])))
-    return df.sort_values(by=["mutations", "exposure"], ascending=False)
+    exposure_dict = {x['name']: x['score'] for x in results if x['mutations'] != ''}
+    mutations_dict = {x['name']: x['mutations'] for x in results if x['mutations'] != ''}
+    return exposure_dict, mutations_dict
 
 
-def _get_bootstrap_stats_percentile(bootstrap_results, level):
+def _get_bootstrap_exposure_mutations(bootstrap_results, signature_ids=None):
     """
-        level is converted to percentile: level 90 means an interval 9% - 95%
+        Exposures and mutations of bootstrap replicates as replicates x signatures arrays
 
-        Quantile-based bootstrap intervals
-        Returns pandas data frame - each row is a signature, zeros not removed
+        bootstrap_results are either a tuple of replicates x signatures exposures and mutations arrays
+        ordered as signature_ids, or a list of results of decompose_mutational_profile_counts (one per replicate)
+        Returns tuple: list of signature names, exposures and mutations arrays
     """
-    ci_high = (100.0 + level) / 2.0
-    ci_low = (100.0 - level) / 2.0
+    if isinstance(bootstrap_results, tuple):
+        h, m = bootstrap_results
+        return list(signature_ids), np.atleast_2d(h), np.atleast_2d(m)
+
+    if len(bootstrap_results) > 0 and all(isinstance(results, DecompositionResult) for results in bootstrap_results):
+        signatures = bootstrap_results[0].names
+        exposures = np.vstack([results.exposures for results in bootstrap_results])
+        mutations = np.vstack([results.mutations for results in bootstrap_results])
+        return signatures, exposures, mutations
 
     exposures_lists = defaultdict(list)
     mutations_lists = defaultdict(list)
@@ -52,134 +56,359 @@ def _get_bootstrap_stats_percentile(bootstrap_results, level):
                 signatures |= set([x['name'], ])
     signatures = list(signatures)
 
-    # h: exposures, float [0..1]
     exposures = np.array([exposures_lists[name] for name in signatures]).T
+    mutations = np.array([mutations_lists[name] for name in signatures]).T
+    return signatures, exposures, mutations
 
-    h = np.percentile(exposures, 50.0, axis=0)  # median
-    h_ci_low = np.percentile(exposures, ci_low, axis=0)
-    h_ci_high = np.percentile(exposures, ci_high, axis=0)
 
-    # m: mutations, integer [0, 1, 2...]
-    mutations = np.array([mutations_lists[name] for name in signatures]).T
-    m = np.round(np.percentile(mutations, 50.0, axis=0))
-    m_ci_low = np.round(np.percentile(mutations, ci_low, axis=0))
-    m_ci_high = np.round(np.percentile(mutations, ci_high, axis=0))
+def _get_stats(results, signature_ids=None):
+    """
+        Convert decomposition results into a pandas dataframe compatible with bootstrap stats results
+    """
+    exposure_dict, mutations_dict = _get_exposure_mutations(results, signature_ids)
+    signatures = list(exposure_dict.keys())
+
+    exposure = [exposure_dict[name] for name in signatures]
+    mutations = [mutations_dict[name] for name in signatures]
+
+    h = np.array(exposure)
+    m = np.array(mutations, int)
 
     df = pd.DataFrame(
         dict(
             zip(
-                "signature\texposure\tmutations\texposure_low\texposure_high\tmutations_low\tmutations_high".split(),
-                [signatures, h, m, h_ci_low, h_ci_high, m_ci_low, m_ci_high])))
+                "signature\texposure\tmutations".split(),
+                [signatures, h, m])))
     return df.sort_values(by=["mutations", "exposure"], ascending=False)
 
 
-def _get_bootstrap_stats_t(sample_results, bootstrap_results, n, level):
-    """
-        Calculate approximate bias-corrected t-based confidence intervals for a list of samples using Manly (2007) method.
+BOOTSTRAP_COLUMNS = "signature\texposure\tmutations\texposure_low\texposure_high\tmutations_low\tmutations_high".split()
 
-        n is the number of mutations
 
-        t-based confidence intervals for given confidence level will be based on t distribution with n-1 degrees of freedom
+def _sort_stats(df, method):
+    """ Rows of a sample sorted by mutations and exposure (by exposure for t-based intervals), ties keep signature order """
+    if method == 't':
+        return df.sort_values(by="exposure", ascending=False, kind='mergesort')
+    return df.sort_values(by=["mutations", "exposure"], ascending=False)
 
-        bias-corrected means are calculated as 2 * theta - mean(bootstrap_theta), where:
-            - theta is exposure calculated without the bootstrap
-            - mean(bootstrap_theta) is expected value of exposure in bootstrap samples
 
-        Returns pandas data frame - each row is a signature, zeros not removed
+def _get_bootstrap_arrays(bootstrap_exposures, bootstrap_mutations, method, level, exposures=None, mutations=None, n=None):
     """
-    ci_level = (1.0 + level / 100.0) / 2.0
+        Bootstrap estimates and confidence intervals computed in one pass over replicates
+        bootstrap_exposures, bootstrap_mutations = replicates x signatures arrays of a sample
+            or samples x replicates x signatures arrays of a cohort
+        exposures, mutations = point estimates (signatures or samples x signatures arrays)
+            and n = number of mutations of the sample(s), required for t-based intervals (see _get_bootstrap_stats_t)
+
+        Returns list of arrays (signatures or samples x signatures): exposure, mutations,
+        exposure_low, exposure_high, mutations_low, mutations_high
+    """
+    if method == 'p':
+        # level is converted to percentile: level 90 means an interval 5% - 95%
+        q = [50.0, (100.0 - level) / 2.0, (100.0 + level) / 2.0]
 
-    # ppf: Percent point function (inverse of cdf — percentiles) of t-distribution with (n-1) d.f.
-    t = stats.t.ppf(ci_level, n - 1)
+        # h: exposures, float [0..1]; median and bounds
+        h, h_ci_low, h_ci_high = np.percentile(bootstrap_exposures, q, axis=-2)
 
-    exposure = defaultdict(float)
-    mutations = defaultdict(float)
-    exposures_lists = defaultdict(list)
-    mutations_lists = defaultdict(list)
-    signatures = set()
+        # m: mutations, integer [0, 1, 2...]
+        m, m_ci_low, m_ci_high = np.round(np.percentile(bootstrap_mutations, q, axis=-2))
+        return [h, m, h_ci_low, h_ci_high, m_ci_low, m_ci_high]
 
-    for x in sample_results:
-        if x['mutations'] != '' and x['score'] != '':
-            exposure[x['name']] = x['score']
-            mutations[x['name']] = x['mutations']
+    ci_level = (1.0 + level / 100.0) / 2.0
 
-    for results in bootstrap_results:
-        for x in results:
-            if x['mutations'] != '' and x['score'] != '':
-                exposures_lists[x['name']].append(x['score'])
-                mutations_lists[x['name']].append(x['mutations'])
-                signatures |= set([x['name'], ])
-    signatures = list(signatures)
+    # ppf: Percent point function (inverse of cdf — percentiles) of t-distribution with (n-1) d.f.
+    t = stats.t.ppf(ci_level, np.asarray(n) - 1)[..., np.newaxis]
 
     # h: exposures, float [0..1]
-    h = np.array([2 * exposure[name] - np.nanmean(exposures_lists[name]) for name in signatures])
-    h_sem = np.array([stats.sem(exposures_lists[name]) for name in signatures])
+    h = 2 * exposures - np.nanmean(bootstrap_exposures, axis=-2)
+    h_sem = stats.sem(bootstrap_exposures, axis=-2)
     h_ci_low = np.clip(h - t * h_sem, a_min=0.0, a_max=None)
     h_ci_high = np.clip(h + t * h_sem, a_min=None, a_max=1.0)
     h = np.clip(h, a_min=0.0, a_max=None)
 
     # m: mutations, integer [0, 1, 2...]
-    m = np.array([2 * mutations[name] - np.nanmean(mutations_lists[name]) for name in signatures])
-    m_sem = np.array([stats.sem(mutations_lists[name]) for name in signatures])
+    m = 2 * mutations - np.nanmean(bootstrap_mutations, axis=-2)
+    m_sem = stats.sem(bootstrap_mutations, axis=-2)
     m_ci_low = np.clip(m - t * m_sem, a_min=0, a_max=None)
     m_ci_high = m + t * m_sem
     m = np.clip(m, a_min=0, a_max=None)
+    return [h, m, h_ci_low, h_ci_high, m_ci_low, m_ci_high]
 
-    df = pd.DataFrame(
-        dict(
-            zip(
-                "signature\texposure\tmutations\texposure_low\texposure_high\tmutations_low\tmutations_high".split(),
-                [signatures, h, m, h_ci_low, h_ci_high, m_ci_low, m_ci_high]
-            )))
-    return df.sort_values(by="exposure", ascending=False)
+
+def _get_bootstrap_stats_percentile(bootstrap_results, level, signature_ids=None):
+    """
+        level is converted to percentile: level 90 means an interval 5% - 95%
+
+        Quantile-based bootstrap intervals
+        Returns pandas data frame - each row is a signature, zeros not removed
+    """
+    signatures, exposures, mutations = _get_bootstrap_exposure_mutations(bootstrap_results, signature_ids)
+    columns = _get_bootstrap_arrays(exposures, mutations, 'p', level)
+    df = pd.DataFrame(dict(zip(BOOTSTRAP_COLUMNS, [signatures] + columns)))
+    return _sort_stats(df, 'p')
+
+
+def _get_bootstrap_stats_t(sample_results, bootstrap_results, n, level, signature_ids=None):
+    """
+        Calculate approximate bias-corrected t-based confidence intervals for a list of samples using Manly (2007) method.
+
+        n is the number of mutations
+
+        t-based confidence intervals for given confidence level will be based on t distribution with n-1 degrees of freedom
+
+        bias-corrected means are calculated as 2 * theta - mean(bootstrap_theta), where:
+            - theta is exposure calculated without the bootstrap
+            - mean(bootstrap_theta) is expected value of exposure in bootstrap samples
+
+        Returns pandas data frame - each row is a signature, zeros not removed
+    """
+    exposure, mutations = _get_exposure_mutations(sample_results, signature_ids)
+    signatures, bootstrap_exposures, bootstrap_mutations = _get_bootstrap_exposure_mutations(bootstrap_results, signature_ids)
+
+    columns = _get_bootstrap_arrays(
+        bootstrap_exposures, bootstrap_mutations, 't', level,
+        exposures=np.array([exposure[name] for name in signatures]),
+        mutations=np.array([mutations[name] for name in signatures]), n=n)
+    df = pd.DataFrame(dict(zip(BOOTSTRAP_COLUMNS, [signatures] + columns)))
+    return _sort_stats(df, 't')
+
+
+def get_interval_stats(sample_results, exposures_low, exposures_high, n, signature_ids=None):
+    """
+        Point estimates of a sample with confidence intervals of exposures computed without resampling
+        (e.g. from Fisher information, see mutagene.signatures.fisher), ordered as signature_ids
+        n is the number of mutations, bounds of mutations are bounds of exposures times n
+
+        Returns pandas data frame with the same columns as get_bootstrap_stats - each row is a signature, zeros not removed
+    """
+    exposure, mutations = _get_exposure_mutations(sample_results, signature_ids)
+    h = np.array([exposure[name] for name in signature_ids])
+    m = np.array([mutations[name] for name in signature_ids])
+    columns = [h, m, exposures_low, exposures_high, np.round(n * exposures_low), np.round(n * exposures_high)]
+    df = pd.DataFrame(dict(zip(BOOTSTRAP_COLUMNS, [list(signature_ids)] + columns)))
+    return _sort_stats(df, 'p')
+
+
+def get_cohort_bootstrap_stats(
+    samples, exposures, mutations, bootstrap_exposures, bootstrap_mutations, profiles, method, level, signature_ids
+):
+    """
+        Bootstrap estimates and confidence intervals of exposures and mutations for a cohort in one vectorized pass
+        exposures, mutations = samples x signatures arrays of point estimates ordered as samples and signature_ids
+        bootstrap_exposures, bootstrap_mutations = samples x replicates x signatures arrays
+        profiles = samples x channels array of mutational profiles (mutation counts)
+
+        Returns pandas data frame with rows of each sample as in get_bootstrap_stats, preceded by column 'sample'
+    """
+    if method not in ('t', 'p'):
+        raise ValueError("Incorrect bootstrap_method value, only 't' or 'p' are recognized")
+
+    n = np.sum(profiles, axis=1).astype(int)
+    if method == 't':
+        assert np.all(n > 1)
+    columns = _get_bootstrap_arrays(
+        np.asarray(bootstrap_exposures), np.asarray(bootstrap_mutations), method, level,
+        exposures=np.asarray(exposures, dtype=float), mutations=np.asarray(mutations, dtype=float), n=n)
+
+    # rows of each sample sorted as in _sort_stats
+    h, m = columns[0], columns[1]
+    sample_index = np.repeat(np.arange(len(samples)), h.shape[1])
+    if method == 't':
+        order = np.lexsort((-h.ravel(), sample_index))
+    else:
+        order = np.lexsort((-h.ravel(), -m.ravel(), sample_index))
+
+    df = pd.DataFrame(dict(zip(
+        ['sample'] + BOOTSTRAP_COLUMNS,
+        [np.asarray(samples, dtype=object)[sample_index], np.tile(np.asarray(signature_ids, dtype=object), len(samples))] +
+        [column.ravel() for column in columns])))
+    return df.iloc[order]
+
+
+def get_bootstrap_stats(sample_results, bootstrap_results, profile, method, level, signature_ids=None):
+    """
+        Bootstrap estimates and confidence intervals of exposures and mutations for a single sample
+        method is 't' (t-distribution-based) or 'p' (percentile-based confidence intervals)
+        profile is the mutational profile of the sample (mutation counts)
+
+        Returns pandas data frame - each row is a signature, zeros not removed
+    """
+    if method == 't':
+        # t-distribution-based confidence intervals
+        n = int(np.sum(profile))
+        assert n > 1
+        return _get_bootstrap_stats_t(sample_results, bootstrap_results, n, level, signature_ids)
+    elif method == 'p':
+        # percentile-based confidence intervals
+        return _get_bootstrap_stats_percentile(bootstrap_results, level, signature_ids)
+    else:
+        raise ValueError("Incorrect bootstrap_method value, only 't' or 'p' are recognized")
+
+
+class DecompositionWriter(object):
+    """
+        Incremental writer of decomposition results: rows of each sample are written (and flushed)
+        as soon as the sample is done, instead of collecting results of the whole cohort first
+
+        fname is a file name (opened on the first write) or a file handle
+        bootstrap_method and bootstrap_level are used for samples written with bootstrap results (see get_bootstrap_stats)
+        order is an optional list of samples: samples written out of order are held back until all preceding
+        samples are written, so that output follows the order of the list
+
+        Use as a context manager or call close() when done
+    """
+
+    def __init__(
+        self, fname, signature_ids, mutations_threshold=0,
+        bootstrap_method=None, bootstrap_level=None, order=None, flush=True
+    ):
+        self.fname = fname
+        self.signature_ids = signature_ids
+        self.mutations_threshold = mutations_threshold
+        self.bootstrap_method = bootstrap_method
+        self.bootstrap_level = bootstrap_level
+        self.flush = flush
+        self.order = None if order is None else list(order)
+        self.pending = {}
+        self.handle = None
+        self.header = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def get_sample_stats(self, sample, sample_results, profile=None, bootstrap_results=None, replicates=None):
+        """ Pandas data frame with rows of a sample, filtered by the mutations threshold """
+        if bootstrap_results is not None and self.bootstrap_level is not None and profile is not None:
+            df = get_bootstrap_stats(
+                sample_results, bootstrap_results, profile,
+                self.bootstrap_method, self.bootstrap_level, self.signature_ids)
+            if replicates is not None:
+                df['replicates'] = replicates
+        else:
+            df = _get_stats(sample_results, self.signature_ids)
+        df.insert(0, 'sample', sample)
+        return self._filter(df)
+
+    def _filter(self, df):
+        # filter mutations (converted to int) by threshold
+        df = df[df['mutations'].values.astype('int32') > self.mutations_threshold].copy()
+
+        # convert mutations to int
+        for column in ('mutations', 'mutations_low', 'mutations_high'):
+            if column in df:
+                df[column] = df[column].values.astype('int32')
+        return df
+
+    def write(self, sample, sample_results, profile=None, bootstrap_results=None, replicates=None):
+        """
+            Write rows of a sample: sample_results are the point estimates (tuple of exposures and mutations arrays
+            ordered as signature_ids or a list of decomposition results), profile and bootstrap_results (tuple of
+            replicates x signatures arrays) are required for bootstrap estimates and confidence intervals,
+            replicates is the optional number of bootstrap replicates reported in the column 'replicates'
+        """
+        self._queue(sample, self.get_sample_stats(sample, sample_results, profile, bootstrap_results, replicates))
+
+    def _queue(self, sample, df):
+        """ Write rows of a sample now or, if samples are ordered, once all preceding samples are written """
+        if self.order is None:
+            self._write(df)
+            return
+
+        self.pending[sample] = df
+        while len(self.order) > 0 and self.order[0] in self.pending:
+            self._write(self.pending.pop(self.order.pop(0)))
+
+    def write_intervals(self, sample, sample_results, exposures_low, exposures_high, n):
+        """ Write rows of a sample with confidence intervals computed without resampling (see get_interval_stats) """
+        df = get_interval_stats(sample_results, exposures_low, exposures_high, n, self.signature_ids)
+        df.insert(0, 'sample', sample)
+        self._queue(sample, self._filter(df))
+
+    def write_cohort(self, samples, exposures, mutations, profiles, bootstrap_exposures, bootstrap_mutations, replicates=None):
+        """
+            Write rows of samples with the same number of bootstrap replicates, statistics of all samples
+            are computed at once (see get_cohort_bootstrap_stats for the arrays)
+            replicates is an optional dictionary with the number of replicates of each sample (column 'replicates')
+        """
+        df = get_cohort_bootstrap_stats(
+            samples, exposures, mutations, bootstrap_exposures, bootstrap_mutations, profiles,
+            self.bootstrap_method, self.bootstrap_level, self.signature_ids)
+        if replicates is not None:
+            df['replicates'] = df['sample'].map(replicates)
+        if self.order is None:
+            self._write(self._filter(df))
+            return
+
+        # rows of each sample are contiguous
+        K = len(self.signature_ids)
+        for i, sample in enumerate(samples):
+            self._queue(sample, self._filter(df.iloc[i * K: (i + 1) * K]))
+
+    def _write(self, df):
+        if self.handle is None:
+            self.handle = open(self.fname, 'w') if isinstance(self.fname, str) else self.fname
+        df.to_csv(self.handle, sep="\t", index=False, header=self.header, float_format='%g')
+        self.header = False
+        if self.flush:
+            self.handle.flush()
+
+    def close(self):
+        """ Write samples held back by ordering (samples never written are skipped) and close the file """
+        for sample in list(self.order or []):
+            if sample in self.pending:
+                self._write(self.pending.pop(sample))
+        self.order = None
+        if self.handle is not None and isinstance(self.fname, str):
+            self.handle.close()
+        self.handle = None
 
 
 def write_decomposition(
     fname, samples_results, signature_ids, mutations_threshold=0,
     bootstrap_method=None, profile=None,
-    bootstrap_results=None, bootstrap_level=None
+    bootstrap_results=None, bootstrap_level=None, bootstrap_replicates=None
 ):
     """
         Process sample results for the input data and (optionally) bootstrapped data
         and save a resulting table with or without the optional bootstrap columns
-    """
-    bootstrap = bootstrap_results is not None and bootstrap_level is not None and profile is not None
 
-    # print("Bootstrap", bootstrap)
-    dfs = []
-    for sample in samples_results.keys():
-        if bootstrap:
-            if bootstrap_method == 't':
-                # t-distribution-based confidence intervals
-                p = profile[sample]
-                n = int(np.sum(p))
-                assert n > 1
-                df_sample = _get_bootstrap_stats_t(samples_results[sample], bootstrap_results[sample], n, bootstrap_level)
-            elif bootstrap_method == 'p':
-                # percentile-based confidence intervals
-                df_sample = _get_bootstrap_stats_percentile(bootstrap_results[sample], bootstrap_level)
-            else:
-                raise ValueError("Incorrect bootstrap_method value, only 't' or 'p' are recognized")
-        else:
-            df_sample = _get_stats(samples_results[sample])
-        df_sample.insert(0, 'sample', sample)
-        dfs.append(df_sample)
+        samples_results and bootstrap_results are dictionaries keyed by sample,
+        values are tuples of exposures and mutations arrays ordered as signature_ids
+        (replicates x signatures arrays for bootstrap_results) or lists of decomposition results
 
-    # join results for multiple samples
-    if len(dfs) == 0:
-        return
-    df = pd.concat(dfs)
+        bootstrap_results can also be a tuple of samples x replicates x signatures exposures and mutations arrays
+        of all samples (ordered as samples_results), statistics are then computed for all samples at once
 
-    # convert mutations to int
-    df = df.astype({'mutations': 'int32'})
-    if 'mutations_low' in df:
-        df = df.astype({'mutations_high': 'int32', 'mutations_low': 'int32'})
+        bootstrap_replicates is an optional dictionary with the number of bootstrap replicates used for each sample
+        (adaptive bootstrap), reported in the column 'replicates'
 
-    # filter mutations by threshold
-    df = df[df.mutations > mutations_threshold]
+        Samples are written one at a time (see DecompositionWriter)
+    """
+    bootstrap = bootstrap_results is not None and bootstrap_level is not None and profile is not None
 
-    if df is not None:
-        df.to_csv(fname, sep="\t", index=False, float_format='%g')
+    with DecompositionWriter(
+        fname, signature_ids, mutations_threshold=mutations_threshold,
+        bootstrap_method=bootstrap_method, bootstrap_level=bootstrap_level
+    ) as writer:
+        if bootstrap and isinstance(bootstrap_results, tuple):
+            samples = list(samples_results.keys())
+            if len(samples) > 0:
+                exposures, mutations = zip(*[samples_results[sample] for sample in samples])
+                writer.write_cohort(
+                    samples, np.array(exposures), np.array(mutations), np.array([profile[sample] for sample in samples]),
+                    *bootstrap_results, replicates=bootstrap_replicates)
+            return
+
+        for sample in samples_results.keys():
+            if bootstrap:
+                writer.write(
+                    sample, samples_results[sample], profile[sample], bootstrap_results[sample],
+                    None if bootstrap_replicates is None else bootstrap_replicates[sample])
+            else:
+                writer.write(sample, samples_results[sample])
 
 
 def read_decomposition(fname):
@@ -0,0 +1,157 @@
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+import numpy as np
+
+from mutagene.io.catalog_cache import get_cache_root
+
+import logging
+logger = logging.getLogger(__name__)
+
+# increment when decomposition results change for the same inputs, invalidates all cached results
+DECOMPOSITION_CACHE_VERSION = 1
+
+# default size limit of the cache in bytes, least recently used results are evicted above the limit
+DECOMPOSITION_CACHE_SIZE = 256 * 1024 * 1024
+
+# number of keys per query (below the limit of SQLite host parameters)
+_QUERY_SIZE = 500
+
+
+def get_decomposition_cache_file():
+    """ SQLite database of cached decompositions in the cache directory (see get_cache_root) """
+    return os.path.join(get_cache_root(), 'decompositions.sqlite')
+
+
+def get_signatures_hash(W, names):
+    """ Identity of a set of signatures: hash of the signatures matrix and signature names """
+    h = hashlib.sha1(np.ascontiguousarray(W, dtype=float).tobytes())
+    h.update(json.dumps(list(names)).encode())
+    return h.hexdigest()
+
+
+def get_decomposition_keys(V, W, names, options):
+    """
+    Content-addressed keys of decompositions of profiles (rows of V, mutation counts) with signatures W
+    and decomposition options (dictionary of method, solver options etc.)
+    Identical profiles get identical keys
+    """
+    prefix = hashlib.sha1(json.dumps(
+        [DECOMPOSITION_CACHE_VERSION, get_signatures_hash(W, names), options], sort_keys=True, default=str).encode())
+    keys = []
+    for v in np.asarray(V, dtype=float):
+        h = prefix.copy()
+        h.update(np.ascontiguousarray(v).tobytes())
+        keys.append(h.hexdigest())
+    return keys
+
+
+class DecompositionCache(object):
+    """
+    Persistent cache of decomposition results across runs, keyed by get_decomposition_keys
+    Values are exposures (including dummy signatures) and a dictionary of per-sample metrics (Iterations, Fits, ...)
+    The cache is limited to max_size bytes, least recently used results are evicted first
+
+    Use as a context manager or call close() when done
+    """
+
+    def __init__(self, fname=None, max_size=DECOMPOSITION_CACHE_SIZE, timeout=5.0):
+        self.fname = fname or get_decomposition_cache_file()
+        self.max_size = max_size
+        dirname = os.path.dirname(self.fname)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        # seconds to wait for a database locked by another run
+        self.connection = sqlite3.connect(self.fname, timeout=timeout)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS decompositions "
+            "(key TEXT PRIMARY KEY, exposures BLOB, metrics TEXT, size INTEGER, used INTEGER)")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS decompositions_used ON decompositions (used)")
+        self.connection.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def get_keys(self, V, W, names, options):
+        return get_decomposition_keys(V, W, names, options)
+
+    def get(self, keys):
+        """
+        Returns dictionary of cached results (tuples of exposures and metrics) of keys found in the cache
+        Errors of the database (e.g. locked by another run) are logged and treated as cache misses
+        """
+        keys = list(set(keys))
+        results = {}
+        try:
+            for start in range(0, len(keys), _QUERY_SIZE):
+                chunk = keys[start:start + _QUERY_SIZE]
+                rows = self.connection.execute(
+                    "SELECT key, exposures, metrics FROM decompositions WHERE key IN ({})".format(",".join("?" * len(chunk))),
+                    chunk).fetchall()
+                for key, exposures, metrics in rows:
+                    results[key] = np.frombuffer(exposures, dtype=float).copy(), json.loads(metrics)
+        except sqlite3.Error as e:
+            logger.warning("Cached results could not be read from {}, samples will be fitted: {}".format(self.fname, e))
+            return {}
+
+        if len(results) > 0:
+            used = time.time_ns()
+            try:
+                self.connection.executemany(
+                    "UPDATE decompositions SET used = ? WHERE key = ?", [(used, key) for key in results])
+                self.connection.commit()
+            except sqlite3.Error as e:
+                # results are still valid, only their eviction order is not updated
+                self.connection.rollback()
+                logger.debug("Use of cached results could not be recorded in {}: {}".format(self.fname, e))
+        return results
+
+    def put(self, results):
+        """
+        Store results (dictionary keyed by key of tuples of exposures and metrics), evict results above the size limit
+        Errors of the database are logged and results are not stored
+        """
+        used = time.time_ns()
+        rows = []
+        for key, (exposures, metrics) in results.items():
+            blob = np.ascontiguousarray(exposures, dtype=float).tobytes()
+            text = json.dumps({name: int(value) for name, value in metrics.items()})
+            rows.append((key, blob, text, len(key) + len(blob) + len(text), used))
+        try:
+            self.connection.executemany("INSERT OR REPLACE INTO decompositions VALUES (?, ?, ?, ?, ?)", rows)
+            self.evict()
+            self.connection.commit()
+        except sqlite3.Error as e:
+            self.connection.rollback()
+            logger.warning("Results could not be stored in cache {}: {}".format(self.fname, e))
+
+    def get_size(self):
+        """ Total size of cached results in bytes """
+        return self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM decompositions").fetchone()[0]
+
+    def evict(self):
+        """ Remove least recently used results until the cache fits max_size """
+        excess = self.get_size() - self.max_size
+        if excess <= 0:
+            return
+        evicted = []
+        for key, size in self.connection.execute("SELECT key, size FROM decompositions ORDER BY used").fetchall():
+            if excess <= 0:
+                break
+            evicted.append((key, ))
+            excess -= size
+        self.connection.executemany("DELETE FROM decompositions WHERE key = ?", evicted)
+        logger.debug("Evicted {} decompositions from cache {}".format(len(evicted), self.fname))
+
+    def close(self):
+        try:
+            self.connection.commit()
+        except sqlite3.Error as e:
+            logger.warning("Cache {} could not be updated: {}".format(self.fname, e))
+        self.connection.close()
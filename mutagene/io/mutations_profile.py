@@ -1,12 +1,15 @@
 import csv
 from collections import namedtuple
+from itertools import chain
 
 import twobitreader as tbr
 
 from tqdm import tqdm
-from collections import defaultdict
+
+import numpy as np
 
 from mutagene.dna import nucleotides, complementary_nucleotide
+from mutagene.profiles.channels import CODE_DTYPE, INVALID_CHANNEL, encode_channels
 
 import logging
 logger = logging.getLogger(__name__)
@@ -39,8 +42,8 @@ def get_context_53_twobit(mutations, twobit_file):
                 # print(chromosome, x, nuc5, nuc, nuc3)
             if nuc != 'N' and nuc != x:
                 if cn[nuc] == x:
-                    nuc3 = cn[nuc5]
-                    nuc5 = cn[nuc3]
+                    # flanks of the complementary strand: reverse complement
+                    nuc5, nuc3 = cn[nuc3], cn[nuc5]
                 else:
                     nuc3 = nuc5 = 'N'
         else:
@@ -69,6 +72,20 @@ def get_context_batch(mutations, assembly, method='twobit'):
     return contexts
 
 
+def encode_mutations(raw_mutations, contexts):
+    """
+    Channel codes of mutations (chrom, pos, x, y) on either strand in contexts (see get_context_batch),
+    all mutations are encoded at once (see encode_channels)
+    Returns tuple: array of codes of valid mutations and number of mutations with unknown nucleotides
+    """
+    flanks = [contexts.get((chrom, pos), ("N", "N")) for chrom, pos, _, _ in raw_mutations]
+    p5, p3 = zip(*flanks)
+    _, _, x, y = zip(*raw_mutations)
+    codes = encode_channels(p5, p3, x, y)
+    valid = codes != INVALID_CHANNEL
+    return codes[valid], int(np.sum(~valid))
+
+
 def read_auto_profile(muts, fmt, asm):
     # if isinstance(muts, io.TextIOWrapper):
     #     print("OOOO")
@@ -102,9 +119,10 @@ def read_auto_profile(muts, fmt, asm):
                 if tabs[4].lower().startswith("chr"):
                     fmt = "MAF"
                     break
-        mutations_lines.extend(muts.readlines())
+        # lines read to detect the format followed by the rest of the file, read by the parser line by line
+        mutations_lines = chain(mutations_lines, muts)
     else:
-        mutations_lines = muts.readlines()
+        mutations_lines = muts
 
     logger.info("DATA FORMAT:" + fmt)
 
@@ -121,8 +139,7 @@ def read_auto_profile(muts, fmt, asm):
 
 def read_MAF_profile(muts, asm):
 
-    cn = complementary_nucleotide
-    mutations = defaultdict(float)
+    mutations = []
     N_skipped = 0
 
     try:
@@ -136,7 +153,7 @@ def read_MAF_profile(muts, asm):
     except ValueError:
         # raise
         logger.warning("MAF format not recognized")
-        return mutations, {}
+        return np.array(mutations, dtype=CODE_DTYPE), {}
 
     N_loaded = N_skipped = 0
 
@@ -188,28 +205,19 @@ def read_MAF_profile(muts, asm):
         if len(contexts) == 0:
             return None, None
 
-        for (chrom, pos, x, y) in raw_mutations:
-            p5, p3 = contexts.get((chrom, pos), ("N", "N"))
+        # channel codes of mutations on either strand, mutations with unknown nucleotides are skipped
+        mutations, skipped = encode_mutations(raw_mutations, contexts)
+        N_skipped += skipped
 
-            if len(set([p5, x, y, p3]) - set(nucleotides)) > 0:
-                # print("Skipping invalid nucleotides")
-                N_skipped += 1
-                continue
-
-            if x in "CT":
-                mutations[p5 + p3 + x + y] += 1.0
-            else:
-                # complementary mutation
-                mutations[cn[p3] + cn[p5] + cn[x] + cn[y]] += 1.0
-
-    N_loaded = int(sum(mutations.values()))
+    # array of channel codes of mutations (see mutagene.profiles.channels)
+    mutations = np.array(mutations, dtype=CODE_DTYPE)
+    N_loaded = len(mutations)
     processing_stats = {'loaded': N_loaded, 'skipped': N_skipped, 'format': 'MAF'}
     return mutations, processing_stats
 
 
 def read_VCF_profile(muts, asm=None):
-    cn = complementary_nucleotide
-    mutations = defaultdict(float)
+    mutations = []
     N_skipped = 0
 
     raw_mutations = []
@@ -259,22 +267,12 @@ def read_VCF_profile(muts, asm=None):
         if len(contexts) == 0:
             return None, None
 
-        for (chrom, pos, x, y) in raw_mutations:
-            p5, p3 = contexts.get((chrom, pos), ("N", "N"))
-            # print("RESULT: {} {}".format(p5, p3))
-
-            if len(set([p5, x, y, p3]) - set(nucleotides)) > 0:
-                # print(chrom, pos, p5, p3, x)
-                # print("Skipping invalid nucleotides")
-                N_skipped += 1
-                continue
-
-            if x in "CT":
-                mutations[p5 + p3 + x + y] += 1.0
-            else:
-                # complementary mutation
-                mutations[cn[p3] + cn[p5] + cn[x] + cn[y]] += 1.0
+        # channel codes of mutations on either strand, mutations with unknown nucleotides are skipped
+        mutations, skipped = encode_mutations(raw_mutations, contexts)
+        N_skipped += skipped
 
-    N_loaded = int(sum(mutations.values()))
+    # array of channel codes of mutations (see mutagene.profiles.channels)
+    mutations = np.array(mutations, dtype=CODE_DTYPE)
+    N_loaded = len(mutations)
     processing_stats = {'loaded': N_loaded, 'skipped': N_skipped, 'format': 'VCF'}
     return mutations, processing_stats
@@ -1,11 +1,14 @@
 # from tqdm import tqdm
 from collections import defaultdict
-from mutagene.dna import nucleotides
 from mutagene.dna import complementary_trinucleotide, complementary_nucleotide
 
 import os
 import numpy as np
 
+from mutagene.signatures.signature_set import SignatureSet, get_signature_similarity, get_signature_linkage
+from mutagene.profiles.channels import CHANNELS, MUTATION_TYPES, get_channel_scheme, get_label_scheme
+from mutagene.io.catalog_cache import read_cached_catalog, read_cached_derived
+
 import logging
 logger = logging.getLogger(__name__)
 
@@ -31,7 +34,13 @@ def read_profile_file(profile_file):
 
 
 def read_profile_str(profile_str):
-    mutations = defaultdict(float)
+    """
+    Parse profile given as lines of channel label (e.g. T[A>C]G, see mutagene.profiles.channels) and value,
+    channels not listed are zero. The layout of channels (96, 192 or 1536) is detected from labels
+    Returns list of values in the order of channels of the layout
+    """
+    labels = []
+    values = []
     for line in profile_str.splitlines():
         if len(line) == 0:
             continue
@@ -40,36 +49,36 @@ def read_profile_str(profile_str):
         fields = line.strip().upper().split()
         if len(fields) != 2:
             return None, None
-
-        if len(fields[0]) != 7:
-            return None, None
-
-        if fields[0][1] != "[" or fields[0][3] != ">" or fields[0][5] != "]":
-            return None, None
-
-        p5, _, x, _, y, _, p3 = tuple(fields[0])
-
-        if p5 not in nucleotides or p3 not in nucleotides or y not in nucleotides:
-            return None, None
-
-        if x not in "TC":
-            return None, None
-
         try:
-            f = float(fields[1])
-        except:
+            values.append(float(fields[1]))
+        except ValueError:
             return None, None
+        labels.append(fields[0])
 
-        mutations[p5 + p3 + x + y] = f
+    try:
+        scheme = get_label_scheme(labels)
+    except ValueError:
+        return None, None
+    profile = np.zeros(scheme.n_channels)
+    profile[scheme.get_rows(labels)] = values
+    return profile.tolist()
 
-    values = []
-    for p5 in nucleotides:
-        for p3 in nucleotides:
-            for x in "CT":
-                for y in nucleotides:
-                    if x != y:
-                        values.append(mutations.get(p5 + p3 + x + y, 0.0))
-    return values
+
+def read_signatures_table(fname):
+    """
+    Read signatures from a tab-separated table with a row per channel (labels of channels in the first column
+    in any order, e.g. A[C>A]A, see mutagene.profiles.channels) and a column per signature, as written by
+    write_signatures. Channels not listed are zero. The layout of channels (96, 192 or 1536) is detected from labels
+    Returns tuple: channels x K signatures matrix and list of K signature names
+    """
+    with open(fname) as f:
+        signature_names = f.readline().rstrip("\r\n").split("\t")[1:]
+        rows = [line.rstrip("\r\n").split("\t") for line in f if len(line.strip()) > 0]
+    labels = [row[0].strip().upper() for row in rows]
+    scheme = get_label_scheme(labels)
+    W = np.zeros((scheme.n_channels, len(signature_names)))
+    W[scheme.get_rows(labels)] = np.array([row[1:] for row in rows], dtype=float).reshape(len(rows), -1)
+    return W, signature_names
 
 
 """
@@ -104,17 +113,7 @@ def read_COSMICv3_signatures():
                 val = float(val)
                 mutations[j][p5 + p3 + x + y] = val
 
-    W = []
-    for j in range(len(signature_names)):
-        profile = []
-        for p5 in nucleotides:
-            for p3 in nucleotides:
-                for x in "CT":
-                    for y in nucleotides:
-                        if x != y:
-                            profile.append(mutations[j].get(p5 + p3 + x + y, 0.0))
-        W.append(profile)
-    W = np.array(W).T
+    W = np.array([[mutations[j].get(channel, 0.0) for channel in CHANNELS] for j in range(len(signature_names))]).T
     return W, signature_names
 
 
@@ -127,43 +126,9 @@ def read_KUCAB_signatures():
     MutationType    Potassium bromate (875 uM)  DBADE (0.109 uM)    Formaldehyde (120 uM)   Semustine (150 uM)  Temozolomide (200 uM)   DMH (11.6 mM) + S9  Benzidine (200 uM)  DBP (0.0039 uM) MX (7 uM) + S9  Methyleugenol (1.25 mM) 4-ABP (300 uM) + S9 DBPDE (0.000156 uM) DBP (0.0313 uM) + S9    DBADE (0.0313 uM)   1,8-DNP (0.125 uM)  BPDE (0.125 uM) MNU (350 uM)    ENU (400 uM)    Cyclophosphamide (18.75 uM) + S9    BaP (0.39 uM) + S9  6-Nitrochrysene (12.5 uM) + S9  AAI (1.25 uM)   Potassium bromate (260 uM)  6-Nitrochrysene (0.78 uM)   Ellipticine (0.375 uM) + S9 DBA (75 uM) + S9    PhIP (3 uM) + S9    AFB1 (0.25 uM) + S9 3-NBA (0.025 uM)    1,6-DNP (0.09 uM)   5-Methylchrysene (1.6 uM) + S9  Furan (100 mM) + S9 SSR (1.25 J)    AAII (37.5 uM)  Propylene oxide (10 mM) N-Nitrosopyrrolidine (50 mM)    Mechlorethamine (0.3 uM)    DES (0.938 mM)  DMS (0.078 mM)  Cisplatin (3.125 uM)    OTA (0.08 uM) + S9  Carboplatin (5 uM)  DBAC (5 uM) + S9    Temozolomide (200 uM).1 Cisplatin (12.5 uM) AZD7762 (1.625 uM)  3-NBA (0.1 uM)  PhIP (4 uM) + S9    BaP (2 uM) + S9 6-Nitrochrysene (50 uM) + S9    6-Nitrochrysene (50 uM) 1,8-DNP (8 uM)  DBPDE (0.000625 uM) Control
     A[C>A]A 0.109398510425891   0.0240330588511261  0.0181865586268237  0.000122421190463747    0   0.00665025743214769 0.0564462237667514  0   0.0494977586860332  0.111458492403729   0.00483165426221388 0.0002218019424568  0.00869925685873544 0.0264652966450285  0.0195599544767651  0.0237017339519746  0.00262256704780487 0.0130480902574389  0.00555898815479868 0.0406568174086766  0.0100871864208784  0.00428520931740606 0.114738757387778   0.00515014598157648 0.0482801050571615  0.0323606741641645  0.0279971115871403  0.0379396506608179  0.000340069771278152    0.000751844456779883    0.0286278352872072  0.0503953181060661  2.22941465639634e-05    0.000162365803469566    0.0104143358776828  0.00685630323850839 0.000133921576621699    0.014166642071802   0.000461507809128427    0.00279492689318811 0.11584205195812    0.00194170922837543 0.00673772703708239 0.000256609057933161    1.12145020078519e-05    0.000395123818576932    0.0258298926507019  0.032667880519281   0.0283815533748292  0.00855231498108648 0.00555769823738427 0.0180349250334742  0.0186419336589614  0.0605073306958345
     """
-    mutations = defaultdict(dict)
     dirname = os.path.dirname(os.path.realpath(__file__))
     fname = os.path.normpath(dirname + "/../data/signatures/Kucab.txt")
-    signature_names = []
-    with open(fname, 'r') as f:
-        for i, line in enumerate(f):
-            fields = line.strip().split("\t")
-            if i == 0:
-                signature_names = fields[1:]
-                continue
-
-            # parse A[C>A]A
-            m = fields[0]
-            p5 = m[0]
-            assert m[1] == '['
-            x = m[2]
-            assert m[3] == '>'
-            y = m[4]
-            assert m[5] == ']'
-            p3 = m[6]
-
-            for j, val in enumerate(fields[1:]):
-                val = float(val)
-                mutations[j][p5 + p3 + x + y] = val
-
-    W = []
-    for j in range(len(signature_names)):
-        profile = []
-        for p5 in nucleotides:
-            for p3 in nucleotides:
-                for x in "CT":
-                    for y in nucleotides:
-                        if x != y:
-                            profile.append(mutations[j].get(p5 + p3 + x + y, 0.0))
-        W.append(profile)
-    W = np.array(W).T
-    return W, signature_names
+    return read_signatures_table(fname)
 
 
 def _read_mutagene_signatures(name, n_signatures):
@@ -193,10 +158,46 @@ def read_COSMICv2_signatures():
     return _read_mutagene_signatures('C', 30)
 
 
-def read_signatures(name, only=None):
+def get_signatures_source_files(name):
+    """ Files a set of signatures is read from """
+    dirname = os.path.dirname(os.path.realpath(__file__))
+    sources = {
+        'MGA': ["A_{}.profile".format(i + 1) for i in range(5)],
+        'MGB': ["B_{}.profile".format(i + 1) for i in range(10)],
+        'COSMICv2': ["C_{}.profile".format(i + 1) for i in range(30)],
+        'COSMICv3': ["sigProfiler_SBS_signatures_2019_05_22.csv"],
+        'KUCAB': ["Kucab.txt"],
+    }
+    return [os.path.normpath(dirname + "/../data/signatures/" + fname) for fname in sources[name]]
+
+
+def get_named_subset(signature_set, only):
+    """
+    Names of signatures (without prefix of the signature set) selected by a list of names and named subsets:
+        'representatives' - one representative signature of each cluster of similar signatures
+        'cluster:X' - signatures in the cluster of signature X (e.g. cluster:SBS3)
+    """
+    prefix = signature_set.name + "-"
+    names = [x[len(prefix):] for x in signature_set.names]
+    selected = []
+    for item in only:
+        if item == 'representatives':
+            selected.extend(x for x, representative in zip(names, signature_set.representatives) if representative)
+        elif item.startswith('cluster:') and item[len('cluster:'):] in names:
+            members = signature_set.get_cluster_members(names.index(item[len('cluster:'):]))
+            selected.extend(x[len(prefix):] for x in members)
+        else:
+            selected.append(item)
+    return selected
+
+
+def read_signatures(name, only=None, use_cache=True):
     """
     Retrieve a set of signatures by its name or number of signatures specified as 'str'.
-    Returns tuple: numpy matrix and list of names
+    Parsed signatures are compiled to a binary cache (see read_cached_catalog) unless use_cache is False,
+    along with similarity and hierarchical clustering of signatures
+    only = list of names of signatures to keep, may include named subsets (see get_named_subset)
+    Returns SignatureSet, which unpacks as a tuple: numpy matrix and list of names
     """
 
     # number of sigatures matching to names
@@ -205,7 +206,7 @@ def read_signatures(name, only=None):
         '10': 'MGB',
         '30': 'COSMICv2',
         '49': 'COSMICv3',
-        '53': 'KUKAB'
+        '53': 'KUCAB'
     }
     inv_signatures_dict = dict(zip(signatures_dict.values(), signatures_dict.keys()))
 
@@ -214,8 +215,20 @@ def read_signatures(name, only=None):
 
     assert name in inv_signatures_dict, "Unknown name for a signature set: {}".format(name)
 
-    function_name = "read_{}_signatures".format(name)
-    W, signature_names = globals()[function_name]()
+    reader = globals()["read_{}_signatures".format(name)]
+    if use_cache:
+        W, signature_names = read_cached_catalog(name, get_signatures_source_files(name), reader)
+        similarity = read_cached_derived(name, 'similarity', W, get_signature_similarity)
+        linkage = read_cached_derived(name, 'linkage', W, lambda W: get_signature_linkage(similarity))
+    else:
+        W, signature_names = reader()
+        similarity, linkage = None, None
+
+    if only is not None:
+        only = [only] if isinstance(only, str) else only
+        catalog = SignatureSet(W, ["{}-{}".format(name, x) for x in signature_names], name=name,
+                               similarity=similarity, linkage=linkage)
+        only = get_named_subset(catalog, only)
 
     # filter by list of 'only' signatures,
     # append signature set prefix to signature names
@@ -229,9 +242,13 @@ def read_signatures(name, only=None):
         filtered_signature_names.append("{}-{}".format(name, x))
 
     if only is not None:
-        W = np.delete(W, np.array(delete_signatures), axis=1)
+        W = np.delete(W, np.array(delete_signatures, dtype=int), axis=1)
+        if similarity is not None:
+            similarity = np.delete(np.delete(similarity, delete_signatures, axis=0), delete_signatures, axis=1)
+        # clustering of the subset is recomputed
+        linkage = None
 
-    return W, filtered_signature_names
+    return SignatureSet(W, filtered_signature_names, name=name, similarity=similarity, linkage=linkage)
 
 
 def write_profile(profile_file, p, counts=True):
@@ -240,19 +257,10 @@ def write_profile(profile_file, p, counts=True):
 
 
 def format_profile(values, counts=False):
-    if counts:
-        format_str = "{}[{}>{}]{}\t{:d}\n"
-    else:
-        format_str = "{}[{}>{}]{}\t{:.12f}\n"
-    attrib = get_profile_attributes_dict()
-    result = ""
-    for i, v in enumerate(values):
-        x, y = attrib[i]['mutation']
-        p5, p3 = attrib[i]['context']
-        if counts:
-            v = int(v)
-        result += format_str.format(p5, x, y, p3, v)
-    return result
+    """ Profile as lines of channel label and value, labels of the layout of channels of len(values) channels """
+    format_str = "{}\t{:d}\n" if counts else "{}\t{:.12f}\n"
+    labels = get_channel_scheme(len(values)).labels
+    return "".join(format_str.format(label, int(v) if counts else v) for label, v in zip(labels, values))
 
 
 def write_profile_file(file_handle, p, counts=True):
@@ -260,29 +268,29 @@ def write_profile_file(file_handle, p, counts=True):
     file_handle.write(formatted_profile)
 
 
+def write_signatures(file_handle, W, signature_names):
+    """
+    Write signatures (channels x K matrix) as a tab-separated table with a column per signature
+    and a row per channel in A[C>A]A notation (format of Kucab et al. signatures, see ChannelScheme.labels)
+    """
+    file_handle.write("\t".join(["MutationType"] + list(signature_names)) + "\n")
+    W = np.asarray(W)
+    for label, values in zip(get_channel_scheme(W.shape[0]).labels, W):
+        file_handle.write("{}\t{}\n".format(label, "\t".join("{:.12g}".format(v) for v in values)))
+
+
+def write_profiles_matrix(file_handle, profiles, samples):
+    """ Write profiles (samples x channels mutation counts) as a table with a column per sample (see write_signatures) """
+    write_signatures(file_handle, np.asarray(profiles).T, samples)
+
+
 def get_profile_attributes_dict(signature_order=False):
-    attribs = []
+    """ Mutation (x + y) and context (p5 + p3) of 96 channels, sorted by mutation first if signature_order """
+    scheme = get_channel_scheme()
+    order = range(scheme.n_channels)
     if signature_order:
-        for x in "CT":
-            for y in nucleotides:
-                if x != y:
-                    for p5 in nucleotides:
-                        for p3 in nucleotides:
-                            attribs.append({
-                                'mutation': x + y,
-                                'context': p5 + p3
-                            })
-    else:
-        for p5 in nucleotides:
-            for p3 in nucleotides:
-                for x in "CT":
-                    for y in nucleotides:
-                        if x != y:
-                            attribs.append({
-                                'mutation': x + y,
-                                'context': p5 + p3
-                            })
-    return attribs
+        order = sorted(order, key=lambda i: (MUTATION_TYPES.index(scheme.mutations[i]), scheme.contexts[i]))
+    return [{'mutation': scheme.mutations[i], 'context': scheme.contexts[i]} for i in order]
 
 
 def get_attributes():
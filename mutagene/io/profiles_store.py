@@ -0,0 +1,214 @@
+import csv
+import glob
+import os
+
+import numpy as np
+
+from mutagene.io.profile import read_profile_file
+from mutagene.profiles.channels import get_channel_scheme
+from mutagene.profiles.profile import get_grouped_profiles
+
+import logging
+logger = logging.getLogger(__name__)
+
+# fields of every record of a store, other fields are metadata columns
+PROFILES_STORE_FIELDS = ('sample', 'counts', 'mutations')
+
+
+def _get_column_dtype(values):
+    """ Integer, float or string dtype fitting all values of a metadata column (given as strings) """
+    for dtype in (np.int64, np.float64):
+        try:
+            np.array(values, dtype=dtype)
+            return dtype
+        except (ValueError, TypeError, OverflowError):
+            pass
+    return 'U{}'.format(max([len(str(value)) for value in values] + [1]))
+
+
+def write_profiles_store(fname, samples, profiles, mutations=None, metadata=None):
+    """
+    Write profiles of a cohort to a single store file: a numpy structured array (.npy) with one record per sample
+    of sample ID, mutation counts in channels (96, 192 or 1536, see get_channel_scheme), total number of mutations (sum of counts by default, may include
+    mutations not in the profile) and metadata columns (e.g. cancer type)
+
+    samples = list of sample IDs
+    profiles = samples x channels matrix of mutation counts
+    mutations = total number of mutations of each sample
+    metadata = dictionary keyed by column name of lists of values (in the order of samples)
+    """
+    profiles = np.asarray(profiles, dtype=float)
+    if profiles.ndim != 2 or len(samples) != profiles.shape[0]:
+        raise ValueError("Number of samples ({}) and profiles ({}) do not match".format(len(samples), len(profiles)))
+    n_channels = get_channel_scheme(profiles.shape[1]).n_channels
+    if mutations is None:
+        mutations = np.rint(profiles.sum(axis=1))
+    metadata = metadata or {}
+    for column, values in metadata.items():
+        if column in PROFILES_STORE_FIELDS:
+            raise ValueError("Metadata column can not be named {}".format(column))
+        if len(values) != len(samples):
+            raise ValueError("Number of values of metadata column {} does not match number of samples".format(column))
+
+    dtype = [
+        ('sample', 'U{}'.format(max([len(sample) for sample in samples] + [1]))),
+        ('counts', np.float64, (n_channels, )),
+        ('mutations', np.int64),
+    ] + [(column, _get_column_dtype(values)) for column, values in metadata.items()]
+    records = np.zeros(len(samples), dtype=dtype)
+    records['sample'] = samples
+    records['counts'] = profiles
+    records['mutations'] = mutations
+    for column, values in metadata.items():
+        records[column] = values
+
+    # file object: np.save would append .npy to other file names
+    with open(fname, 'wb') as f:
+        np.save(f, records)
+
+
+def _read_stats_file(fname):
+    """ Key and value pairs of processing statistics of a sample (.stats file) """
+    stats = {}
+    with open(fname) as f:
+        for line in f:
+            fields = line.split()
+            if len(fields) == 2:
+                stats[fields[0]] = fields[1]
+    return stats
+
+
+def read_metadata_file(fname):
+    """ Metadata of samples from a TSV file with header, first column is sample ID. Returns dictionary keyed by sample """
+    with open(fname) as f:
+        reader = csv.reader(f, delimiter='\t')
+        header = next(reader)
+        return {row[0]: dict(zip(header[1:], row[1:])) for row in reader if len(row) > 0}
+
+
+def import_profiles_directory(dirname, fname, metadata=None):
+    """
+    Import a directory of per-sample text files (SAMPLE.counts profiles, optional SAMPLE.mutations total number
+    of mutations and SAMPLE.stats processing statistics, e.g. data/ICGC and data/NCI60) to a store file
+    (see write_profiles_store). SAMPLE.profile files of frequencies are not needed, they are derived from counts
+
+    metadata = dictionary keyed by sample of dictionaries of metadata values (see read_metadata_file),
+        statistics of .stats files are added as metadata columns
+
+    Returns number of imported samples
+    """
+    samples = []
+    profiles = []
+    mutations = []
+    samples_metadata = []
+    for counts_fname in sorted(glob.glob(os.path.join(dirname, "*.counts"))):
+        sample = os.path.splitext(os.path.basename(counts_fname))[0]
+        profile = read_profile_file(counts_fname)
+        if not isinstance(profile, list):
+            logger.warning("Profile of sample {} could not be read, sample skipped".format(sample))
+            continue
+        # all profiles of a store have the layout of channels of the first profile
+        if len(profiles) > 0 and len(profile) != len(profiles[0]):
+            logger.warning("Profile of sample {} has {} channels instead of {}, sample skipped".format(sample, len(profile), len(profiles[0])))
+            continue
+
+        total = int(round(sum(profile)))
+        mutations_fname = os.path.join(dirname, sample + ".mutations")
+        if os.path.isfile(mutations_fname):
+            with open(mutations_fname) as f:
+                total = int(f.read().strip() or total)
+
+        sample_metadata = {}
+        stats_fname = os.path.join(dirname, sample + ".stats")
+        if os.path.isfile(stats_fname):
+            sample_metadata.update(_read_stats_file(stats_fname))
+        if metadata is not None:
+            sample_metadata.update(metadata.get(sample, {}))
+
+        samples.append(sample)
+        profiles.append(profile)
+        mutations.append(total)
+        samples_metadata.append(sample_metadata)
+
+    columns = []
+    for sample_metadata in samples_metadata:
+        columns.extend(column for column in sample_metadata if column not in columns)
+    store_metadata = {column: [sample_metadata.get(column, '') for sample_metadata in samples_metadata] for column in columns}
+
+    n_channels = len(profiles[0]) if len(profiles) > 0 else get_channel_scheme().n_channels
+    write_profiles_store(fname, samples, np.array(profiles).reshape(len(samples), n_channels), mutations, store_metadata)
+    return len(samples)
+
+
+class ProfilesStore(object):
+    """
+    Profiles of a cohort in a store file (see write_profiles_store), memory-mapped read-only:
+    only records and columns actually used are read from disk
+    """
+
+    def __init__(self, fname):
+        self.fname = fname
+        self.records = np.load(fname, mmap_mode='r')
+        names = self.records.dtype.names or ()
+        if any(field not in names for field in PROFILES_STORE_FIELDS) or self.records['counts'].ndim != 2:
+            raise ValueError("{} is not a store of mutational profiles".format(fname))
+        self.scheme = get_channel_scheme(self.records['counts'].shape[1])
+        self.metadata_columns = [name for name in names if name not in PROFILES_STORE_FIELDS]
+        self.samples = self.records['sample'].tolist()
+        self._index = {sample: i for i, sample in enumerate(self.samples)}
+
+    def __len__(self):
+        return len(self.samples)
+
+    def __repr__(self):
+        return "ProfilesStore({}, {} samples)".format(self.fname, len(self))
+
+    def get_rows(self, samples=None, where=None):
+        """
+        Indices of records of samples (all samples if None) matching metadata criteria
+        where = dictionary of values of metadata columns, e.g. {'cancer_type': 'BRCA'}
+        Unknown samples and columns raise ValueError
+        """
+        if samples is None:
+            rows = np.arange(len(self))
+        else:
+            missing = [sample for sample in samples if sample not in self._index]
+            if len(missing) > 0:
+                raise ValueError("Samples not found in {}: {}".format(self.fname, ", ".join(missing)))
+            rows = np.array([self._index[sample] for sample in samples], dtype=int)
+        for column, value in (where or {}).items():
+            if column not in self.metadata_columns:
+                raise ValueError("Unknown metadata column {}, columns of {}: {}".format(column, self.fname, ", ".join(self.metadata_columns)))
+            values = self.records[column][rows]
+            rows = rows[values == np.array(value).astype(values.dtype)]
+        return rows
+
+    def get_profiles(self, samples=None, where=None):
+        """ Returns tuple: list of samples and samples x channels matrix of mutation counts (see get_rows) """
+        rows = self.get_rows(samples, where)
+        return [self.samples[i] for i in rows], np.asarray(self.records['counts'][rows])
+
+    def get_mutations(self, samples=None, where=None):
+        """ Total numbers of mutations of samples (see get_rows) """
+        return np.asarray(self.records['mutations'][self.get_rows(samples, where)])
+
+    def get_metadata(self, column, samples=None):
+        """ Values of a metadata column for samples (all samples if None) """
+        if column not in self.metadata_columns:
+            raise ValueError("Unknown metadata column {}, columns of {}: {}".format(column, self.fname, ", ".join(self.metadata_columns)))
+        return np.asarray(self.records[column][self.get_rows(samples)])
+
+    def get_grouped_profiles(self, column):
+        """ Profiles pooled by values of a metadata column, returns tuple: list of values and groups x channels matrix """
+        return get_grouped_profiles(self.records['counts'], self.get_metadata(column))
+
+
+def parse_store_criteria(items):
+    """ Metadata criteria given as COLUMN=VALUE strings (see ProfilesStore.get_rows) """
+    where = {}
+    for item in items or []:
+        column, sep, value = item.partition('=')
+        if not sep or not column:
+            raise ValueError("Criteria should be given as COLUMN=VALUE, not {}".format(item))
+        where[column] = value
+    return where
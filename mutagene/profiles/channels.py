@@ -0,0 +1,226 @@
+import numpy as np
+
+from mutagene.dna import nucleotides
+
+# mutations with pyrimidine reference in the order of channels within a context
+MUTATION_TYPES = [x + y for x in "CT" for y in nucleotides if x != y]
+
+# transcriptional strand of the pyrimidine reference nucleotide: transcribed (template) or untranscribed (coding)
+STRANDS = "TU"
+
+# channel code of mutations not in a profile (unknown nucleotides or reference equal to alternative)
+INVALID_CHANNEL = -1
+
+# dtype of arrays of channel codes, fits channels of all schemes
+CODE_DTYPE = np.int16
+
+# index of nucleotides (position in dna.nucleotides) by character code, -1 for other characters (N, ambiguity codes)
+NUCLEOTIDE_INDEX = np.full(256, -1, dtype=np.int8)
+for _i, _n in enumerate(nucleotides):
+    NUCLEOTIDE_INDEX[ord(_n)] = NUCLEOTIDE_INDEX[ord(_n.lower())] = _i
+NUCLEOTIDE_INDEX.flags.writeable = False
+
+
+def _get_nucleotide_indices(sequences, length):
+    """ samples x length matrix of nucleotide indices of sequences (strings of the same length) """
+    a = np.asarray(sequences, dtype='S{}'.format(length))
+    return NUCLEOTIDE_INDEX[np.frombuffer(a.tobytes(), dtype=np.uint8)].reshape(-1, length)
+
+
+class ChannelScheme(object):
+    """
+    Layout of channels of mutational profiles: single nucleotide substitutions with pyrimidine reference
+    in the context of flank nucleotides on each side, optionally split by transcriptional strand
+        96 - flank 1 (trinucleotide context)
+        192 - flank 1 and transcriptional strand
+        1536 - flank 2 (pentanucleotide context)
+
+    Channels are ordered by strand (transcribed, untranscribed), 5' flank, 3' flank (nucleotides in dna.nucleotides
+    order, flanks read 5' to 3' as in labels: the 5' flank from the farthest nucleotide to the mutation,
+    the 3' flank from the nearest) and mutation type (see MUTATION_TYPES),
+    the 96 channels layout is the order of profile files and signatures
+
+    Codes of channels are looked up in a table indexed by nucleotide indices of flanks, reference, alternative
+    nucleotide and strand of the transcript (+ or -) of mutations given on the forward strand of the genome,
+    mutations with purine reference are counted as their complement on the other strand
+    """
+
+    def __init__(self, name, flank=1, stranded=False):
+        self.name = name
+        self.flank = flank
+        self.stranded = stranded
+        self.n_contexts = 4 ** (2 * flank)
+        self.n_channels = (2 if stranded else 1) * self.n_contexts * len(MUTATION_TYPES)
+
+        # all combinations of nucleotide indices of 5' flank, 3' flank, reference, alternative and transcript strand
+        index = np.indices((4, ) * (2 * flank + 2) + (2, )).reshape(2 * flank + 3, -1)
+        p5, p3, x, y, strand = index[:flank], index[flank:2 * flank], index[-3], index[-2], index[-1]
+        purine = (x == nucleotides.index("A")) | (x == nucleotides.index("G"))
+        # complementary strand: complementary nucleotides (index 3 - i for ACGT), flanks reversed and swapped
+        p5, p3 = np.where(purine, 3 - p3[::-1], p5), np.where(purine, 3 - p5[::-1], p3)
+        x, y = np.where(purine, 3 - x, x), np.where(purine, 3 - y, y)
+
+        mutation_index = np.full((4, 4), -1, dtype=np.intp)
+        for i, (a, b) in enumerate(MUTATION_TYPES):
+            mutation_index[nucleotides.index(a), nucleotides.index(b)] = i
+        mutation = mutation_index[x, y]
+        context = np.zeros_like(x)
+        for a in list(p5) + list(p3):
+            context = context * 4 + a
+        codes = context * len(MUTATION_TYPES) + mutation
+        if stranded:
+            # pyrimidine reference on the forward strand is on the coding (untranscribed) strand of + transcripts
+            untranscribed = np.where(purine, strand == 1, strand == 0)
+            codes = codes + untranscribed * self.n_contexts * len(MUTATION_TYPES)
+        codes[mutation < 0] = INVALID_CHANNEL
+        self.table = codes.astype(CODE_DTYPE).reshape((4, ) * (2 * flank + 2) + (2, ))
+        self.table.flags.writeable = False
+
+        # attributes of channels in the order of codes
+        channels = np.indices(((2 if stranded else 1), ) + (4, ) * (2 * flank) + (len(MUTATION_TYPES), ))
+        channels = channels.reshape(len(channels), -1)
+        self.strands = [STRANDS[i] for i in channels[0]] if stranded else [""] * self.n_channels
+        self.contexts = ["".join(nucleotides[i] for i in c) for c in channels[1:-1].T]
+        self.mutations = [MUTATION_TYPES[i] for i in channels[-1]]
+        # keys (strand + 5' flank + 3' flank + x + y) and labels e.g. A[C>A]A, T:A[C>A]A, AA[C>A]AA
+        self.keys = [s + c + m for s, c, m in zip(self.strands, self.contexts, self.mutations)]
+        self.labels = [
+            (s + ":" if s else "") + "{}[{}>{}]{}".format(c[:flank], m[0], m[1], c[flank:])
+            for s, c, m in zip(self.strands, self.contexts, self.mutations)]
+        self._codes = self._get_codes()
+
+    def __repr__(self):
+        return "ChannelScheme({}, {} channels)".format(self.name, self.n_channels)
+
+    def _get_codes(self):
+        """ Channel code of mutations keyed by p5 + p3 + x + y (+ transcript strand, if stranded) on either strand """
+        index = np.indices(self.table.shape).reshape(self.table.ndim, -1)
+        codes = {}
+        for i, code in zip(index.T, self.table.ravel()):
+            if code == INVALID_CHANNEL:
+                continue
+            key = "".join(nucleotides[j] for j in i[:-1])
+            if self.stranded:
+                key += "+-"[i[-1]]
+            codes[key] = int(code)
+        return codes
+
+    def encode(self, p5, p3, x, y, strand='+'):
+        """
+        Channel code of a single mutation x>y on the forward strand in context p5 _ p3 (strings of flank nucleotides)
+        in a transcript on strand + or - (stranded schemes only), INVALID_CHANNEL if not a valid mutation
+        """
+        key = p5 + p3 + x + y + (strand if self.stranded else "")
+        return self._codes.get(key, INVALID_CHANNEL)
+
+    def encode_array(self, p5, p3, x, y, strand=None):
+        """
+        Channel codes of arrays of mutations (see encode)
+        p5, p3 = sequences of flanks (strings of flank nucleotides), x, y = sequences of single nucleotides
+        strand = sequence of strands of transcripts (+ or -), forward strand if None
+        """
+        index = np.hstack([
+            _get_nucleotide_indices(p5, self.flank), _get_nucleotide_indices(p3, self.flank),
+            _get_nucleotide_indices(x, 1), _get_nucleotide_indices(y, 1)])
+        if strand is None:
+            strand_index = np.zeros(len(index), dtype=np.intp)
+        else:
+            strand_index = (np.asarray(strand) == '-').astype(np.intp)
+        invalid = np.any(index < 0, axis=1)
+        codes = self.table[tuple(np.where(invalid, 0, index.T)) + (strand_index, )]
+        codes[invalid] = INVALID_CHANNEL
+        return codes
+
+    def get_dummy_signatures(self):
+        """
+        Dummy signatures: uniform frequencies over channels of one mutation type (C>A, C>T, C>G, T>A, T>C, T>G)
+        Returns tuple: list of names and channels x 6 matrix
+        """
+        mutations = [("C", "A"), ("C", "T"), ("C", "G"), ("T", "A"), ("T", "C"), ("T", "G")]
+        channels = np.array(self.mutations)
+        W = np.array([channels == x + y for x, y in mutations], dtype=float).T
+        return [x + " to " + y for x, y in mutations], W / W.sum(axis=0)
+
+    def get_rows(self, labels):
+        """ Channel codes of labels of channels (e.g. A[C>A]A), ValueError if a label is not a channel of the scheme """
+        index = {label: i for i, label in enumerate(self.labels)}
+        missing = [label for label in labels if label not in index]
+        if len(missing) > 0:
+            raise ValueError("Channels {} are not in {} channels layout".format(", ".join(missing[:5]), self.name))
+        return np.array([index[label] for label in labels], dtype=np.intp)
+
+
+CHANNEL_SCHEMES = {
+    '96': ChannelScheme('96'),
+    '192': ChannelScheme('192', stranded=True),
+    '1536': ChannelScheme('1536', flank=2),
+}
+
+
+def get_channel_scheme(scheme=None):
+    """ Channel scheme given by name or number of channels (96 by default), ChannelScheme is returned as is """
+    if isinstance(scheme, ChannelScheme):
+        return scheme
+    if scheme is None:
+        return CHANNEL_SCHEMES['96']
+    if str(scheme) not in CHANNEL_SCHEMES:
+        raise ValueError("Unknown channels layout {}, only {} are recognized".format(scheme, ", ".join(CHANNEL_SCHEMES)))
+    return CHANNEL_SCHEMES[str(scheme)]
+
+
+def get_label_scheme(labels):
+    """ Smallest channel scheme with all channels given by labels (in any order), ValueError if there is none """
+    for scheme in CHANNEL_SCHEMES.values():
+        if set(labels) <= set(scheme.labels):
+            return scheme
+    raise ValueError("Channels do not match any layout of {} channels".format(", ".join(CHANNEL_SCHEMES)))
+
+
+# 96 channels of mutational profiles in the order of profile files and signatures:
+# 5' flank, 3' flank, reference (pyrimidine) and alternative nucleotide, e.g. 'ACCA' is A[C>A]C
+CHANNELS = CHANNEL_SCHEMES['96'].keys
+N_CHANNELS = len(CHANNELS)
+
+# channel code of mutations p5 + p3 + x + y on either strand
+CHANNEL_CODES = CHANNEL_SCHEMES['96']._codes
+
+# channel codes indexed by nucleotide indices of 5' flank, 3' flank, reference and alternative nucleotide
+CHANNEL_TABLE = CHANNEL_SCHEMES['96'].table[..., 0]
+
+
+def encode_channel(p5, p3, x, y):
+    """ Channel code of a single mutation x>y in context p5 _ p3 (either strand), INVALID_CHANNEL if not a valid mutation """
+    return CHANNEL_CODES.get(p5 + p3 + x + y, INVALID_CHANNEL)
+
+
+def encode_channels(p5, p3, x, y):
+    """
+    Channel codes of arrays of mutations (see encode_channel)
+    p5, p3, x, y = sequences of single nucleotides (strings, lists or numpy arrays of characters)
+    """
+    return CHANNEL_SCHEMES['96'].encode_array(p5, p3, x, y)
+
+
+def get_channel_codes(channels):
+    """ Channel codes of mutations given as strings p5 + p3 + x + y """
+    return np.array([CHANNEL_CODES.get(channel, INVALID_CHANNEL) for channel in channels], dtype=CODE_DTYPE)
+
+
+def get_codes_profile(codes, n_channels=N_CHANNELS):
+    """ Profile (mutation counts in n_channels) of mutations given by channel codes, invalid codes are ignored """
+    codes = np.asarray(codes, dtype=np.intp)
+    return np.bincount(codes[codes >= 0], minlength=n_channels)
+
+
+def get_codes_profiles(samples_codes, n_channels=N_CHANNELS):
+    """
+    Profiles of multiple samples at once
+    samples_codes = list of arrays of channel codes of mutations, one per sample
+    Returns samples x n_channels matrix of mutation counts
+    """
+    lengths = [len(codes) for codes in samples_codes]
+    if sum(lengths) == 0:
+        return np.zeros((len(samples_codes), n_channels), dtype=np.intp)
+    codes = np.concatenate([np.asarray(codes, dtype=np.intp) for codes in samples_codes])
+    index = np.repeat(np.arange(len(samples_codes)), lengths) * n_channels + codes
+    return np.bincount(index[codes >= 0], minlength=len(samples_codes) * n_channels).reshape(-1, n_channels)
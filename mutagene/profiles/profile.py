@@ -1,72 +1,182 @@
 # from collections import defaultdict
 # from mutagene.dna import complementary_nucleotide
 
-from collections import Counter
-from operator import add
-from functools import reduce
+import os
+from multiprocessing import Pool
 
 import numpy as np
 from numpy.random import multinomial
 from sklearn.utils import resample
 
-from mutagene.io.profile import write_profile_file, get_profile_attributes_dict
+from mutagene.io.profile import write_profile_file, write_profiles_matrix
+from mutagene.profiles.channels import N_CHANNELS, get_channel_scheme, get_codes_profile, get_codes_profiles
 from mutagene.io.mutations_profile import read_auto_profile
+from mutagene.signatures.identify import get_jobs
 
 import logging
 logger = logging.getLogger(__name__)
 
 
-def calc_profile(infile, outfile, genome, fmt='auto'):
-    all_mutations = {}
-    for f in infile:
-        mutations, processing_stats = read_auto_profile(f, fmt=fmt, asm=genome)
-        msg = "Loaded {} mutations".format(processing_stats['loaded'])
-        if processing_stats['skipped'] > 0:
-            msg += " skipped {} mutations due to mismatches with the reference genome".format(processing_stats['skipped'])
-        logger.info(msg)
-        all_mutations = {k: all_mutations.get(k, 0) + mutations.get(k, 0) for k in set(all_mutations) | set(mutations)}
-    if sum(all_mutations.values()) == 0:
+def get_file_profile(infile, genome, fmt='auto'):
+    """
+    Profile of mutations in a file (file name or open file) in VCF or MAF format
+    Returns tuple: array of 96 mutation counts and processing statistics (loaded and skipped mutations)
+    """
+    if isinstance(infile, str):
+        with open(infile) as f:
+            return get_file_profile(f, genome, fmt)
+    mutations, processing_stats = read_auto_profile(infile, fmt=fmt, asm=genome)
+    if mutations is None:
+        # format is not supported
+        return np.zeros(N_CHANNELS, dtype=np.intp), {'loaded': 0, 'skipped': 0}
+    return get_codes_profile(mutations), processing_stats
+
+
+# state shared with worker processes once, when the pool is created
+_worker_context = None
+
+
+def _init_worker(context):
+    global _worker_context
+    _worker_context = context
+
+
+def _profile_worker(fname):
+    genome, fmt = _worker_context
+    return get_file_profile(fname, genome, fmt)
+
+
+def calc_profiles(infiles, genome, fmt='auto', jobs=1):
+    """
+    Profiles of mutations of each file (see get_file_profile), files are read and their mutations
+    are put in context in a pool of jobs processes. Open files are read in the calling process
+    Returns tuple: files x 96 matrix of mutation counts and list of processing statistics of files
+    """
+    jobs = min(get_jobs(jobs), max(len(infiles), 1))
+    if jobs == 1 or any(not isinstance(infile, str) for infile in infiles):
+        results = [get_file_profile(infile, genome, fmt) for infile in infiles]
+    else:
+        with Pool(jobs, initializer=_init_worker, initargs=((genome, fmt), )) as pool:
+            results = pool.map(_profile_worker, infiles, chunksize=max(1, len(infiles) // (4 * jobs)))
+    profiles = np.array([profile for profile, _ in results], dtype=np.intp).reshape(-1, N_CHANNELS)
+    return profiles, [processing_stats for _, processing_stats in results]
+
+
+def calc_profile(infile, outfile, genome, fmt='auto', jobs=1, matrix=None):
+    """
+    Write pooled profile of mutations in files infile (file names or open files) to outfile
+    and profiles of each file to matrix (table with a column per file, see write_profiles_matrix) if given
+    """
+    profiles, files_stats = calc_profiles(infile, genome, fmt, jobs)
+    loaded = sum(processing_stats['loaded'] for processing_stats in files_stats)
+    skipped = sum(processing_stats['skipped'] for processing_stats in files_stats)
+    msg = "Loaded {} mutations".format(loaded)
+    if len(files_stats) > 1:
+        msg += " from {} files".format(len(files_stats))
+    if skipped > 0:
+        msg += " skipped {} mutations due to mismatches with the reference genome".format(skipped)
+    logger.info(msg)
+
+    if matrix is not None:
+        names = [os.path.splitext(os.path.basename(getattr(f, 'name', f)))[0] for f in infile]
+        write_profiles_matrix(matrix, profiles, names)
+
+    profile = profiles.sum(axis=0)
+    if profile.sum() == 0:
         logger.warn('Can not create profile')
         return
-    profile = get_mutational_profile(all_mutations, counts=True)
     write_profile_file(outfile, profile)
 
 
-def get_mutational_profile(mutational_profile_dict, counts=False):
-    attrib = get_profile_attributes_dict()
-    values = []
-    total_mut_number = sum(mutational_profile_dict.values())
-    for i, attr in enumerate(attrib):
-        number = mutational_profile_dict.get(attr['context'] + attr['mutation'], 0)
-        # freq = 0.000001 * number / total_mut_number
-        if counts:
-            freq = number
-        else:
-            freq = number / float(total_mut_number)
-        # trinucleotide = attr['context'][0] + attr['mutation'][0] + attr['context'][1]
-        # trinucleotide_freq = exome_trinucleotide_freq[trinucleotide]
-        # values.append(3.0 * freq / trinucleotide_freq)
-        values.append(freq)
-    return values
-
-
-def get_multisample_mutational_profile(samples_mutations, counts=False):
-    samples_profiles = {}
-
-    for sample, mutations in samples_mutations.items():
-        samples_profiles[sample] = get_mutational_profile(mutations, counts)
-
-    return samples_profiles
-
-
-def get_pooled_multisample_mutational_profile(samples_mutations, counts=False):
-    mutational_profile_dict = reduce(add, (Counter(dict(mutations)) for mutations in samples_mutations.values()))
-    return get_mutational_profile(mutational_profile_dict, counts)
+def get_frequencies(profiles):
+    """ Frequencies of mutations in each row of a matrix of mutation counts, rows without mutations stay zero """
+    profiles = np.asarray(profiles)
+    totals = profiles.sum(axis=-1, keepdims=True)
+    return profiles / np.maximum(totals, 1e-12)
+
+
+def get_mutational_profile(mutations, counts=False, scheme=None):
+    """
+    Mutational profile of a sample
+    mutations = array of channel codes of mutations (see mutagene.profiles.channels)
+        or dictionary of counts of mutations keyed by channel keys, e.g. p5 + p3 + x + y (see ChannelScheme.keys)
+    scheme = layout of channels (see get_channel_scheme), 96 channels by default
+    Returns array of mutation counts or frequencies
+    """
+    scheme = get_channel_scheme(scheme)
+    if isinstance(mutations, dict):
+        # counts are not necessarily integers (e.g. weighted mutations)
+        profile = np.array([mutations.get(channel, 0) for channel in scheme.keys], dtype=float)
+    else:
+        profile = get_codes_profile(mutations, scheme.n_channels)
+    return profile if counts else get_frequencies(profile)
+
+
+def get_multisample_mutational_profile(samples_mutations, counts=False, scheme=None):
+    """
+    Mutational profiles of multiple samples at once
+    samples_mutations = dictionary keyed by sample of mutations (see get_mutational_profile)
+    Returns samples x channels matrix of mutation counts or frequencies, rows follow the order of samples_mutations
+    """
+    scheme = get_channel_scheme(scheme)
+    if all(not isinstance(mutations, dict) for mutations in samples_mutations.values()):
+        profiles = get_codes_profiles(list(samples_mutations.values()), scheme.n_channels)
+    else:
+        profiles = np.array([get_mutational_profile(mutations, True, scheme) for mutations in samples_mutations.values()])
+    profiles = profiles.reshape(-1, scheme.n_channels)
+    return profiles if counts else get_frequencies(profiles)
+
+
+def get_grouped_profiles(profiles, groups):
+    """
+    Profiles pooled by groups of samples (e.g. cancer types) in one reduction
+    profiles = samples x channels matrix of mutation counts
+    groups = group of each sample (in the order of rows)
+    Returns tuple: sorted list of groups and groups x channels matrix of pooled mutation counts
+    """
+    profiles = np.atleast_2d(profiles)
+    groups = np.asarray(groups)
+    if len(groups) != profiles.shape[0]:
+        raise ValueError("Number of groups ({}) and samples ({}) do not match".format(len(groups), profiles.shape[0]))
+    if len(groups) == 0:
+        return [], np.zeros((0, profiles.shape[1]), dtype=profiles.dtype)
+    labels, inverse = np.unique(groups, return_inverse=True)
+    # rows sorted by group, each group is a contiguous block summed by reduceat
+    order = np.argsort(inverse, kind='stable')
+    starts = np.searchsorted(inverse[order], np.arange(len(labels)))
+    return labels.tolist(), np.add.reduceat(profiles[order], starts, axis=0)
+
+
+def get_grouped_multisample_mutational_profile(samples_mutations, groups, counts=False, scheme=None):
+    """
+    Mutational profiles of groups of samples, mutations of samples in a group are pooled together
+    samples_mutations = dictionary keyed by sample of mutations (see get_mutational_profile)
+    groups = dictionary of group of each sample, samples without a group are not included
+    Returns tuple: sorted list of groups and groups x channels matrix of mutation counts or frequencies
+    """
+    samples = [sample for sample in samples_mutations if sample in groups]
+    profiles = get_multisample_mutational_profile(
+        {sample: samples_mutations[sample] for sample in samples}, counts=True, scheme=scheme)
+    labels, pooled = get_grouped_profiles(profiles, [groups[sample] for sample in samples])
+    return labels, pooled if counts else get_frequencies(pooled)
+
+
+def get_pooled_multisample_mutational_profile(samples_mutations, counts=False, scheme=None):
+    """ Mutational profile of mutations of all samples pooled together (see get_multisample_mutational_profile) """
+    profile = get_multisample_mutational_profile(samples_mutations, counts=True, scheme=scheme).sum(axis=0)
+    return profile if counts else get_frequencies(profile)
+
+
+def get_resampled_profiles(profile, k):
+    """
+    k bootstrap replicates of a profile drawn at once, returns k x channels matrix of mutation counts
+    """
+    profile = np.array(profile)
+    N = np.sum(profile)
+    return multinomial(N, profile / N, size=k)
 
 
 def generate_resampled_profiles(profile, k):
-    profile = np.array(profile)
-    N = np.sum(profile)
-    new_profiles = multinomial(N, profile / N, size=k)
+    new_profiles = get_resampled_profiles(profile, k)
     for i in range(k):
         yield new_profiles[i]
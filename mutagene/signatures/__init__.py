@@ -1,25 +1,12 @@
+from mutagene.profiles.channels import get_channel_scheme
 
-from mutagene.dna import nucleotides
 
-
-def get_dummy_signatures_lists():
+def get_dummy_signatures_lists(scheme=None):
     """
     Generate 6 dummy signatures
     Each will have uniform non-zero frequencies corresponding to one mutation type
     Format them as lists
+    scheme = layout of channels (see mutagene.profiles.channels.get_channel_scheme), 96 channels by default
     """
-    dummy_signatures = []
-    for mutation in (("C", "A"), ("C", "T"), ("C", "G"), ("T", "A"), ("T", "C"), ("T", "G")):
-        values = []
-        for p5 in nucleotides:
-            for p3 in nucleotides:
-                for x in "CT":
-                    for y in nucleotides:
-                        if x != y:
-                            if mutation == (x, y):
-                                values.append(1.0 / 16.0)
-                            else:
-                                values.append(0.0)
-        name = mutation[0] + " to " + mutation[1]
-        dummy_signatures.append((name, values))
-    return dummy_signatures
+    names, W = get_channel_scheme(scheme).get_dummy_signatures()
+    return [(name, values.tolist()) for name, values in zip(names, W.T)]
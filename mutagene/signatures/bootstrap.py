@@ -0,0 +1,118 @@
+import numpy as np
+
+from mutagene.profiles.profile import get_resampled_profiles
+from mutagene.io.decomposition import get_bootstrap_stats
+from mutagene.signatures.identify import decompose_multisample_mutational_profile_counts
+from mutagene.signatures.signature_set import SignatureSet
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+def get_bootstrap_ci(sample_results, bootstrap_results, profile, method, level, signature_ids):
+    """
+    Confidence intervals of exposures ordered as signature_ids
+    Returns tuple: arrays of lower and upper bounds
+    """
+    df = get_bootstrap_stats(sample_results, bootstrap_results, profile, method, level, signature_ids)
+    df = df.set_index('signature').reindex(signature_ids)
+    return df['exposure_low'].values, df['exposure_high'].values
+
+
+def bootstrap_multisample_decomposition(
+    samples_profiles, samples_results, signatures, func="MLE", H0=None,
+    replicates=100, method='p', level=95, adaptive=False, block_size=50, ci_tol=0.005,
+    callback=None, batch_size=1000, **kwargs
+):
+    """
+    Bootstrap of signature decomposition for multiple samples, replicates of up to batch_size samples are fitted as one batch
+    samples_profiles = dictionary of sample profiles (mutation counts)
+    samples_results = dictionary of point estimates of samples, tuples of exposures and mutations arrays
+    signatures = SignatureSet or tuple of signatures matrix and list of signature names
+    H0 = optional dictionary of exposures used to warm-start fits of replicates of each sample
+    method, level = type ('t' or 'p') and confidence level of the intervals (see write_decomposition)
+    callback = optional function called with sample, its bootstrap results and number of replicates
+        as soon as the sample is done (e.g. DecompositionWriter.write), results of the sample are then released
+        and not returned, so that memory does not grow with the number of samples
+    Other keyword arguments are passed to decompose_multisample_mutational_profile_counts
+
+    In adaptive mode replicates are generated in blocks of block_size until all confidence bounds of exposures
+    of a sample move less than ci_tol after a block; replicates is then the maximum number of replicates
+
+    Returns tuple: dictionary of bootstrap results (tuples of replicates x K exposures and mutations arrays,
+    empty if callback is provided) and dictionary of the number of replicates used for each sample
+    """
+    samples = list(samples_profiles.keys())
+    batch_size = batch_size or max(len(samples), 1)
+    # signatures are prepared once for all blocks of replicates
+    signatures = SignatureSet.from_signatures(signatures)
+
+    bootstrap_results = {}
+    replicates_used = {}
+    for start in range(0, len(samples), batch_size):
+        _bootstrap_batch(
+            samples[start:start + batch_size], samples_profiles, samples_results, signatures, func, H0,
+            replicates, method, level, adaptive, block_size, ci_tol,
+            callback, bootstrap_results, replicates_used, **kwargs)
+    return bootstrap_results, replicates_used
+
+
+def _bootstrap_batch(
+    samples, samples_profiles, samples_results, signatures, func, H0,
+    replicates, method, level, adaptive, block_size, ci_tol,
+    callback, bootstrap_results, replicates_used, **kwargs
+):
+    """ Bootstrap of a batch of samples (see bootstrap_multisample_decomposition), fills results and replicates_used """
+    signature_names = signatures.names
+    if not adaptive:
+        block_size = replicates
+
+    bootstrap_exposures = {sample: [] for sample in samples}
+    bootstrap_mutations = {sample: [] for sample in samples}
+    bounds = {}
+
+    def finish(sample):
+        result = np.vstack(bootstrap_exposures.pop(sample)), np.vstack(bootstrap_mutations.pop(sample))
+        if callback is None:
+            bootstrap_results[sample] = result
+        else:
+            callback(sample, result, replicates_used[sample])
+
+    active = list(samples)
+    n = 0
+    while len(active) > 0 and n < replicates:
+        k = min(block_size, replicates - n)
+        V = np.vstack([get_resampled_profiles(samples_profiles[sample], k) for sample in active])
+        block_H0 = None if H0 is None else np.repeat([H0[sample] for sample in active], k, axis=0)
+
+        exposures, mutations, metrics = decompose_multisample_mutational_profile_counts(
+            V, signatures, func, H0=block_H0, diagnostics=False, **kwargs)
+        n += k
+        logger.debug("Bootstrap: {} replicates of {} samples, {} solver iterations per replicate".format(
+            n, len(active), np.mean(metrics['Iterations'])))
+
+        converged = set()
+        for i, sample in enumerate(active):
+            bootstrap_exposures[sample].append(exposures[i * k: (i + 1) * k])
+            bootstrap_mutations[sample].append(mutations[i * k: (i + 1) * k])
+            replicates_used[sample] = n
+            if not adaptive or n >= replicates:
+                continue
+
+            low, high = get_bootstrap_ci(
+                samples_results[sample],
+                (np.vstack(bootstrap_exposures[sample]), np.vstack(bootstrap_mutations[sample])),
+                samples_profiles[sample], method, level, signature_names)
+            if sample in bounds:
+                previous_low, previous_high = bounds[sample]
+                if max(np.nanmax(np.abs(low - previous_low)), np.nanmax(np.abs(high - previous_high))) < ci_tol:
+                    converged.add(sample)
+            bounds[sample] = low, high
+
+        for sample in active:
+            if sample in converged:
+                finish(sample)
+        active = [sample for sample in active if sample not in converged]
+
+    for sample in active:
+        finish(sample)
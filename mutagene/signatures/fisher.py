@@ -0,0 +1,96 @@
+import numpy as np
+from scipy import stats
+
+from mutagene.signatures.signature_set import MIN_FREQUENCY
+
+import logging
+logger = logging.getLogger(__name__)
+
+# exposures below are treated as zero: the bound constraint of the signature is active
+FISHER_ZERO_EXPOSURE = 1e-4
+
+
+def get_observed_information(v, h, W):
+    """
+    Observed Fisher information of multinomial mixture log likelihood sum(v * log(W h)) at exposures h
+    v = profile (mutation counts)
+    Returns tuple: K x K information matrix and K gradient of the log likelihood
+    """
+    reconstructed = np.maximum(W.dot(h), MIN_FREQUENCY)
+    gradient = W.T.dot(v / reconstructed)
+    weighted = W * np.sqrt(v / reconstructed ** 2)[:, np.newaxis]
+    return weighted.T.dot(weighted), gradient
+
+
+def get_free_covariance(information, free):
+    """
+    Covariance of exposures of free signatures (boolean array) restricted to the total exposure constraint:
+    exposures sum up to 1 at the optimum (scaling exposures up always increases the likelihood),
+    so only directions keeping the sum are allowed
+    Returns covariance matrix of free signatures (zero if there is a single free signature)
+    """
+    n = int(free.sum())
+    if n < 2:
+        return np.zeros((n, n))
+    # orthonormal basis of directions with zero sum
+    Z = np.linalg.qr(np.vstack([np.ones(n), np.eye(n)[:-1]]).T)[0][:, 1:]
+    reduced = Z.T.dot(information[np.ix_(free, free)]).dot(Z)
+    return Z.dot(np.linalg.pinv(reduced, hermitian=True)).dot(Z.T)
+
+
+def get_fisher_intervals(v, h, W, level=95):
+    """
+    Approximate confidence intervals of exposures from the observed Fisher information at the maximum likelihood
+    exposures h of profile v (mutation counts) with signatures W (including dummy signatures if they were fitted)
+
+    Exposures of free signatures get Wald intervals h +/- z se, standard errors are computed from the information
+    restricted to directions keeping the total exposure. Lower bounds are clipped at 0 and upper bounds at 1
+    Signatures at the bound (exposure below FISHER_ZERO_EXPOSURE) have lower bound 0, their upper bound is
+    the exposure at which the quadratic approximation of the profile log likelihood drops by z^2 / 2,
+    which includes the first-order decrease (the signature is not favored by the data at the optimum)
+
+    Returns tuple: arrays of lower and upper bounds of K exposures
+    """
+    v = np.asarray(v, dtype=float)
+    h = np.asarray(h, dtype=float)
+    z = stats.norm.ppf((1.0 + level / 100.0) / 2.0)
+    low = np.zeros_like(h)
+    high = np.zeros_like(h)
+    if v.sum() == 0:
+        return low, high
+
+    information, gradient = get_observed_information(v, h, W)
+    free = h >= FISHER_ZERO_EXPOSURE
+    if not free.any():
+        free[np.argmax(h)] = True
+
+    covariance = get_free_covariance(information, free)
+    se = np.sqrt(np.clip(np.diag(covariance), 0.0, None))
+    low[free] = np.clip(h[free] - z * se, 0.0, None)
+    high[free] = np.clip(h[free] + z * se, None, 1.0)
+
+    # Lagrange multiplier of the total exposure constraint: gradient of free signatures (equal to number of mutations)
+    multiplier = np.mean(gradient[free])
+    for j in np.flatnonzero(~free):
+        extended = free.copy()
+        extended[j] = True
+        variance = get_free_covariance(information, extended)[np.sum(extended[:j])][np.sum(extended[:j])]
+        slope = max(multiplier - gradient[j], 0.0)
+        if variance <= 0.0:
+            high[j] = 0.0 if slope > 0.0 else 1.0
+            continue
+        # root of slope * t + t^2 / (2 variance) = z^2 / 2
+        high[j] = min(variance * (np.sqrt(slope ** 2 + z ** 2 / variance) - slope), 1.0)
+    return low, high
+
+
+def get_multisample_fisher_intervals(V, H, W, level=95):
+    """
+    Fisher information confidence intervals (see get_fisher_intervals) of exposures H (samples x K)
+    of profiles V (samples x 96 mutation counts)
+    Returns tuple: samples x K lower and upper bounds
+    """
+    bounds = [get_fisher_intervals(v, h, W, level) for v, h in zip(V, H)]
+    low = np.array([b[0] for b in bounds]).reshape(np.shape(H))
+    high = np.array([b[1] for b in bounds]).reshape(np.shape(H))
+    return low, high
@@ -1,5 +1,8 @@
-import urllib
 import math
+import os
+from functools import partial
+
+from multiprocessing import Pool
 
 import numpy as np
 
@@ -10,7 +13,11 @@ from scipy.spatial.distance import cosine
 # from scipy.optimize import fmin_cobyla
 from scipy.stats import entropy
 
-from mutagene.signatures import get_dummy_signatures_lists
+from mutagene.signatures.solvers import em_exposures, fista_exposures, fista_quadratic_exposures, row_dot
+from mutagene.signatures.results import DecompositionResult
+from mutagene.signatures.selection import select_signatures, get_selection_context, SELECTION_DIRECTIONS
+from mutagene.signatures.signature_set import SignatureSet, MIN_FREQUENCY, get_dummy_matrix
+from mutagene.signatures.signature_set import get_fingerprint_url, get_constraints_and_bounds  # noqa: F401
 
 import logging
 logger = logging.getLogger(__name__)
@@ -42,6 +49,17 @@ def DivergenceKL(x, A, b):
     return entropy(v, b)
 
 
+def DerDivergenceKL(x, A, b):
+    """ gradient of DivergenceKL """
+    b = b + 1e-17
+    v = A.dot(x) + 1e-17
+    p = v / v.sum()
+    q = b / b.sum()
+    log_ratio = np.log(p / q)
+    kl = np.sum(p * log_ratio)
+    return A.T.dot((log_ratio - kl) / v.sum())
+
+
 # Define minimization function
 def DivergenceJS(x, A, b):
     b = b + 1e-17
@@ -50,11 +68,37 @@ def DivergenceJS(x, A, b):
     return 0.5 * (entropy(v, m) + entropy(b, m))
 
 
+def DerDivergenceJS(x, A, b):
+    """ gradient of DivergenceJS """
+    b = b + 1e-17
+    v = A.dot(x) + 1e-17
+    m = (v + b) / 2.0
+    p = v / v.sum()
+    q = m / m.sum()
+    log_ratio = np.log(p / q)
+    kl = np.sum(p * log_ratio)
+    # derivatives of KL(v||m) w.r.t. v and of KL(v||m) + KL(b||m) w.r.t. m (dm/dv = 1/2)
+    dv = (log_ratio - kl) / v.sum()
+    dm = 2.0 / m.sum() - (p + b / b.sum()) / m
+    return A.T.dot(0.5 * (dv + 0.5 * dm))
+
+
 def Cos(x, A, b):
     """ cosine distance """
     return cosine(A.dot(x), b)
 
 
+def DerCos(x, A, b):
+    """ gradient of Cos """
+    u = A.dot(x)
+    u_norm = np.linalg.norm(u)
+    b_norm = np.linalg.norm(b)
+    if u_norm == 0.0 or b_norm == 0.0:
+        return np.zeros_like(x)
+    du = -(b / (u_norm * b_norm) - u.dot(b) * u / (u_norm ** 3 * b_norm))
+    return A.T.dot(du)
+
+
 def Elastic(x, A, b):
     """ elastic net """
     alpha = 1.0
@@ -71,25 +115,54 @@ def Elastic(x, A, b):
     return objective
 
 
+def DerElastic(x, A, b):
+    """ gradient of Elastic, regularization term is piecewise constant """
+    return DerFrobenius(x, A, b) / (0.5 * b.sum())
+
+
 # Define minimization function
 def Frobenius(x, A, b):
     return np.linalg.norm(A.dot(x) - b)
 
 
+def DerFrobenius(x, A, b):
+    """ gradient of Frobenius """
+    residuals = A.dot(x) - b
+    norm = np.linalg.norm(residuals)
+    if norm == 0.0:
+        return np.zeros_like(x)
+    return A.T.dot(residuals) / norm
+
+
 # Define minimization function
 def FrobeniusZero(x, A, b):
     b_hat = A.dot(x)
     b_hat[b == 0.0] = 0.0
-    b_hat /= b_hat.sum()
+    total = b_hat.sum()
+    if total > 0.0:
+        b_hat /= total
     error = b - b_hat
     return np.linalg.norm(error)
 
 
-# def DerNegLogLik(x, A, b):    
-#     print(b / A.dot(x))
-#     DLL = - np.ma.divide(b, A.dot(x)).filled(0)
-#     print(x, DLL)
-#     return DLL
+def DerFrobeniusZero(x, A, b):
+    """ gradient of FrobeniusZero """
+    mask = b != 0.0
+    b_hat = np.where(mask, A.dot(x), 0.0)
+    total = b_hat.sum()
+    b_hat /= total
+    error = b_hat - b
+    norm = np.linalg.norm(error)
+    if norm == 0.0:
+        return np.zeros_like(x)
+    d_hat = error / norm
+    # b_hat = masked(A x) / sum(masked(A x))
+    return A.T.dot(np.where(mask, (d_hat - d_hat.dot(b_hat)) / total, 0.0))
+
+
+def _der_loglik(x, A, b):
+    """ gradient of -sum(b * log(A x)) """
+    return -A.T.dot(b / np.maximum(A.dot(x), MIN_FREQUENCY))
 
 
 def NegLogLik(x, A, b):
@@ -106,12 +179,22 @@ def NegLogLik(x, A, b):
     if x.sum() > 1.0:
         x /= x.sum()
 
-    LL = np.sum(b * np.ma.log(A.dot(x)).filled(0.0))
+    LL = np.sum(b * np.log(np.maximum(A.dot(x), MIN_FREQUENCY)))
 
     # print("NegLL\t{}\t{}\t{}".format(len(x), "\t".join(map(lambda a: "{:.2f}".format(a), x)), -LL))
     return -LL
 
 
+def DerNegLogLik(x, A, b):
+    """ gradient of NegLogLik, accounting for normalization of x when x sums up to more than 1 """
+    total = x.sum()
+    if total > 1.0:
+        y = x / total
+        dy = _der_loglik(y, A, b)
+        return (dy - dy.dot(y)) / total
+    return _der_loglik(x, A, b)
+
+
 def NegLogLikOld(x, A, b):
     """
     Log Likelihood of a mixture of multinomials
@@ -130,12 +213,19 @@ def NegLogLikOld(x, A, b):
     if np.sum(x) > 1.0:
         return 1000
 
-    LL = np.sum(b * np.ma.log(A.dot(x)).filled(0))
+    LL = np.sum(b * np.log(np.maximum(A.dot(x), MIN_FREQUENCY)))
 
     # print("LOG\t{}\t{}\t{}".format(len(x), "\t".join(map(lambda a: "{:.2f}".format(a), x)), LL))
     return -LL
 
 
+def DerNegLogLikOld(x, A, b):
+    """ gradient of NegLogLikOld """
+    if np.sum(x) > 1.0:
+        return np.zeros_like(x)
+    return _der_loglik(x, A, b)
+
+
 def count_threshold(x, threshold=10e-6):
     """ count the number of above-threshold elements in an array """
     return np.sum(x > threshold)
@@ -172,6 +262,14 @@ def BIC(x, A, b):
     return 2 * NegLogLik(x, A, b) + k * np.log(n)
 
 
+def DerInformationCriterion(x, A, b):
+    """
+    gradient of AIC, AICc and BIC
+    penalty terms depend only on the number of non-zero exposures and are piecewise constant
+    """
+    return 2 * DerNegLogLik(x, A, b)
+
+
 IDENTIFY_MIN_FUNCTIONS = {
     'frobenius': Frobenius,
     'frobeniuszero': FrobeniusZero,
@@ -190,13 +288,824 @@ IDENTIFY_MIN_FUNCTIONS = {
     'bicz': BIC,  # BIC with added context-independent signatures (different name Z given for benchmarking)
 }
 
+# analytic gradients passed to the optimizer as jac
+IDENTIFY_MIN_GRADIENTS = {
+    Frobenius: DerFrobenius,
+    FrobeniusZero: DerFrobeniusZero,
+    Cos: DerCos,
+    Elastic: DerElastic,
+    DivergenceKL: DerDivergenceKL,
+    DivergenceJS: DerDivergenceJS,
+    NegLogLik: DerNegLogLik,
+    NegLogLikOld: DerNegLogLikOld,
+    AIC: DerInformationCriterion,
+    AICc: DerInformationCriterion,
+    BIC: DerInformationCriterion,
+}
+
+# optimization backends, EM is only applicable to likelihood-based functions
+IDENTIFY_SOLVERS = ('slsqp', 'em', 'fista')
+EM_FUNCTIONS = (NegLogLik, AIC, AICc, BIC)
+# accelerated projected gradient is available for smooth objectives
+FISTA_FUNCTIONS = (Frobenius, FrobeniusZero, Cos, DivergenceKL, DivergenceJS)
+
+# screens of signatures before the fit: NNLS support or members of clusters with active representatives
+PRESCREEN_METHODS = ('nnls', 'clusters')
+
+# information criteria available for stepwise selection of signatures
+SELECTION_FUNCTIONS = {AIC: 'AIC', AICc: 'AICc', BIC: 'BIC'}
+
+# exposures of a warm start are lifted off zero: EM keeps zero exposures at zero
+# and SLSQP tends to keep bounds active when it starts on them
+WARM_START_FLOOR = 1e-3
+
+
+def add_dummy_signatures(W):
+    """
+    Append 6 dummy signatures (one per mutation type) as extra columns of signatures matrix W
+    """
+    return np.hstack([W, get_dummy_matrix(np.shape(W)[0])])
+
+
+def get_initial_guess(W, v_freq):
+    """
+    Initial guess of exposures with NNLS, normalized if exposures sum up to more than 1
+    """
+    # DATA, residuals = nnls(W.T, X.T.ravel())
+    h0, rnorm = nnls(W, v_freq)
+    if h0.sum() > 1.0:
+        h0 = h0.ravel() / h0.sum()
+
+    # not sure if we need this failsafe option:
+    # if np.isnan(h0.sum()):
+    #     h0 = np.ones(h0.shape[0]) / h0.shape[0]
+    return h0
+
+
+def get_initial_guesses(W, V_freq, gram=None, tol=1e-6, max_iter=1000):
+    """
+    Initial guesses of exposures of many samples at once: least squares exposures over the capped simplex
+    (NNLS exposures normalized to sum up to at most 1, as in get_initial_guess) fitted with projected gradient
+    for all rows of V_freq together, each step is a product with K x K Gram matrix of signatures shared by samples
+    gram = tuple of Gram matrix and its largest eigenvalue (see SignatureSet.get_gram), computed if not provided
+    Products are computed row by row, so the initial guess of a sample does not depend on the batch it is fitted in,
+    exposures are lifted off zero as warm starts (see get_warm_start)
+    Returns samples x K initial exposures
+    """
+    if gram is None:
+        G = W.T.dot(W)
+        gram = G, np.linalg.eigvalsh(G)[-1]
+    G, L = gram
+    V_freq = np.atleast_2d(V_freq)
+    H, _ = fista_quadratic_exposures(G, row_dot(V_freq, W), L, tol=tol, max_iter=max_iter, reproducible=True)
+    return get_warm_start(H, V_freq.shape[0], W, W.shape[1])
+
+
+def get_screened_signatures(W, v, fixed, margin=3, replicates=0, random_state=None):
+    """
+    Cheap screen of signatures before the fit: signatures with non-zero NNLS exposures of profile v
+    (and of replicates bootstrap-resampled profiles, if requested) are kept, along with margin pruned signatures
+    with the largest gradient of NNLS residual W.T (v - W h) (closest to entering the NNLS solution)
+    v = profile (mutation counts)
+    fixed = boolean array of signatures that are always kept (e.g. dummy signatures)
+    Returns boolean array of signatures kept
+    """
+    v_freq = v / v.sum()
+    h, _ = nnls(W, v_freq)
+    keep = fixed | (h > 0.0)
+
+    if replicates > 0:
+        if not isinstance(random_state, np.random.RandomState):
+            random_state = np.random.RandomState(random_state)
+        for profile in random_state.multinomial(int(v.sum()), v_freq, size=replicates):
+            keep |= nnls(W, profile / profile.sum())[0] > 0.0
+
+    pruned = np.flatnonzero(~keep)
+    if margin > 0 and len(pruned) > 0:
+        gradient = W[:, pruned].T.dot(v_freq - W.dot(h))
+        keep[pruned[np.argsort(-gradient)[:margin]]] = True
+    return keep
+
+
+def get_warm_start(H0, n_samples, W, n_signatures):
+    """
+    Initial exposures for a batch of samples from previously estimated exposures H0
+    H0 = samples x K exposures or a single vector of K exposures shared by all samples,
+        K is either the number of signatures or the number of columns of W (with dummy signatures)
+    If H0 does not include dummy signatures, the unexplained part of exposures is spread evenly across them
+    All exposures are lifted by WARM_START_FLOOR so that signatures absent from H0 can still enter the fit
+    """
+    H0 = np.clip(np.array(H0, dtype=float), 0.0, 1.0)
+    H0 = np.broadcast_to(H0, (n_samples, H0.shape[-1])).copy()
+
+    n_dummy = W.shape[1] - n_signatures
+    if H0.shape[1] == n_signatures and n_dummy > 0:
+        unexplained = np.clip(1.0 - H0.sum(axis=1, keepdims=True), 0.0, None)
+        H0 = np.hstack([H0, np.repeat(unexplained / n_dummy, n_dummy, axis=1)])
+    if H0.shape[1] != W.shape[1]:
+        raise ValueError("Initial exposures should have {} or {} columns".format(n_signatures, W.shape[1]))
+
+    H0 += WARM_START_FLOOR
+    total = H0.sum(axis=1, keepdims=True)
+    return np.where(total > 1.0, H0 / total, H0)
+
+
+def get_fit_metrics(H, W, V_target, V_freq):
+    """
+    Goodness of fit of profiles reconstructed from exposures, one value per sample
+    H = samples x signatures exposures
+    W = 96 channels x signatures
+    V_target = samples x 96 channels profiles the likelihood is calculated for (counts or frequencies)
+    V_freq = samples x 96 channels profiles normalized to frequencies
+    Returns dictionary of arrays keyed by metric name
+    """
+    H = np.atleast_2d(H)
+    total = H.sum(axis=1, keepdims=True)
+    H = np.where(total > 1.0, H / np.maximum(total, 1.0), H)
+
+    reconstructed = H.dot(W.T)
+
+    # floored as in NegLogLik so that channels left at zero are penalized the same way as in single-profile fits
+    ll = np.sum(V_target * np.log(np.maximum(reconstructed, MIN_FREQUENCY)), axis=1)
+    frobenius = np.linalg.norm(reconstructed - V_freq, axis=1)
+
+    b_hat = np.where(V_freq == 0.0, 0.0, reconstructed)
+    # profiles without mutations or reconstructed without any of their channels stay zero
+    b_hat_total = b_hat.sum(axis=1, keepdims=True)
+    b_hat = np.divide(b_hat, b_hat_total, out=np.zeros_like(b_hat), where=b_hat_total > 0.0)
+    frobeniuszero = np.linalg.norm(V_freq - b_hat, axis=1)
+
+    b = V_freq + 1e-17
+    v = reconstructed + 1e-17
+    m = (v + b) / 2.0
+    divergencejs = 0.5 * (entropy(v, m, axis=1) + entropy(b, m, axis=1))
+    divergencekl = entropy(v, b, axis=1)
+
+    return {
+        'LogLik': ll,
+        'Frobenius': frobenius,
+        'FrobeniusZero': frobeniuszero,
+        'DivergenceJS': divergencejs,
+        'DivergenceKL': divergencekl,
+    }
+
+
+def get_objective_values(min_func, H, W, V_target):
+    """
+    Values of min_func for rows of exposures H, V_target = profiles (one per row) or a single profile shared by all rows
+    Likelihood-based functions and Frobenius are evaluated for all rows at once, other functions row by row
+    Returns array of values, one per row
+    """
+    H = np.atleast_2d(H)
+    V_target = np.broadcast_to(V_target, (H.shape[0], W.shape[0]))
+    if min_func in (NegLogLik, AIC, AICc, BIC):
+        total = H.sum(axis=1, keepdims=True)
+        H_normalized = np.where(total > 1.0, H / np.maximum(total, 1.0), H)
+        values = -np.sum(V_target * np.log(np.maximum(H_normalized.dot(W.T), MIN_FREQUENCY)), axis=1)
+        if min_func is NegLogLik:
+            return values
+        k = np.sum(H > 10e-6, axis=1)  # see count_threshold
+        n = V_target.sum(axis=1)
+        if min_func is BIC:
+            return 2 * values + k * np.log(n)
+        values = 2 * values + 2 * k
+        if min_func is AICc:
+            corrected = n - k - 1 > 0
+            values[corrected] += 2 * k[corrected] * (k[corrected] + 1) / (n[corrected] - k[corrected] - 1)
+        return values
+    if min_func is Frobenius:
+        return np.linalg.norm(H.dot(W.T) - V_target, axis=1)
+    return np.array([min_func(h.copy(), W, v_target) for h, v_target in zip(H, V_target)])
+
+
+def get_profile_fit_metrics(h, W, v_target, v_freq):
+    """
+    Goodness of fit of a single profile reconstructed from exposures h (see get_fit_metrics for multiple samples)
+    Returns dictionary keyed by metric name
+    """
+    h = h.copy()
+    return {
+        'LogLik': -NegLogLik(h, W, v_target),  # h is normalized in place if exposures sum up to more than 1
+        'Frobenius': Frobenius(h, W, v_freq),
+        'FrobeniusZero': FrobeniusZero(h, W, v_freq),
+        'DivergenceJS': DivergenceJS(h, W, v_freq),
+        'DivergenceKL': DivergenceKL(h, W, v_freq),
+    }
+
+
+def get_target_profile(min_func, v, v_freq):
+    """
+    Likelihood-based functions are minimized for counts, other functions for frequencies
+    """
+    if min_func in (NegLogLik, AIC, AICc, BIC):
+        return v
+    return v_freq
+
+
+def check_solver(min_func, solver):
+    if solver not in IDENTIFY_SOLVERS:
+        raise ValueError("Unknown solver {}, only {} are recognized".format(solver, ", ".join(IDENTIFY_SOLVERS)))
+    if solver == 'em' and min_func not in EM_FUNCTIONS:
+        raise ValueError("EM solver is only available for likelihood-based methods (MLE, AICc, BIC)")
+    if solver == 'fista' and min_func not in FISTA_FUNCTIONS:
+        raise ValueError("FISTA solver is only available for Frobenius, FrobeniusZero, Cos, KL and JS methods")
+
+
+def check_selection(min_func, selection):
+    if selection is None:
+        return
+    if selection not in SELECTION_DIRECTIONS:
+        raise ValueError("Unknown selection {}, only {} are recognized".format(selection, ", ".join(SELECTION_DIRECTIONS)))
+    if min_func not in SELECTION_FUNCTIONS:
+        raise ValueError("Stepwise selection of signatures is only available for AICc and BIC methods")
+
+
+def check_prescreen(prescreen, selection, global_optimization):
+    if prescreen and prescreen is not True and prescreen not in PRESCREEN_METHODS:
+        raise ValueError("Unknown prescreen {}, only {} are recognized".format(prescreen, ", ".join(PRESCREEN_METHODS)))
+    if prescreen and (selection is not None or global_optimization):
+        raise ValueError("Pre-screening of signatures is not available with stepwise selection and global optimization")
+
+
+def get_selection_pool(jobs, W):
+    """ Pool of processes fitting candidate subsets of select_signatures, None if a single process is requested """
+    jobs = get_jobs(jobs)
+    if jobs == 1:
+        return None
+    initializer, initargs = get_selection_context(W)
+    return Pool(jobs, initializer=initializer, initargs=initargs)
+
+
+def is_improved_exposure(min_func, h, h0, W, v_target):
+    """
+    SLSQP may stop in line search (e.g. positive directional derivative) close to the optimum,
+    the solution is still accepted if it is feasible and better than the initial guess
+    """
+    if not np.all(np.isfinite(h)):
+        return False
+    if np.any(h < -1e-8) or h.sum() > 1.0 + 1e-6:
+        return False
+    return min_func(h.copy(), W, v_target) <= min_func(h0.copy(), W, v_target)
+
+
+def minimize_exposure(min_func, h0, W, v_target, bounds, constraints):
+    """
+    Local minimization of min_func with SLSQP starting from initial guess h0
+    using analytic gradient of min_func if available (see IDENTIFY_MIN_GRADIENTS)
+    Falls back to normalized initial guess if minimization does not converge
+    Returns tuple: exposures and number of iterations
+    """
+    jac = IDENTIFY_MIN_GRADIENTS.get(min_func)
+    options = {'maxiter': 500}
+    if jac is not None and min_func not in (AIC, AICc, BIC, Elastic):
+        # with exact gradients iterations are cheap, use tighter tolerance to avoid premature termination
+        # (not for objectives with piecewise constant penalty for the number of signatures)
+        options['ftol'] = 1e-10
+
+    minout = minimize(
+        min_func, h0, args=(W, v_target),
+        jac=jac,
+        method='SLSQP',
+        bounds=bounds, constraints=constraints,
+        options=options
+    )
+
+    if minout.success or is_improved_exposure(min_func, minout.x, h0, W, v_target):
+        logger.debug("MINIMIZATION: {} {}".format(minout.message, minout.nit))
+        h = minout.x
+        logger.debug("MAX LIK {} {}".format(h, round(-NegLogLik(h, W, v_target), 4)))
+    else:
+        logger.debug("MINIMIZATION FAILED:{} {}".format(minout.message, minout.nit))
+        # Minimization did not converge
+        # Use our initial guess, but normalize it:
+        h = h0.ravel() / h0.sum()
+    return h, minout.nit
+
+
+def minimize_exposure_fista(min_func, h0, W, v_target, tol=1e-6, max_iter=5000, gram=None):
+    """
+    Local minimization of min_func with accelerated projected gradient (FISTA) starting from initial guess h0
+    Frobenius is minimized as least squares using Gram matrix of signatures,
+    gram = tuple of Gram matrix and its largest eigenvalue (see SignatureSet.get_gram), computed if not provided
+    Returns tuple: exposures and number of iterations
+    """
+    if min_func is Frobenius:
+        if gram is None:
+            G = W.T.dot(W)
+            gram = G, np.linalg.eigvalsh(G)[-1]
+        G, L = gram
+        H, iterations = fista_quadratic_exposures(G, W.T.dot(v_target), L, H0=h0, tol=tol, max_iter=max_iter)
+        return H[0], iterations[0]
+
+    grad = IDENTIFY_MIN_GRADIENTS[min_func]
+    return fista_exposures(
+        lambda x: min_func(x, W, v_target), lambda x: grad(x, W, v_target),
+        h0, tol=tol, max_iter=max_iter)
+
+
+def fit_exposure(min_func, h0, W, v_target, bounds, constraints, solver="slsqp", tol=1e-6, max_iter=5000, gram=None):
+    """
+    Local minimization of min_func from initial guess h0 with SLSQP or FISTA solver
+    Returns tuple: exposures and number of iterations
+    """
+    if solver == 'em':
+        # exposures starting at zero stay at zero in EM
+        h0 = get_warm_start(h0, 1, W, W.shape[1])
+        H, iterations = em_exposures(v_target, W, H0=h0, tol=tol, max_iter=max_iter, min_frequency=MIN_FREQUENCY)
+        return H[0], iterations[0]
+    if solver == 'fista':
+        return minimize_exposure_fista(min_func, h0, W, v_target, tol=tol, max_iter=max_iter, gram=gram)
+    return minimize_exposure(min_func, h0, W, v_target, bounds, constraints)
+
+
+def get_kkt_violations(min_func, h, W, v_target, mask, rtol=1e-3):
+    """
+    Pruned signatures (not in mask) violating optimality conditions of min_func at exposures h:
+    the objective decreases when a pruned signature enters with a gradient below the gradient of selected signatures
+    (exposure-weighted, Lagrange multiplier of the total exposure constraint)
+    """
+    grad = IDENTIFY_MIN_GRADIENTS[min_func](h.copy(), W, v_target)
+    total = h.sum()
+    threshold = grad.dot(h) / total if total > 0.0 else 0.0
+    return ~mask & (grad < threshold - rtol * np.abs(grad).mean())
+
+
+def get_representatives_mask(signature_set, fixed):
+    """ Boolean array of representatives of clusters of signatures (see SignatureSet) and fixed signatures """
+    mask = fixed.copy()
+    mask[:signature_set.n_signatures] = signature_set.representatives
+    return mask
+
+
+def get_cluster_screened_signatures(
+    min_func, W, v_target, v_freq, signature_set, fixed, solver="slsqp", tol=1e-6, max_iter=5000, min_exposure=0.01,
+    h0=None
+):
+    """
+    Screen of signatures with clusters of similar signatures (see SignatureSet): the profile is fitted
+    with one representative of each cluster first, all members of clusters with representatives
+    with exposure above min_exposure are kept
+    fixed = boolean array of signatures that are always kept (e.g. dummy signatures)
+    h0 = initial guess of exposures of representatives (see get_representatives_mask), fitted if not provided
+    Returns tuple: boolean array of signatures kept and number of iterations of the fit of representatives
+    """
+    n = signature_set.n_signatures
+    mask = get_representatives_mask(signature_set, fixed)
+    if h0 is None:
+        h0 = get_initial_guesses(W[:, mask], v_freq)[0]
+    constraints, bounds = get_constraints_and_bounds(int(mask.sum()))
+    h, iterations = fit_exposure(
+        min_func, h0, W[:, mask], v_target, bounds, constraints, solver=solver, tol=tol, max_iter=max_iter)
+
+    exposures = np.zeros(W.shape[1])
+    exposures[mask] = h
+    active = np.unique(signature_set.clusters[exposures[:n] > min_exposure])
+    keep = fixed.copy()
+    keep[:n] = np.isin(signature_set.clusters, active)
+    return keep, iterations
+
+
+def get_prescreen_mask(
+    prescreen, min_func, W, v, v_target, signature_set, solver="slsqp", tol=1e-6, max_iter=5000,
+    margin=3, replicates=0, random_state=None, h0=None
+):
+    """
+    Signatures kept for the fit of profile v by NNLS screen (prescreen 'nnls' or True, see get_screened_signatures)
+    or by the fit of representatives of clusters of signatures (prescreen 'clusters', see get_cluster_screened_signatures,
+    h0 = initial guess of exposures of representatives)
+    Dummy signatures are always kept
+    Returns tuple: boolean array of signatures kept and number of iterations of the screen
+    """
+    fixed = np.arange(W.shape[1]) >= signature_set.n_signatures
+    if prescreen == 'clusters':
+        return get_cluster_screened_signatures(
+            min_func, W, v_target, v / v.sum(), signature_set, fixed, solver=solver, tol=tol, max_iter=max_iter, h0=h0)
+    return get_screened_signatures(W, v, fixed, margin=margin, replicates=replicates, random_state=random_state), 0
+
+
+def fit_screened_exposure(min_func, h0, W, v_target, mask, solver="slsqp", tol=1e-6, max_iter=5000):
+    """
+    Local minimization of min_func (see fit_exposure) over signatures selected by mask (see get_screened_signatures)
+    Pruned signatures violating optimality conditions at the solution (see get_kkt_violations) are added and refitted,
+    so the screen does not change the optimum
+    Returns tuple: exposures (zero for pruned signatures), number of iterations and signatures used in the final fit
+    """
+    total_iterations = 0
+    while True:
+        constraints, bounds = get_constraints_and_bounds(int(mask.sum()))
+        h_screened, iterations = fit_exposure(
+            min_func, h0[mask], W[:, mask], v_target, bounds, constraints, solver=solver, tol=tol, max_iter=max_iter)
+        total_iterations += iterations
+        h = np.zeros(W.shape[1])
+        h[mask] = h_screened
+
+        violations = get_kkt_violations(min_func, h, W, v_target, mask)
+        if not violations.any():
+            return h, total_iterations, mask
+        logger.debug("Screen: {} pruned signatures added".format(violations.sum()))
+        mask = mask | violations
+        h0 = h
+
+
+def get_random_starts(n, K, random_state=None):
+    """
+    n random initial exposures of K signatures sampled uniformly from the simplex (flat Dirichlet distribution)
+    """
+    if not isinstance(random_state, np.random.RandomState):
+        random_state = np.random.RandomState(random_state)
+    return random_state.dirichlet(np.ones(K), size=n)
+
+
+def minimize_exposure_multistart(
+    min_func, h0, W, v_target, bounds, constraints, n_starts=20, agreement=3, ftol=1e-6,
+    random_state=None, pool=None, batch_size=1, **solver_options
+):
+    """
+    Global minimization of min_func: local minimization (see fit_exposure) from initial guess h0
+    and from up to n_starts - 1 random initial exposures (see get_random_starts)
+    Starts are fitted in batches of batch_size, in parallel if pool is provided (see get_multistart_pool),
+    until agreement starts reach the best objective value found (within relative tolerance ftol)
+    Returns tuple: exposures, total number of iterations and number of starts used
+    """
+    starts = np.vstack([h0, get_random_starts(n_starts - 1, W.shape[1], random_state)])
+    best_h, best_value = None, np.inf
+    values = []
+    total_iterations = 0
+    n = 0
+    while n < n_starts:
+        batch = starts[n:n + batch_size]
+        n += len(batch)
+        if pool is None:
+            fits = [fit_exposure(min_func, h, W, v_target, bounds, constraints, **solver_options) for h in batch]
+        else:
+            fits = pool.map(_multistart_worker, [(h, v_target) for h in batch])
+
+        H = np.array([h for h, _ in fits])
+        total_iterations += sum(iterations for _, iterations in fits)
+        batch_values = get_objective_values(min_func, H, W, v_target)
+        values.extend(batch_values)
+        best = np.argmin(batch_values)
+        if batch_values[best] < best_value:
+            best_h, best_value = H[best], batch_values[best]
+
+        threshold = best_value + ftol * max(1.0, abs(best_value))
+        if np.sum(np.array(values) <= threshold) >= agreement:
+            break
+
+    logger.debug("Multistart: {} starts, best objective {}".format(n, best_value))
+    return best_h, total_iterations, n
+
+
+def get_multistart_pool(jobs, min_func, W, bounds, constraints, **solver_options):
+    """
+    Pool of processes for minimize_exposure_multistart, None if a single process is requested
+    Function, signatures, bounds and constraints are sent to each worker once, only starts and profiles with tasks
+    """
+    jobs = get_jobs(jobs)
+    if jobs == 1:
+        return None
+    context = (min_func, W, bounds, constraints, solver_options)
+    return Pool(jobs, initializer=_init_worker, initargs=(context, ))
+
+
+def get_jobs(jobs):
+    """ Number of worker processes, 0 or None means all available CPUs """
+    if not jobs:
+        return os.cpu_count() or 1
+    return max(1, jobs)
+
+
+# state shared with worker processes once, when the pool is created
+_worker_context = None
 
-def get_fingerprint_url(a):
-    data = {"s{}".format(i): v for i, v in enumerate(a)}
-    return urllib.parse.urlencode(data)
 
+def _init_worker(context):
+    global _worker_context
+    _worker_context = context
 
-def decompose_mutational_profile_counts(profile, signatures, func="Frobenius", others_threshold=0.05, global_optimization=None, enable_dummy=None):
+
+def _minimize_worker(i):
+    min_func, W, V_target, H0, masks, constraints, bounds, solver_options = _worker_context
+    if masks is not None:
+        return fit_screened_exposure(min_func, H0[i], W, V_target[i], masks[i], **solver_options)
+    return fit_exposure(min_func, H0[i], W, V_target[i], bounds, constraints, **solver_options)
+
+
+def _multistart_worker(task):
+    min_func, W, bounds, constraints, solver_options = _worker_context
+    h0, v_target = task
+    return fit_exposure(min_func, h0, W, v_target, bounds, constraints, **solver_options)
+
+
+def _decompose_worker(profile):
+    signatures, kwargs = _worker_context
+    return decompose_mutational_profile_counts(profile, signatures, **kwargs)
+
+
+def map_decompose_mutational_profile_counts(profiles, signatures, jobs=1, **kwargs):
+    """
+    Iterate decompose_mutational_profile_counts over profiles, optionally in a pool of jobs processes
+    Signatures and keyword arguments are sent to each worker process once, only profiles are sent with tasks
+    Results are yielded in the order of profiles
+    """
+    jobs = get_jobs(jobs)
+    if jobs == 1:
+        for profile in profiles:
+            yield decompose_mutational_profile_counts(profile, signatures, **kwargs)
+        return
+
+    with Pool(jobs, initializer=_init_worker, initargs=((signatures, kwargs), )) as pool:
+        for result in pool.imap(_decompose_worker, profiles, chunksize=8):
+            yield result
+
+
+def is_cacheable(random_state=None, global_optimization=False, prescreen=False, prescreen_replicates=0, **kwargs):
+    """
+    Whether results of a fit can be cached: random starts of global optimization and bootstrap replicates
+    of the screen give different results on every run unless random_state is a seed (integer)
+    """
+    randomized = global_optimization or (prescreen and prescreen_replicates > 0)
+    return not randomized or isinstance(random_state, (int, np.integer))
+
+
+def get_cached_exposures(cache, V, signature_set, func, enable_dummy, H0=None, **kwargs):
+    """
+    Exposures of samples (rows of V, mutation counts) taken from cache or fitted with
+    decompose_multisample_mutational_profile_counts (keyword arguments are decomposition options)
+    Results are keyed by the profile, signatures and options affecting the fit (see get_decomposition_keys),
+    profiles missing from the cache are fitted once per distinct profile and stored in the cache
+    Warm start H0 is only used for profiles that are fitted
+
+    Returns tuple: samples x K exposures (including dummy signatures) and dictionary of per-sample metrics,
+    'Cached' marks samples that were not fitted (cache hits and repeated profiles), their 'Iterations' are 0
+    """
+    W = signature_set.get_matrix(enable_dummy)
+    nonempty = V.sum(axis=1) > 0.0
+
+    options = dict(kwargs, func=func.lower(), enable_dummy=bool(enable_dummy))
+    options.pop('jobs', None)
+    if not isinstance(options.get('random_state'), (int, type(None))):
+        # results of random starts from a shared random generator are not reproducible
+        options['random_state'] = None
+
+    names = ['Iterations']
+    if kwargs.get('selection') is not None:
+        names.append('Fits')
+    elif kwargs.get('global_optimization'):
+        names.append('Starts')
+    if kwargs.get('prescreen'):
+        names.append('Pruned')
+
+    keys = cache.get_keys(V, signature_set.W, signature_set.names, options)
+    results = cache.get([key for key, keep in zip(keys, nonempty) if keep])
+
+    # identical profiles are fitted once
+    first = {}
+    for i in np.flatnonzero(nonempty):
+        if keys[i] not in results:
+            first.setdefault(keys[i], i)
+    rows = sorted(first.values())
+    if len(rows) > 0:
+        if H0 is not None:
+            H0 = np.broadcast_to(H0, (V.shape[0], np.shape(H0)[-1]))[rows]
+        exposures, _, metrics = decompose_multisample_mutational_profile_counts(
+            V[rows], signature_set, func, enable_dummy=enable_dummy, H0=H0, diagnostics=False, **kwargs)
+        H_fit = np.hstack([exposures, metrics['Unexplained']])
+        fitted = {keys[i]: (H_fit[j], {name: metrics[name][j] for name in names}) for j, i in enumerate(rows)}
+        cache.put(fitted)
+        results.update(fitted)
+    logger.debug("Decomposition cache: {} samples, {} fitted".format(np.sum(nonempty), len(rows)))
+
+    H = np.zeros((V.shape[0], W.shape[1]))
+    sample_metrics = {name: np.zeros(V.shape[0], dtype=int) for name in names}
+    for i in np.flatnonzero(nonempty):
+        H[i], values = results[keys[i]]
+        for name in names:
+            sample_metrics[name][i] = values[name]
+    cached = nonempty.copy()
+    cached[rows] = False
+    sample_metrics['Iterations'][cached] = 0
+    sample_metrics['Cached'] = cached
+    return H, sample_metrics
+
+
+def decompose_multisample_mutational_profile_counts(
+    profiles, signatures, func="MLE", enable_dummy=None,
+    solver="slsqp", tol=1e-6, max_iter=5000, jobs=1, H0=None, diagnostics=True,
+    global_optimization=False, n_starts=20, random_state=None, selection=None,
+    prescreen=False, prescreen_margin=3, prescreen_replicates=0, cache=None
+):
+    """
+    Decomposition of multiple samples at once
+    profiles = samples x channels matrix of mutation counts (96, 192 or 1536 channels, see mutagene.profiles.channels)
+    signatures = SignatureSet or tuple of channels x K signatures matrix and list of K signature names,
+        a SignatureSet is prepared once and can be reused across calls (a tuple is prepared on every call)
+    solver = 'slsqp' (constrained minimization of func), 'em' (likelihood-based functions only, all samples are fitted together)
+        or 'fista' (accelerated projected gradient for Frobenius, FrobeniusZero, Cos, KL and JS; Frobenius fits all samples together)
+    tol, max_iter = convergence tolerance and maximum number of iterations of EM and FISTA
+    jobs = number of processes per-sample fits (SLSQP, FISTA) are distributed across (0 for all CPUs)
+    H0 = initial exposures (warm start, see get_warm_start), e.g. point estimates when fitting bootstrap replicates.
+        If not provided, uniform exposures are used for EM and initial guesses of all samples are fitted at once
+        for other solvers (see get_initial_guesses)
+    SLSQP (and FISTA for functions other than Frobenius) still runs one local minimization per sample
+    from its initial guess, starts of global optimization are compared with the objective evaluated for all starts
+    of a batch at once (see get_objective_values). Augmented signatures matrix, Gram matrix, bounds and constraints
+    are taken from SignatureSet
+    diagnostics = when False, goodness of fit metrics (LogLik, Frobenius, ...) are not calculated
+    global_optimization = when True, each sample is fitted from up to n_starts initial guesses
+        (see minimize_exposure_multistart), starts of a sample are distributed across jobs processes,
+        random_state = seed or numpy RandomState of random starts
+    selection = 'forward', 'backward' or 'both' for stepwise selection of signatures minimizing AIC, AICc or BIC
+        (see select_signatures), candidate subsets of a step are distributed across jobs processes
+    prescreen = 'nnls' (or True) or 'clusters', each sample is fitted only with signatures passing a screen (see get_prescreen_mask):
+        NNLS screen with prescreen_margin extra signatures and prescreen_replicates bootstrap replicates
+        or the fit of representatives of clusters of similar signatures
+    cache = DecompositionCache (see mutagene.io.decomposition_cache): samples with results in the cache are not fitted,
+        identical profiles are fitted once (see get_cached_exposures). The cache is not used for random starts
+        and screened replicates without a seed (see is_cacheable)
+    Returns tuple: samples x K exposures, samples x K mutations and dictionary of fit metrics (arrays, one value per sample)
+    Number of iterations used for each sample is reported as metric 'Iterations'
+    (and number of starts as metric 'Starts' in global optimization mode, number of fitted subsets as 'Fits' in stepwise selection,
+    number of signatures pruned by the screen as 'Pruned', samples not fitted in this call as 'Cached' if cache is used)
+    """
+    signature_set = SignatureSet.from_signatures(signatures)
+    n_signatures = signature_set.n_signatures
+
+    if enable_dummy is None:
+        enable_dummy = True
+
+    W = signature_set.get_matrix(enable_dummy)
+    constraints, bounds = signature_set.get_constraints_and_bounds(enable_dummy)
+
+    V = np.asarray(profiles, dtype=float).reshape(-1, W.shape[0])
+    totals = V.sum(axis=1)
+    nonempty = totals > 0.0
+
+    V_freq = np.zeros_like(V)
+    V_freq[nonempty] = V[nonempty] / totals[nonempty, np.newaxis]
+
+    min_func = IDENTIFY_MIN_FUNCTIONS.get(func.lower(), Frobenius)
+    check_solver(min_func, solver)
+    check_selection(min_func, selection)
+    check_prescreen(prescreen, selection, global_optimization)
+    V_target = get_target_profile(min_func, V, V_freq)
+
+    if cache is not None and not is_cacheable(random_state, global_optimization, prescreen, prescreen_replicates):
+        logger.debug("Random starts or replicates without a seed, results are not cached")
+        cache = None
+    if cache is not None:
+        H, sample_metrics = get_cached_exposures(
+            cache, V, signature_set, func, enable_dummy, H0=H0, solver=solver, tol=tol, max_iter=max_iter, jobs=jobs,
+            global_optimization=global_optimization, n_starts=n_starts, random_state=random_state, selection=selection,
+            prescreen=prescreen, prescreen_margin=prescreen_margin, prescreen_replicates=prescreen_replicates)
+        return get_decomposition_results(H, W, V_target, V_freq, totals, n_signatures, sample_metrics, diagnostics)
+
+    if H0 is not None:
+        H0 = get_warm_start(H0, V.shape[0], W, n_signatures)
+    elif selection is None and (solver != 'em' or global_optimization):
+        # initial guesses of all samples at once, steps share Gram matrix of signatures
+        H0 = np.zeros((V.shape[0], W.shape[1]))
+        H0[nonempty] = get_initial_guesses(W, V_freq[nonempty], gram=signature_set.get_gram(enable_dummy))
+
+    masks = None
+    H = np.zeros((V.shape[0], W.shape[1]))
+    iterations = np.zeros(V.shape[0], dtype=int)
+
+    if prescreen:
+        random_state = np.random.RandomState(random_state)
+        masks = np.ones((V.shape[0], W.shape[1]), dtype=bool)
+        screen_iterations = np.zeros(V.shape[0], dtype=int)
+        H_screen = None
+        if prescreen == 'clusters':
+            # initial guesses of fits of representatives of clusters for all samples at once
+            representatives = get_representatives_mask(signature_set, np.arange(W.shape[1]) >= n_signatures)
+            H_screen = np.zeros((V.shape[0], representatives.sum()))
+            H_screen[nonempty] = get_initial_guesses(W[:, representatives], V_freq[nonempty])
+        for i in np.flatnonzero(nonempty):
+            masks[i], screen_iterations[i] = get_prescreen_mask(
+                prescreen, min_func, W, V[i], V_target[i], signature_set, solver=solver, tol=tol, max_iter=max_iter,
+                margin=prescreen_margin, replicates=prescreen_replicates, random_state=random_state,
+                h0=None if H_screen is None else H_screen[i])
+    if selection is not None:
+        fits = np.zeros(V.shape[0], dtype=int)
+        fixed = np.arange(W.shape[1]) >= n_signatures
+        pool = get_selection_pool(jobs, W)
+        try:
+            for i in np.flatnonzero(nonempty):
+                H[i], iterations[i], fits[i] = select_signatures(
+                    V[i], W, SELECTION_FUNCTIONS[min_func], fixed=fixed, direction=selection,
+                    tol=tol, max_iter=max_iter, min_frequency=MIN_FREQUENCY, pool=pool, batch_size=get_jobs(jobs))
+        finally:
+            if pool is not None:
+                pool.terminate()
+    elif global_optimization:
+        random_state = np.random.RandomState(random_state)
+        starts = np.zeros(V.shape[0], dtype=int)
+        gram = signature_set.get_gram(enable_dummy) if solver == 'fista' else None
+        solver_options = {'solver': solver, 'tol': tol, 'max_iter': max_iter, 'gram': gram}
+        pool = get_multistart_pool(jobs, min_func, W, bounds, constraints, **solver_options)
+        try:
+            for i in np.flatnonzero(nonempty):
+                H[i], iterations[i], starts[i] = minimize_exposure_multistart(
+                    min_func, H0[i], W, V_target[i], bounds, constraints, n_starts=n_starts,
+                    random_state=random_state, pool=pool, batch_size=get_jobs(jobs), **solver_options)
+        finally:
+            if pool is not None:
+                pool.terminate()
+    elif solver == 'em':
+        rows = np.flatnonzero(nonempty)
+        H_start = None if H0 is None else H0[rows]
+        if masks is not None:
+            # exposures starting at zero stay at zero: EM over the screened signatures only
+            H_start = masks[rows] * (1.0 if H_start is None else H_start)
+            H_start = H_start / H_start.sum(axis=1, keepdims=True)
+        while len(rows) > 0:
+            H[rows], n = em_exposures(V[rows], W, H0=H_start, tol=tol, max_iter=max_iter, min_frequency=MIN_FREQUENCY)
+            iterations[rows] += n
+            if masks is None:
+                break
+            # samples with pruned signatures violating optimality conditions are refitted with these signatures
+            violations = np.array([get_kkt_violations(min_func, H[i], W, V_target[i], masks[i]) for i in rows])
+            masks[rows] |= violations
+            rows = rows[violations.any(axis=1)]
+            H_start = np.where(masks[rows], np.maximum(H[rows], WARM_START_FLOOR), 0.0)
+            H_start = H_start / H_start.sum(axis=1, keepdims=True)
+    elif solver == 'fista' and min_func is Frobenius and masks is None:
+        # least squares: projected gradient steps for all samples at once are products with K x K Gram matrix
+        G, L = signature_set.get_gram(enable_dummy)
+        H[nonempty], iterations[nonempty] = fista_quadratic_exposures(
+            G, V_target[nonempty].dot(W), L, H0=H0[nonempty], tol=tol, max_iter=max_iter)
+    elif get_jobs(jobs) > 1:
+        indices = np.flatnonzero(nonempty)
+        solver_options = {'solver': solver, 'tol': tol, 'max_iter': max_iter}
+        context = (min_func, W, V_target, H0, masks, constraints, bounds, solver_options)
+        with Pool(get_jobs(jobs), initializer=_init_worker, initargs=(context, )) as pool:
+            for i, result in zip(indices, pool.imap(_minimize_worker, indices, chunksize=8)):
+                H[i], iterations[i] = result[:2]
+                if masks is not None:
+                    masks[i] = result[2]
+    else:
+        for i in np.flatnonzero(nonempty):
+            if masks is not None:
+                H[i], iterations[i], masks[i] = fit_screened_exposure(
+                    min_func, H0[i], W, V_target[i], masks[i], solver=solver, tol=tol, max_iter=max_iter)
+            else:
+                H[i], iterations[i] = fit_exposure(
+                    min_func, H0[i], W, V_target[i], bounds, constraints, solver=solver, tol=tol, max_iter=max_iter)
+
+    sample_metrics = {'Iterations': iterations}
+    if selection is not None:
+        sample_metrics['Fits'] = fits
+    elif global_optimization:
+        sample_metrics['Starts'] = starts
+    if masks is not None:
+        sample_metrics['Iterations'] += screen_iterations
+        sample_metrics['Pruned'] = np.sum(~masks[:, :n_signatures], axis=1)
+    return get_decomposition_results(H, W, V_target, V_freq, totals, n_signatures, sample_metrics, diagnostics)
+
+
+def get_decomposition_results(H, W, V_target, V_freq, totals, n_signatures, sample_metrics, diagnostics=True):
+    """
+    Results of decomposition of multiple samples from samples x K exposures H (including dummy signatures)
+    totals = numbers of mutations of samples
+    sample_metrics = dictionary of per-sample metrics of the fit (Iterations, ...) added to the metrics
+    Returns tuple: samples x K exposures, samples x K mutations and dictionary of metrics
+    (see decompose_multisample_mutational_profile_counts)
+    """
+    metrics = get_fit_metrics(H, W, V_target, V_freq) if diagnostics else {}
+    metrics.update(sample_metrics)
+    # exposures of dummy signatures (samples x 6, empty if dummy signatures are disabled)
+    metrics['Unexplained'] = H[:, n_signatures:]
+
+    exposures = H[:, :n_signatures]
+    N_mutations = np.ceil(totals)
+    mutations = np.round(N_mutations[:, np.newaxis] * exposures).astype(int)
+    return exposures, mutations, metrics
+
+
+def decompose_mutational_profile_counts(
+    profile, signatures, func="Frobenius", others_threshold=0.05, global_optimization=None, enable_dummy=None,
+    solver="slsqp", tol=1e-6, max_iter=5000, summary=True, diagnostics=True, n_starts=20, random_state=None, jobs=1,
+    selection=None, prescreen=False, prescreen_margin=3, prescreen_replicates=0
+):
+    """
+    Decomposition of a single mutational profile (mutation counts)
+    signatures = SignatureSet or tuple of 96 channels x K signatures matrix and list of K signature names,
+        a SignatureSet is prepared once and can be reused across calls (a tuple is prepared on every call)
+    summary = when False, only exposures and mutations are calculated (fast path for cohorts and bootstrap):
+        returns tuple of K exposures and K mutations arrays
+    diagnostics = when False, goodness of fit metrics (LogLik, Frobenius, ...) are not available in results,
+        otherwise they are computed on first access
+    global_optimization = when True, the profile is fitted from up to n_starts initial guesses
+        distributed across jobs processes (see minimize_exposure_multistart)
+    selection = 'forward', 'backward' or 'both' for stepwise selection of signatures minimizing AIC, AICc or BIC
+        (see select_signatures)
+    prescreen = 'nnls' (or True) or 'clusters', the profile is fitted only with signatures passing a screen (see get_prescreen_mask):
+        NNLS screen with prescreen_margin extra signatures and prescreen_replicates bootstrap replicates
+        or the fit of representatives of clusters of similar signatures
+    Returns tuple: exposures (including dummy signatures), summary (query and reconstructed profiles) and
+    results: DecompositionResult, which iterates as a list of dictionaries, one per signature, followed by metrics
+    """
 
     config = {
         'enable_dummy': True,
@@ -214,333 +1123,89 @@ def decompose_mutational_profile_counts(profile, signatures, func="Frobenius", o
         if func.lower().endswith('z'):
             config['enable_dummy'] = True
 
-    W = []
-    results = []
-
-    W, signature_names = list(signatures)
-    signature_names = signature_names[:]  # make a copy
-    for name in signature_names:
-        results.append({
-            'accession': 0,
-            'id': 0,
-            'pid': 0,
-            'name': name,
-            'annotation': '',
-            'score': 0.0,
-            'mutations': 0
-        })
-
-    # add dummy signatures
-    if config['enable_dummy']:
-        for i, (name, values) in enumerate(get_dummy_signatures_lists()):
-            dummy = "d" + str(i)
-            signature_names.append(dummy)
-            W = np.append(W.T, np.array([values, ]), axis=0).T
-            results.append({
-                'accession': 0,
-                'profile': get_fingerprint_url(values),
-                'id': 0,
-                'pid': 0,
-                'name': dummy,
-                'annotation': 'Dummy ' + name,
-                'score': 0.0,
-                'mutations': 0
-            })
-    # print(W)
-    # print(signature_names)
+    signature_set = SignatureSet.from_signatures(signatures)
+    W = signature_set.get_matrix(config['enable_dummy'])
 
     v = np.array([profile]).ravel()
     v_freq = v / v.sum()
 
-    # Initial guess with NNLS:
-    # DATA, residuals = nnls(W.T, X.T.ravel())
-    h0, rnorm = nnls(W, v_freq)
-    if h0.sum() > 1.0:
-        h0 = h0.ravel() / h0.sum()
-
-    # not sure if we need this failsafe option:
-    # if np.isnan(h0.sum()):
-    #     h0 = np.ones(h0.shape[0]) / h0.shape[0]
-
-    logger.debug("h0 {}".format(h0))
-
     min_func = IDENTIFY_MIN_FUNCTIONS.get(func.lower(), Frobenius)
+    check_solver(min_func, solver)
+    check_selection(min_func, selection)
+    check_prescreen(prescreen, selection, config['global_optimization'])
 
-    # if debug:
-    #     np.set_printoptions(precision=4)
-    #     print("--------------------------------------\n")
-    #     print("Signature", signatures)
-    #     print("NNLS", h0)
-    #     print("FRO", round(Frobenius(h0, W, v), 4), "DIV", round(DivergenceKL(h0, W, v), 4))
-
-    # Define constraints and bounds
-    # constraints = {'type': 'eq', 'fun': lambda x: np.sum(x) - 1}
-    constraints = {'type': 'ineq', 'fun': lambda x: 1.0 - np.sum(x)}
-    # bounds = [[0., None],[0., None],[0., None]]
+    constraints, bounds = signature_set.get_constraints_and_bounds(config['enable_dummy'])
 
-    # bounds = [[0., 1.0] for _ in range(h0.shape[0])]
-    bounds = [[0.0, 1.0] for _ in range(h0.shape[0])]
+    h0 = None
+    if selection is None and (solver != 'em' or config['global_optimization']):
+        # Initial guess, the same as for multiple samples (see get_initial_guesses):
+        h0 = get_initial_guesses(W, v_freq, gram=signature_set.get_gram(config['enable_dummy']))[0]
+        logger.debug("h0 {}".format(h0))
 
     # v == counts
     # v_freq == frequency (normalized counts)
-    if min_func in (NegLogLik, AIC, AICc, BIC):
-        v_target = v
-    else:
-        v_target = v_freq
-
-    def print_fun(x, f, accepted):
-        print("{} at minimum {} accepted {}".format(x, f, accepted))
-
-    class RandomDisplacementBounds(object):
-        """random displacement with bounds"""
-
-        def __init__(self, xmin=0.0, xmax=1.0, stepsize=0.3):
-            self.xmin = xmin
-            self.xmax = xmax
-            self.stepsize = stepsize
-
-        def __call__(self, x):
-            """take a random step but ensure the new position is within the bounds"""
-            if np.any(np.isnan(x)):
-                return x
-            while True:
-                xnew = x + np.random.uniform(-self.stepsize, self.stepsize, x.shape)
-                xnew = np.where(xnew < 0.0, 0.0, xnew)
-                if xnew.sum() > 1.0:
-                    xnew += 1.0 - xnew.sum()
-                xnew = np.abs(xnew)
-                if np.all(xnew <= self.xmax) and np.all(xnew >= self.xmin):
-                    break
-            return xnew
-
-    # class RandomDisplacementBounds(object):
-    #     """random displacement with bounds"""
-    #     def __init__(self, xmin, xmax, stepsize=0.1):
-    #         self.xmin = xmin
-    #         self.xmax = xmax
-    #         self.stepsize = stepsize
-
-    #     def __call__(self, x):
-    #         """take a random step but ensure the new position is within the bounds"""
-    #         while True:
-    #             # xnew = x + np.random.uniform(-self.stepsize, self.stepsize, x.shape)
-    #             inew = np.random.randint(0, x.shape[0])
-    #             xnew = x.copy()
-    #             xnew[inew] += np.random.uniform(-self.stepsize, self.stepsize)
-    #             # print("it", np.sum(xnew), xnew)
-    #             if np.all(xnew <= self.xmax) and np.all(xnew >= self.xmin) and np.sum(xnew) <= 1.0:
-    #                 break
-    #         return xnew
-
-    # define the new step taking routine and pass it to basinhopping
-    take_step = RandomDisplacementBounds()
-
-    def accept_test(f_new, x_new, f_old, x_old):
-        if np.any(np.isnan(x_new)):
-            return False
-        if x_new.sum() > 1.0:
-            return False
-        if np.any(x_new > 1.0) or np.any(x_new < 0.0) or np.any(np.isnan(x_new)):
-            return False
-        return True
-
-    def get_constraint(i, upper=True):
-        def a(x):
-            return 1.0 - x[i]
-
-        def b(x):
-            return x[i] - 0.0
-
-        return a if upper else b
-
-    cobyla_constraints = [
-        {'type': 'ineq', 'fun': lambda x: 1.0 - np.sum(x)}  # total upper
-    ]
-    for i in range(h0.shape[0]):
-        cobyla_constraints.append(
-            {'type': 'ineq', 'fun': get_constraint(i, True)}  # , 'jac': get_constraint(i, True)}  # upper
-        )
-        cobyla_constraints.append(
-            {'type': 'ineq', 'fun': get_constraint(i, False)}  # , 'jac': get_constraint(i, False)}  # lower
-        )
-
-    ##############################################################################
-    if config['global_optimization']:
-        # L-BFGS-B COBYLA SLSQP
-        """
-        minout = basinhopping(NegLogLik, h0, minimizer_kwargs={  # 'jac': DerNegLogLik,
-            'args': (W, v_target), 'method': 'SLSQP',
-            'constraints': cobyla_constraints, 'options': {'disp': False, 'ftol': 0.00001, 'eps': 0.0000001}}, niter=100, T=0.001, take_step=take_step, accept_test=accept_test, callback=print_fun)  #, take_step=take_step , callback=print_fun)
-
-        if debug:
-            print(minout, type(minout))
-            print(minout.message)
-            # print("Status: # failures", minout.res.minimization_failures)
-
-        if np.any(np.isnan(minout.x)):
-            print("FAILED!!!!!!!!!!!!!!!!")
-            if debug:
-                print("MINIMIZATION FAILED:", minout.message, minout.nit)
-            # fallback decomposition:
-            h = h0.ravel() / h0.sum()
-            # h = h0.ravel() * 0.0
-        else:
-            h = minout.x
-            if debug:
-                print("MAX LIK", h, round(-NegLogLik(h, W, v_target), 4))
-                print("MIN FRO", h, round(min_func(h, W, v_target), 4))
-                print("FRO", round(Frobenius(h, W, v_target), 4), "DIV", round(DivergenceKL(h, W, v), 4))
-        """
-        # Bayesian Optimization
-        from bayes_opt import BayesianOptimization
-        from functools import partial
-
-        optimizer = BayesianOptimization(
-            f=partial(min_func, A=W, b=v_target),
-            # pbounds=pbounds,
-            verbose=2,  # verbose = 1 prints only when a maximum is observed, verbose = 0 is silent
-            random_state=1,
-        )
+    v_target = get_target_profile(min_func, v, v_freq)
 
     ##############################################################################
-    # debug = True
-    if not config['global_optimization']:
-        minout = minimize(
-            min_func, h0, args=(W, v_target),
-            method='SLSQP',
-            bounds=bounds, constraints=constraints,
-            options={'maxiter': 500}
-        )
-
-        if minout.success:
-            logger.debug("MINIMIZATION: {} {}".format(minout.message, minout.nit))
-            h = minout.x
-            logger.debug("MAX LIK {} {}".format(h, round(-NegLogLik(h, W, v_target), 4)))
-            # print("LIK", round(-NegLogLik(h, W, v), 4), "DIV", round(DivergenceKL(h, W, v), 4))
+    # Gram matrix and its largest eigenvalue are only used by FISTA
+    gram = signature_set.get_gram(config['enable_dummy']) if solver == 'fista' else None
+    if selection is not None:
+        fixed = np.arange(W.shape[1]) >= signature_set.n_signatures
+        pool = get_selection_pool(jobs, W)
+        try:
+            h, iterations, fits = select_signatures(
+                v, W, SELECTION_FUNCTIONS[min_func], fixed=fixed, direction=selection,
+                tol=tol, max_iter=max_iter, min_frequency=MIN_FREQUENCY, pool=pool, batch_size=get_jobs(jobs))
+        finally:
+            if pool is not None:
+                pool.terminate()
+        logger.debug("EM iterations: {} in {} fits".format(iterations, fits))
+    elif config['global_optimization']:
+        solver_options = {'solver': solver, 'tol': tol, 'max_iter': max_iter, 'gram': gram}
+        pool = get_multistart_pool(jobs, min_func, W, bounds, constraints, **solver_options)
+        try:
+            h, iterations, starts = minimize_exposure_multistart(
+                min_func, h0, W, v_target, bounds, constraints, n_starts=n_starts,
+                random_state=random_state, pool=pool, batch_size=get_jobs(jobs), **solver_options)
+        finally:
+            if pool is not None:
+                pool.terminate()
+        logger.debug("{} iterations: {} in {} starts".format(solver, iterations, starts))
+    elif prescreen:
+        mask, screen_iterations = get_prescreen_mask(
+            prescreen, min_func, W, v, v_target, signature_set, solver=solver, tol=tol, max_iter=max_iter,
+            margin=prescreen_margin, replicates=prescreen_replicates, random_state=random_state)
+        if solver == 'em':
+            # exposures starting at zero stay at zero: EM over the screened signatures only
+            h0 = mask / mask.sum()
+        h, iterations, mask = fit_screened_exposure(
+            min_func, h0, W, v_target, mask, solver=solver, tol=tol, max_iter=max_iter)
+        iterations += screen_iterations
+        logger.debug("{} iterations: {}, {} signatures pruned".format(
+            solver, iterations, np.sum(~mask[:signature_set.n_signatures])))
+    else:
+        if solver == 'em':
+            H, iterations = em_exposures(v, W, tol=tol, max_iter=max_iter, min_frequency=MIN_FREQUENCY)
+            h = H[0]
         else:
-            logger.debug("MINIMIZATION FAILED:{} {}".format(minout.message, minout.nit))
-            # Minimization did not converge
-            # Use our initial guess, but normalize it:
-            h = h0.ravel() / h0.sum()
+            h, iterations = fit_exposure(
+                min_func, h0, W, v_target, bounds, constraints, solver=solver, tol=tol, max_iter=max_iter, gram=gram)
+        logger.debug("{} iterations: {}".format(solver, iterations))
 
     ##############################################################################
     N_mutations = int(math.ceil(v.sum()))
 
-    for i in range(len(results)):
-        results[i]['score'] = h[i]
-        results[i]['mutations'] = round(N_mutations * h[i])
+    if not summary:
+        exposures = h[:signature_set.n_signatures]
+        return exposures, np.round(N_mutations * exposures).astype(int)
 
-    # remove dummy signatures if enabled
-    if config['enable_dummy']:
-        results = results[:-6]
-        signature_names = signature_names[:-6]
+    # dummy signatures are not reported, metrics are computed when requested from results
+    metrics = partial(get_profile_fit_metrics, h, W, v_target, v_freq) if diagnostics else None
+    results = DecompositionResult(
+        signature_set.names, h[:signature_set.n_signatures], N_mutations,
+        metrics=metrics, others_threshold=others_threshold)
 
-    # residuals = min_func(h, W, v)
     reconstructed_profile = W.dot(h)
-    ##############################################################################
-
-    below_threshold = []
-    above_threshold = []
-    # import operator
-    # for r in results:
-    # print(results)
-    j = 0
-    for r in sorted(results, key=lambda item: item['score'], reverse=True):
-        if others_threshold > 0.0 and round(r['score'], 2) <= others_threshold:
-            below_threshold.append(r)
-        else:
-            j += 1
-            r['id'] = j
-            above_threshold.append(r)
-    results = above_threshold
-
-    # if len(below_threshold) == 1:
-    #     # print("ONLY ONE")
-    #     results.append(below_threshold[0])
-    #     below_threshold = []
-
-    # sum up other signatures
-    other_signatures = 0.0
-    for r in below_threshold:
-        other_signatures += r['score']
-
-    if round(other_signatures, 2) > 0.0:
-        results.append({
-            'accession': 0,
-            'id': 100,
-            'pid': 0,
-            'name': 'Other signatures',
-            'annotation': 'Signatures with individual contrubution &le; 0.05',
-            'profile': '',
-            'score': other_signatures,
-            'mutations': round(N_mutations * other_signatures)
-        })
-        for j, r in enumerate(below_threshold):
-            if round(r['score'], 2) > 0.0:
-                r['id'] = 100 + j + 1
-                r['pid'] = 100
-                results.append(r)
-
-    ll = -NegLogLik(h, W, v_target)
-    results.append({
-        'accession': 0,
-        'id': 201,
-        'pid': 0,
-        'name': 'LogLik',
-        'annotation': '',
-        'profile': '',
-        'mutations': '',
-        'score': ll,
-    })
-
-    frobenius = Frobenius(h, W, v_freq)
-    results.append({
-        'accession': 0,
-        'id': 202,
-        'pid': 0,
-        'name': 'Frobenius',
-        'annotation': '',
-        'profile': '',
-        'mutations': '',
-        'score': frobenius,
-    })
-
-    frobeniuszero = FrobeniusZero(h, W, v_freq)
-    results.append({
-        'accession': 0,
-        'id': 203,
-        'pid': 0,
-        'name': 'FrobeniusZero',
-        'annotation': '',
-        'profile': '',
-        'mutations': '',
-        'score': frobeniuszero,
-    })
-
-    divergencejs = DivergenceJS(h, W, v_freq)
-    results.append({
-        'accession': 0,
-        'id': 204,
-        'pid': 0,
-        'name': 'DivergenceJS',
-        'annotation': '',
-        'profile': '',
-        'mutations': '',
-        'score': divergencejs,
-    })
-
-    divergencekl = DivergenceKL(h, W, v_freq)
-    results.append({
-        'accession': 0,
-        'id': 205,
-        'pid': 0,
-        'name': 'DivergenceKL',
-        'annotation': '',
-        'profile': '',
-        'mutations': '',
-        'score': divergencekl,
-    })
-
     summary = []
     summary.append({
         'accession': 0,
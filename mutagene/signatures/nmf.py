@@ -1,27 +1,244 @@
+from multiprocessing import Pool
 
+import numpy as np
+from scipy.optimize import linear_sum_assignment
 
-    # @manager.command
-    # def dump_nmf_decomp():
-    #     for AB in ('A', 'B'):
-    #         deconv = db.query(CachedObjects).get('deconvolution_' + AB).value
+from mutagene.signatures.identify import get_jobs
 
-    #         # load samples in 5D or 10D
-    #         W = deconv['W']
-    #         H = deconv['H'].T
-    #         ids = deconv['ids']
+import logging
+logger = logging.getLogger(__name__)
 
-    #         for i, ID in enumerate(ids):
-    #             profile = db.query(Signature).get(int(ID))
-    #             v = np.array([get_signature_values_list(profile)]).ravel()
-    #             x = np.array(H[i]).squeeze()
-    #             residuals = np.linalg.norm(W.dot(x) - v)  # Frobenius norm
-    #             N = '5' if AB == 'A' else '10'
-    #             oname = "/Users/gonceare/projects/RA/ALL.decompose/{}_NMF{}.txt".format(ID, N)
-    #             with open(oname, 'w') as o:
-    #                 for j in range(H.shape[1]):
-    #                     name = "MUTAGENE {}.{}".format(AB, j + 1)
-    #                     o.write("{}\t{}\n".format(name, H[i, j]))
-    #                 # print(ID, residuals)
-    #                 o.write("Residuals\t{}\n".format(residuals))
+NMF_OBJECTIVES = ('kl', 'frobenius')
 
+# lower bound of reconstructed counts in ratios of multiplicative updates
+NMF_EPSILON = 1e-12
 
+
+def _get_chunks(n, chunk_size=None):
+    """ Slices of rows of a matrix with n rows, processed chunk_size rows at a time """
+    chunk_size = chunk_size or n
+    return [slice(start, start + chunk_size) for start in range(0, n, chunk_size)]
+
+
+def nmf_objective(V, W, H, objective='kl', chunk_size=None):
+    """
+    Generalized Kullback-Leibler divergence (negative Poisson log likelihood up to a constant)
+    or squared Frobenius norm of the difference between V and its reconstruction H W.T
+    """
+    total = 0.0
+    for rows in _get_chunks(V.shape[0], chunk_size):
+        reconstructed = H[rows].dot(W.T)
+        if objective == 'kl':
+            v = V[rows]
+            ratio = np.where(v > 0.0, v / np.maximum(reconstructed, NMF_EPSILON), 1.0)
+            total += np.sum(v * np.log(ratio) - v + reconstructed)
+        else:
+            total += np.sum((V[rows] - reconstructed) ** 2)
+    return total
+
+
+def get_random_factors(V, k, random_state=None):
+    """ Random initial signatures (columns sum up to 1) and exposures (on the scale of numbers of mutations) """
+    if not isinstance(random_state, np.random.RandomState):
+        random_state = np.random.RandomState(random_state)
+    W = random_state.uniform(size=(V.shape[1], k))
+    W /= W.sum(axis=0)
+    H = random_state.uniform(size=(V.shape[0], k)) * (2.0 * V.sum(axis=1, keepdims=True) / k)
+    return W, H
+
+
+def nmf(V, k, objective='kl', W0=None, H0=None, tol=1e-6, max_iter=2000, check_every=10, chunk_size=None, random_state=None):
+    """
+    Non-negative matrix factorization V ~ H W.T with multiplicative updates (Lee and Seung 2001)
+    V = samples x 96 channels matrix of mutation counts
+    k = number of signatures
+    objective = 'kl' (Poisson likelihood, generalized KL divergence) or 'frobenius' (least squares)
+    W0, H0 = initial signatures and exposures, random if not provided (see get_random_factors)
+    tol = convergence tolerance, relative change of the objective between checks made every check_every iterations
+    chunk_size = number of samples updated at a time, temporary matrices never exceed chunk_size x 96
+
+    Exposures of each chunk are updated with the current signatures,
+    signatures are updated once per iteration from statistics accumulated over chunks,
+    so the result does not depend on chunk_size
+
+    Returns tuple: 96 x k signatures (columns sum up to 1), samples x k exposures (numbers of mutations),
+    value of the objective and number of iterations
+    """
+    if objective not in NMF_OBJECTIVES:
+        raise ValueError("Unknown NMF objective {}, only {} are recognized".format(objective, ", ".join(NMF_OBJECTIVES)))
+
+    V = np.asarray(V, dtype=float)
+    W, H = get_random_factors(V, k, random_state)
+    if W0 is not None:
+        W = np.array(W0, dtype=float)
+    if H0 is not None:
+        H = np.array(H0, dtype=float)
+    chunks = _get_chunks(V.shape[0], chunk_size)
+
+    previous = nmf_objective(V, W, H, objective, chunk_size)
+    value = previous
+    for i in range(max_iter):
+        numerator = np.zeros_like(W)
+        if objective == 'kl':
+            # columns of W sum up to 1, denominator of exposure updates is 1
+            exposures_sum = np.zeros(k)
+            for rows in chunks:
+                h = H[rows]
+                h *= (V[rows] / np.maximum(h.dot(W.T), NMF_EPSILON)).dot(W)
+                numerator += (V[rows] / np.maximum(h.dot(W.T), NMF_EPSILON)).T.dot(h)
+                exposures_sum += h.sum(axis=0)
+            W *= numerator / np.maximum(exposures_sum, NMF_EPSILON)
+        else:
+            WtW = W.T.dot(W)
+            HtH = np.zeros((k, k))
+            for rows in chunks:
+                h = H[rows]
+                h *= V[rows].dot(W) / np.maximum(h.dot(WtW), NMF_EPSILON)
+                numerator += V[rows].T.dot(h)
+                HtH += h.T.dot(h)
+            W *= numerator / np.maximum(W.dot(HtH), NMF_EPSILON)
+
+        # signatures are kept normalized, scale is moved to exposures
+        scale = np.maximum(W.sum(axis=0), NMF_EPSILON)
+        W /= scale
+        H *= scale
+
+        if (i + 1) % check_every == 0:
+            value = nmf_objective(V, W, H, objective, chunk_size)
+            if abs(previous - value) <= tol * max(abs(previous), 1.0):
+                break
+            previous = value
+    else:
+        value = nmf_objective(V, W, H, objective, chunk_size)
+
+    return W, H, value, i + 1
+
+
+# state shared with worker processes once, when the pool is created
+_worker_context = None
+
+
+def _init_worker(context):
+    global _worker_context
+    _worker_context = context
+
+
+def _nmf_worker(task):
+    V, options = _worker_context
+    k, seed = task
+    W, _, value, iterations = nmf(V, k, random_state=seed, **options)
+    # exposures are not sent back: memory of a restart is bounded by samples x k in the worker only
+    return W, value, iterations
+
+
+def run_nmf_restarts(V, k, n_restarts=100, jobs=1, random_state=None, **options):
+    """
+    NMF of V (see nmf) from n_restarts random initializations, in a pool of jobs processes
+    V and options are sent to each worker process once
+    Returns list of tuples: signatures and value of the objective, sorted by the objective
+    """
+    if not isinstance(random_state, np.random.RandomState):
+        random_state = np.random.RandomState(random_state)
+    tasks = [(k, seed) for seed in random_state.randint(2 ** 31 - 1, size=n_restarts)]
+    V = np.asarray(V, dtype=float)
+
+    jobs = get_jobs(jobs)
+    if jobs == 1:
+        _init_worker((V, options))
+        results = [_nmf_worker(task) for task in tasks]
+    else:
+        with Pool(jobs, initializer=_init_worker, initargs=((V, options), )) as pool:
+            results = pool.map(_nmf_worker, tasks)
+
+    logger.debug("NMF rank {}: {} restarts, {} iterations per restart".format(
+        k, n_restarts, np.mean([iterations for _, _, iterations in results])))
+    return sorted([(W, value) for W, value, _ in results], key=lambda result: result[1])
+
+
+def cluster_signatures(Ws, max_iter=20):
+    """
+    Clustering of signatures of NMF restarts for stability of extracted signatures
+    Ws = list of 96 x k signatures of restarts, the first one (e.g. best restart) initializes clusters
+    Each restart contributes exactly one signature to each of k clusters: signatures are matched
+    to cluster centroids maximizing total cosine similarity (Hungarian algorithm), centroids are updated
+    until assignments do not change
+
+    Returns tuple: 96 x k consensus signatures (cluster centroids, columns sum up to 1)
+    and stability of each signature, average silhouette width of its cluster (cosine distance).
+    Stability is the average cosine similarity to the centroid if k = 1
+    """
+    X = np.array([W / np.maximum(np.linalg.norm(W, axis=0), NMF_EPSILON) for W in Ws])  # restarts x 96 x k
+    n_restarts, _, k = X.shape
+
+    centroids = X[0]
+    assignment = None
+    for _ in range(max_iter):
+        new_assignment = np.empty((n_restarts, k), dtype=int)
+        for r in range(n_restarts):
+            _, columns = linear_sum_assignment(-X[r].T.dot(centroids).T)
+            new_assignment[r] = columns  # column of restart r matched to each cluster
+        if assignment is not None and np.array_equal(assignment, new_assignment):
+            break
+        assignment = new_assignment
+        members = X[np.arange(n_restarts)[:, np.newaxis], :, assignment]  # restarts x k x 96
+        centroids = members.mean(axis=0).T
+        centroids = centroids / np.maximum(np.linalg.norm(centroids, axis=0), NMF_EPSILON)
+
+    members = X[np.arange(n_restarts)[:, np.newaxis], :, assignment]  # restarts x k x 96
+    points = members.reshape(-1, X.shape[1])
+    labels = np.tile(np.arange(k), n_restarts)
+
+    if k == 1 or n_restarts == 1:
+        stability = np.mean(members.dot(centroids).diagonal(axis1=1, axis2=2), axis=0)
+    else:
+        distances = 1.0 - points.dot(points.T)
+        # mean distance to members of each cluster (excluding the point itself in its own cluster)
+        sums = np.array([distances[:, labels == j].sum(axis=1) for j in range(k)]).T
+        a = sums[np.arange(len(labels)), labels] / (n_restarts - 1)
+        sums[np.arange(len(labels)), labels] = np.inf
+        b = np.min(sums / n_restarts, axis=1)
+        silhouette = (b - a) / np.maximum(np.maximum(a, b), NMF_EPSILON)
+        stability = np.array([silhouette[labels == j].mean() for j in range(k)])
+
+    signatures = np.maximum(centroids, 0.0)
+    return signatures / signatures.sum(axis=0), stability
+
+
+def extract_signatures(
+    V, ranks, n_restarts=100, objective='kl', stability_threshold=0.8, jobs=1, random_state=None, **options
+):
+    """
+    De novo extraction of mutational signatures from a cohort with NMF
+    V = samples x 96 channels matrix of mutation counts
+    ranks = numbers of signatures to try, for each rank NMF is run from n_restarts random initializations
+        in a pool of jobs processes (see run_nmf_restarts) and signatures of restarts are clustered (see cluster_signatures)
+    Other keyword arguments are passed to nmf (tol, max_iter, chunk_size)
+
+    The selected rank is the largest rank with average stability of signatures of at least stability_threshold
+    (the most stable rank if there is none)
+
+    Returns tuple: selected rank and dictionary keyed by rank of dictionaries with consensus 'signatures',
+    their 'stability', best value of the 'objective' and consensus 'mean_stability'
+    """
+    if not isinstance(random_state, np.random.RandomState):
+        random_state = np.random.RandomState(random_state)
+
+    results = {}
+    for k in ranks:
+        restarts = run_nmf_restarts(V, k, n_restarts, jobs=jobs, random_state=random_state, objective=objective, **options)
+        signatures, stability = cluster_signatures([W for W, _ in restarts])
+        results[k] = {
+            'signatures': signatures,
+            'stability': stability,
+            'mean_stability': stability.mean(),
+            'objective': restarts[0][1],
+        }
+        logger.info("Rank {}: stability {:.3f} (min {:.3f}), objective {:.2f}".format(
+            k, stability.mean(), stability.min(), restarts[0][1]))
+
+    stable = [k for k in results if results[k]['mean_stability'] >= stability_threshold]
+    if len(stable) > 0:
+        rank = max(stable)
+    else:
+        rank = max(results, key=lambda k: results[k]['mean_stability'])
+    return rank, results
@@ -0,0 +1,133 @@
+import numpy as np
+
+# goodness of fit metrics reported after signatures, with legacy ids of result records
+METRIC_IDS = {
+    'LogLik': 201,
+    'Frobenius': 202,
+    'FrobeniusZero': 203,
+    'DivergenceJS': 204,
+    'DivergenceKL': 205,
+}
+
+
+class DecompositionResult(object):
+    """
+    Result of decomposition of a single profile
+
+    names, exposures, mutations = signature names, exposures and numbers of mutations (arrays ordered as signatures)
+    metrics = dictionary of goodness of fit metrics, computed on first access if a function was provided
+
+    Iteration and indexing give the legacy list of result dictionaries
+    (sorted by exposure, signatures below others_threshold grouped as 'Other signatures',
+    followed by metrics with ids 201-205), which is built only when requested
+    """
+    __slots__ = ('names', 'exposures', 'mutations', 'n_mutations', 'others_threshold', '_metrics', '_records')
+
+    def __init__(self, names, exposures, n_mutations, metrics=None, others_threshold=0.0):
+        """
+        metrics = dictionary of metrics or a function without arguments returning it (evaluated lazily),
+            None if metrics were not requested
+        """
+        self.names = list(names)
+        self.exposures = np.asarray(exposures, dtype=float)
+        self.n_mutations = n_mutations
+        self.mutations = np.round(n_mutations * self.exposures).astype(int)
+        self.others_threshold = others_threshold
+        self._metrics = metrics
+        self._records = None
+
+    @property
+    def metrics(self):
+        if self._metrics is None:
+            return {}
+        if callable(self._metrics):
+            self._metrics = self._metrics()
+        return self._metrics
+
+    def exposure_dict(self):
+        return dict(zip(self.names, self.exposures))
+
+    def mutations_dict(self):
+        return dict(zip(self.names, self.mutations))
+
+    def as_list(self):
+        """ Legacy list of result dictionaries """
+        if self._records is None:
+            self._records = self._get_records()
+        return self._records
+
+    def __iter__(self):
+        return iter(self.as_list())
+
+    def __len__(self):
+        return len(self.as_list())
+
+    def __getitem__(self, i):
+        return self.as_list()[i]
+
+    def __repr__(self):
+        return "DecompositionResult({})".format(", ".join(
+            "{}: {:.4f}".format(name, h) for name, h in zip(self.names, self.exposures)))
+
+    def _get_records(self):
+        N_mutations = self.n_mutations
+        others_threshold = self.others_threshold
+
+        results = []
+        for name, h in zip(self.names, self.exposures):
+            results.append({
+                'accession': 0,
+                'id': 0,
+                'pid': 0,
+                'name': name,
+                'annotation': '',
+                'score': h,
+                'mutations': round(N_mutations * h)
+            })
+
+        below_threshold = []
+        above_threshold = []
+        j = 0
+        for r in sorted(results, key=lambda item: item['score'], reverse=True):
+            if others_threshold > 0.0 and round(r['score'], 2) <= others_threshold:
+                below_threshold.append(r)
+            else:
+                j += 1
+                r['id'] = j
+                above_threshold.append(r)
+        results = above_threshold
+
+        # sum up other signatures
+        other_signatures = 0.0
+        for r in below_threshold:
+            other_signatures += r['score']
+
+        if round(other_signatures, 2) > 0.0:
+            results.append({
+                'accession': 0,
+                'id': 100,
+                'pid': 0,
+                'name': 'Other signatures',
+                'annotation': 'Signatures with individual contrubution &le; 0.05',
+                'profile': '',
+                'score': other_signatures,
+                'mutations': round(N_mutations * other_signatures)
+            })
+            for j, r in enumerate(below_threshold):
+                if round(r['score'], 2) > 0.0:
+                    r['id'] = 100 + j + 1
+                    r['pid'] = 100
+                    results.append(r)
+
+        for name, value in self.metrics.items():
+            results.append({
+                'accession': 0,
+                'id': METRIC_IDS[name],
+                'pid': 0,
+                'name': name,
+                'annotation': '',
+                'profile': '',
+                'mutations': '',
+                'score': value,
+            })
+        return results
@@ -0,0 +1,157 @@
+import math
+
+import numpy as np
+
+from mutagene.signatures.solvers import em_exposures
+
+import logging
+logger = logging.getLogger(__name__)
+
+SELECTION_CRITERIA = ('AIC', 'AICc', 'BIC')
+SELECTION_DIRECTIONS = ('forward', 'backward', 'both')
+
+# exposure a signature enters a candidate subset with: EM keeps zero exposures at zero
+SUBSET_START_FLOOR = 1e-3
+
+
+def get_information_criterion(criterion, loglik, k, n):
+    """
+    AIC, AICc or BIC of a model with k signatures and log likelihood loglik of a profile of n mutations
+    (same definitions as AIC, AICc and BIC objectives in identify)
+    """
+    aic = -2.0 * loglik + 2.0 * k
+    if criterion == 'AIC':
+        return aic
+    if criterion == 'AICc':
+        if n - k - 1 <= 0:
+            return aic
+        return aic + 2.0 * k * (k + 1) / (n - k - 1)
+    if criterion == 'BIC':
+        return -2.0 * loglik + k * math.log(n)
+    raise ValueError("Unknown criterion {}, only {} are recognized".format(criterion, ", ".join(SELECTION_CRITERIA)))
+
+
+def get_subset_key(mask):
+    """ Bitmask of a subset of signatures (boolean array) packed into bytes, used as cache key """
+    return np.packbits(mask).tobytes()
+
+
+def fit_subsets(v, W, masks, h, tol=1e-6, max_iter=1000, min_frequency=1e-12):
+    """
+    Maximum likelihood exposures of candidate subsets of signatures, all candidates are fitted at once with EM
+    v = profile (mutation counts)
+    masks = candidates x K boolean array of signatures included in each candidate
+    h = exposures of the parent subset used as warm start, signatures entering a candidate start at SUBSET_START_FLOOR
+    Returns tuple: candidates x K exposures (zero outside the subsets), log likelihoods and numbers of iterations
+    """
+    H0 = np.where(masks, np.maximum(h, SUBSET_START_FLOOR), 0.0)
+    H0 /= H0.sum(axis=1, keepdims=True)
+    V = np.broadcast_to(v, (masks.shape[0], v.shape[0]))
+    H, iterations = em_exposures(V, W, H0=H0, tol=tol, max_iter=max_iter, min_frequency=min_frequency)
+    loglik = np.sum(v * np.log(np.maximum(H.dot(W.T), min_frequency)), axis=1)
+    return H, loglik, iterations
+
+
+# state shared with worker processes once, when the pool is created
+_worker_context = None
+
+
+def _init_worker(context):
+    global _worker_context
+    _worker_context = context
+
+
+def _fit_subsets_worker(task):
+    W = _worker_context
+    v, masks, h, options = task
+    return fit_subsets(v, W, masks, h, **options)
+
+
+def get_selection_context(W):
+    """ Initializer and its arguments of a pool of processes for select_signatures """
+    return _init_worker, (W, )
+
+
+def select_signatures(
+    v, W, criterion='AICc', fixed=None, direction='both',
+    tol=1e-6, max_iter=1000, min_frequency=1e-12, screen_tol=1e-4, pool=None, batch_size=1
+):
+    """
+    Stepwise selection of the subset of signatures minimizing an information criterion (AIC, AICc or BIC)
+    v = profile (mutation counts)
+    W = 96 channels x K signatures
+    fixed = boolean array of K signatures always included in the model (e.g. dummy signatures)
+    direction = 'forward' (start from fixed signatures and add signatures), 'backward' (start from all signatures
+        and remove them) or 'both' (start from fixed signatures, each step either adds or removes a signature)
+
+    At each step all subsets differing from the current one by a single signature are fitted
+    with EM warm-started from the current exposures (see fit_subsets) and the best subset is taken
+    while the criterion improves. Fitted subsets are cached by bitmask and fitted only once.
+    Candidates are compared after fits with tolerance screen_tol (if looser than tol),
+    only the selected subset is refitted with tolerance tol
+    Candidates of a step are split into batch_size chunks fitted in parallel if pool is provided
+    (created with the initializer from get_selection_context)
+
+    Returns tuple: K exposures (zero for signatures not selected), total number of EM iterations and number of fits
+    """
+    K = W.shape[1]
+    n = v.sum()
+    fixed = np.zeros(K, dtype=bool) if fixed is None else np.asarray(fixed, dtype=bool)
+    free = np.flatnonzero(~fixed)
+    options = {'tol': max(tol, screen_tol), 'max_iter': max_iter, 'min_frequency': min_frequency}
+
+    cache = {}
+    total_iterations = 0
+
+    def fit(masks, h, refine=False):
+        nonlocal total_iterations
+        if refine:
+            fits = [fit_subsets(v, W, masks, h, **dict(options, tol=tol))]
+        elif pool is None or len(masks) == 1:
+            fits = [fit_subsets(v, W, masks, h, **options)]
+        else:
+            chunks = np.array_split(masks, min(batch_size, len(masks)))
+            fits = pool.map(_fit_subsets_worker, [(v, chunk, h, options) for chunk in chunks])
+        for chunk, (H, loglik, iterations) in zip(np.array_split(masks, len(fits)), fits):
+            total_iterations += int(iterations.sum())
+            for mask, h_fit, ll in zip(chunk, H, loglik):
+                score = get_information_criterion(criterion, ll, mask.sum(), n)
+                cache[get_subset_key(mask)] = h_fit, score
+
+    mask = fixed.copy() if direction != 'backward' else np.ones(K, dtype=bool)
+    if mask.any():
+        fit(mask[np.newaxis], np.full(K, 1.0 / K), refine=True)
+        h, score = cache[get_subset_key(mask)]
+    else:
+        h, score = np.zeros(K), np.inf
+
+    steps = 0
+    while True:
+        candidates = []
+        if direction in ('forward', 'both'):
+            candidates.extend(j for j in free if not mask[j])
+        if direction in ('backward', 'both') and mask.sum() > 1:
+            candidates.extend(j for j in free if mask[j])
+        if len(candidates) == 0:
+            break
+
+        masks = np.repeat(mask[np.newaxis], len(candidates), axis=0)
+        masks[np.arange(len(candidates)), candidates] ^= True
+        keys = [get_subset_key(m) for m in masks]
+
+        new = [i for i, key in enumerate(keys) if key not in cache]
+        if len(new) > 0:
+            fit(masks[new], h)
+
+        scores = [cache[key][1] for key in keys]
+        best = int(np.argmin(scores))
+        if not scores[best] < score:
+            break
+        mask = masks[best]
+        fit(mask[np.newaxis], cache[keys[best]][0], refine=True)
+        h, score = cache[keys[best]]
+        steps += 1
+
+    logger.debug("Stepwise {} selection: {} signatures in {} steps, {} fits, {} {:.2f}".format(
+        direction, mask.sum(), steps, len(cache), criterion, score))
+    return h, total_iterations, len(cache)
@@ -0,0 +1,208 @@
+import urllib
+
+import numpy as np
+from scipy.cluster import hierarchy
+from scipy.spatial.distance import squareform
+
+from mutagene.signatures import get_dummy_signatures_lists
+
+# reconstructed frequencies are floored in the log-likelihood so that channels with observed mutations
+# and zero reconstructed frequency are penalized instead of being silently dropped from the sum
+MIN_FREQUENCY = 1e-12
+
+# signatures with average cosine similarity of at least CLUSTER_SIMILARITY are grouped in a cluster
+# (e.g. SBS3, SBS5 and SBS40 of COSMIC v3)
+CLUSTER_SIMILARITY = 0.8
+
+
+def get_fingerprint_url(a):
+    data = {"s{}".format(i): v for i, v in enumerate(a)}
+    return urllib.parse.urlencode(data)
+
+
+def _total_exposure_constraint(x):
+    return 1.0 - np.sum(x)
+
+
+def _total_exposure_constraint_jac(x):
+    return -np.ones_like(x)
+
+
+def get_constraints_and_bounds(n):
+    """
+    Exposures are bound to [0, 1] and should sum up to at most 1
+    Constraints are module-level functions (not lambdas) so that they can be sent to worker processes
+    """
+    # constraints = {'type': 'eq', 'fun': lambda x: np.sum(x) - 1}
+    constraints = {'type': 'ineq', 'fun': _total_exposure_constraint, 'jac': _total_exposure_constraint_jac}
+    # bounds = [[0., None],[0., None],[0., None]]
+    bounds = [[0.0, 1.0] for _ in range(n)]
+    return constraints, bounds
+
+
+def get_signature_similarity(W):
+    """ Pairwise cosine similarity of signatures (columns of W) """
+    W = W / np.linalg.norm(W, axis=0)
+    return W.T.dot(W)
+
+
+def get_signature_linkage(similarity):
+    """ Hierarchical clustering (average linkage, cosine distance) of signatures as scipy linkage matrix """
+    distance = np.clip(1.0 - similarity, 0.0, None)
+    return hierarchy.linkage(squareform(distance, checks=False), method='average')
+
+
+# dummy signatures are the same for every set of signatures, generated once
+DUMMY_SIGNATURES = get_dummy_signatures_lists()
+DUMMY_MATRIX = np.array([values for _, values in DUMMY_SIGNATURES]).T
+DUMMY_MATRIX.flags.writeable = False
+DUMMY_PROFILES = [get_fingerprint_url(values) for _, values in DUMMY_SIGNATURES]
+
+# dummy signatures of other layouts of channels (see mutagene.profiles.channels), generated on first use
+_dummy_matrices = {DUMMY_MATRIX.shape[0]: DUMMY_MATRIX}
+
+
+def get_dummy_matrix(n_channels):
+    """ Dummy signatures (channels x 6 matrix) of the layout of n_channels channels """
+    if n_channels not in _dummy_matrices:
+        W = np.array([values for _, values in get_dummy_signatures_lists(n_channels)]).T
+        W.flags.writeable = False
+        _dummy_matrices[n_channels] = W
+    return _dummy_matrices[n_channels]
+
+
+class SignatureSet(object):
+    """
+    Set of signatures prepared for decomposition once, instead of on every call:
+    signatures matrix with and without dummy signatures, their transposes, column norms, logarithms
+    (floored at MIN_FREQUENCY), names and fingerprints of dummy signatures, bounds and constraints
+
+    Gram matrices W.T W with the largest eigenvalue (step size of projected gradient, FISTA only),
+    cosine similarity of signatures and their hierarchical clustering (pre-screening with clusters, named subsets)
+    are computed on first use unless provided (e.g. similarity and linkage from cache)
+
+    Can be used wherever a (W, signature_names) tuple is expected:
+        W, signature_names = signature_set
+    """
+
+    def __init__(self, W, names, name=None, similarity=None, linkage=None):
+        self.name = name
+        self.names = list(names)
+        self.W = np.ascontiguousarray(W, dtype=float)
+        if self.W.shape[1] != len(self.names):
+            raise ValueError("Number of signatures ({}) and names ({}) do not match".format(self.W.shape[1], len(self.names)))
+
+        self.n_signatures = self.W.shape[1]
+        self.n_channels = self.W.shape[0]
+
+        dummy_matrix = get_dummy_matrix(self.n_channels)
+        self.W_dummy = np.hstack([self.W, dummy_matrix])
+        self.dummy_names = ["d" + str(i) for i in range(dummy_matrix.shape[1])]
+        self.dummy_annotations = ["Dummy " + name for name, _ in DUMMY_SIGNATURES]
+        self.dummy_profiles = DUMMY_PROFILES if dummy_matrix is DUMMY_MATRIX else [get_fingerprint_url(values) for values in dummy_matrix.T]
+
+        self.WT = self.W.T.copy()
+        self.W_dummyT = self.W_dummy.T.copy()
+        self.norms = np.linalg.norm(self.W, axis=0)
+        self.dummy_norms = np.linalg.norm(self.W_dummy, axis=0)
+        self.log_W = np.log(np.maximum(self.W, MIN_FREQUENCY))
+        self.log_W_dummy = np.log(np.maximum(self.W_dummy, MIN_FREQUENCY))
+
+        self._constraints_and_bounds = {
+            False: get_constraints_and_bounds(self.W.shape[1]),
+            True: get_constraints_and_bounds(self.W_dummy.shape[1]),
+        }
+
+        self._gram = {}
+        self._similarity = None if similarity is None else np.asarray(similarity)
+        self._linkage = None if linkage is None else np.asarray(linkage)
+        self._clusters = None
+        self._representatives = None
+
+        for a in (self.W, self.W_dummy, self.WT, self.W_dummyT, self.norms, self.dummy_norms, self.log_W, self.log_W_dummy):
+            a.flags.writeable = False
+
+    @staticmethod
+    def _freeze(a):
+        a.flags.writeable = False
+        return a
+
+    @classmethod
+    def from_signatures(cls, signatures):
+        """ SignatureSet from a (W, signature_names) tuple, a SignatureSet is returned as is """
+        if isinstance(signatures, cls):
+            return signatures
+        W, names = signatures
+        return cls(W, names)
+
+    def __iter__(self):
+        return iter((self.W, self.names))
+
+    def __getitem__(self, i):
+        return (self.W, self.names)[i]
+
+    def __repr__(self):
+        return "SignatureSet({}, {} signatures)".format(self.name, self.n_signatures)
+
+    def get_matrix(self, enable_dummy=True):
+        """ Signatures matrix (channels x signatures), with dummy signatures appended if enabled """
+        return self.W_dummy if enable_dummy else self.W
+
+    def get_gram(self, enable_dummy=True):
+        """ Returns tuple: Gram matrix of signatures and its largest eigenvalue, computed on first use """
+        enable_dummy = bool(enable_dummy)
+        if enable_dummy not in self._gram:
+            W = self.get_matrix(enable_dummy)
+            gram = self._freeze(W.T.dot(W))
+            self._gram[enable_dummy] = gram, np.linalg.eigvalsh(gram)[-1]
+        return self._gram[enable_dummy]
+
+    @property
+    def similarity(self):
+        """ Cosine similarity of signatures """
+        if self._similarity is None:
+            self._similarity = self._freeze(get_signature_similarity(self.W))
+        return self._similarity
+
+    @property
+    def linkage(self):
+        """ Hierarchical clustering of signatures (scipy linkage matrix, empty for a single signature) """
+        if self._linkage is None:
+            linkage = get_signature_linkage(self.similarity) if self.n_signatures > 1 else np.zeros((0, 4))
+            self._linkage = self._freeze(linkage)
+        return self._linkage
+
+    @property
+    def clusters(self):
+        """ Cluster of each signature: signatures with average similarity of at least CLUSTER_SIMILARITY """
+        if self._clusters is None:
+            if self.n_signatures > 1:
+                clusters = hierarchy.fcluster(self.linkage, 1.0 - CLUSTER_SIMILARITY, criterion='distance') - 1
+            else:
+                clusters = np.zeros(self.n_signatures, dtype=int)
+            self._clusters = self._freeze(clusters)
+        return self._clusters
+
+    @property
+    def representatives(self):
+        """ Boolean mask of representatives of clusters (see _get_representatives) """
+        if self._representatives is None:
+            self._representatives = self._freeze(self._get_representatives())
+        return self._representatives
+
+    def get_constraints_and_bounds(self, enable_dummy=True):
+        return self._constraints_and_bounds[bool(enable_dummy)]
+
+    def _get_representatives(self):
+        """ Representative of each cluster: signature with the highest average similarity to the other members """
+        representatives = np.zeros(self.n_signatures, dtype=bool)
+        for cluster in np.unique(self.clusters):
+            members = np.flatnonzero(self.clusters == cluster)
+            similarity = self.similarity[np.ix_(members, members)].sum(axis=1)
+            representatives[members[np.argmax(similarity)]] = True
+        return representatives
+
+    def get_cluster_members(self, signature):
+        """ Names of signatures in the cluster of a signature (given by name or index) """
+        i = self.names.index(signature) if isinstance(signature, str) else signature
+        return [self.names[j] for j in np.flatnonzero(self.clusters == self.clusters[i])]
@@ -0,0 +1,183 @@
+import numpy as np
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+def em_exposures(V, W, H0=None, tol=1e-6, max_iter=1000, min_frequency=1e-12):
+    """
+    Maximum likelihood exposures of a mixture of multinomials with EM (multiplicative updates)
+    All samples are updated at once, each iteration is a pair of matrix products
+
+    V = samples x 96 channels matrix of mutation counts
+    W = 96 channels x K signatures, each signature sums up to 1
+    H0 = samples x K initial exposures (uniform if not provided).
+        Exposures that start at zero stay at zero, so the initial guess should be strictly positive
+    tol = convergence tolerance, maximum absolute change of exposures between iterations
+    max_iter = maximum number of iterations
+
+    Returns tuple: samples x K exposures and number of iterations used for each sample
+    """
+    V = np.atleast_2d(V)
+    n_samples = V.shape[0]
+    K = W.shape[1]
+
+    if H0 is None:
+        H = np.full((n_samples, K), 1.0 / K)
+    else:
+        H = np.array(H0, dtype=float).reshape(n_samples, K)
+
+    N = V.sum(axis=1)
+    iterations = np.zeros(n_samples, dtype=int)
+    active = N > 0.0
+    H[~active] = 0.0
+
+    for i in range(max_iter):
+        if not np.any(active):
+            break
+        H_active = H[active]
+        reconstructed = np.maximum(H_active.dot(W.T), min_frequency)
+        H_new = H_active * (V[active] / reconstructed).dot(W) / N[active, np.newaxis]
+        delta = np.max(np.abs(H_new - H_active), axis=1)
+
+        H[active] = H_new
+        iterations[active] = i + 1
+        converged = np.flatnonzero(active)[delta <= tol]
+        active[converged] = False
+
+    if np.any(active):
+        logger.debug("EM did not converge in {} iterations for {} samples".format(max_iter, np.sum(active)))
+
+    return H, iterations
+
+
+def project_capped_simplex(X):
+    """
+    Euclidean projection of rows of X onto the capped simplex {x >= 0, sum(x) <= 1}
+    Rows with positive part summing up to at most 1 are clipped at zero,
+    other rows are projected onto the simplex sum(x) = 1 with the sort-based algorithm (Held et al. 1974)
+    """
+    X = np.atleast_2d(X)
+    P = np.maximum(X, 0.0)
+    outside = P.sum(axis=1) > 1.0
+    if np.any(outside):
+        Y = X[outside]
+        n = Y.shape[1]
+        U = -np.sort(-Y, axis=1)
+        css = np.cumsum(U, axis=1) - 1.0
+        positive = U - css / np.arange(1, n + 1) > 0.0
+        rho = n - 1 - np.argmax(positive[:, ::-1], axis=1)  # last index where the condition holds
+        theta = css[np.arange(Y.shape[0]), rho] / (rho + 1.0)
+        P[outside] = np.maximum(Y - theta[:, np.newaxis], 0.0)
+    return P
+
+
+def _get_start(H0, n_samples, K):
+    if H0 is None:
+        return np.full((n_samples, K), 1.0 / K)
+    return project_capped_simplex(np.array(H0, dtype=float).reshape(n_samples, K))
+
+
+def row_dot(A, B):
+    """
+    Matrix product A B computed row by row (einsum): unlike BLAS, rounding of a row of the product
+    does not depend on the other rows of A, at the cost of speed
+    """
+    return np.einsum('ij,jk->ik', A, B)
+
+
+def fista_quadratic_exposures(G, C, L, H0=None, tol=1e-6, max_iter=1000, reproducible=False):
+    """
+    Accelerated projected gradient (FISTA) for least squares exposures of many samples at once:
+    minimizes 0.5 * h G h - c h over the capped simplex for each row c of C,
+    which is ||W h - v||^2 up to a constant with Gram matrix G = W.T W and C = V W
+
+    L = Lipschitz constant of the gradient (largest eigenvalue of G), used as fixed step size 1 / L
+    Momentum is restarted when it points against the projected gradient step (O'Donoghue & Candes 2015)
+    reproducible = when True, products are computed with row_dot, so exposures of a sample are the same
+        whatever other samples are fitted with it
+
+    Returns tuple: samples x K exposures and number of iterations used for each sample
+    """
+    dot = row_dot if reproducible else np.dot
+    C = np.atleast_2d(C)
+    n_samples, K = C.shape
+    H = _get_start(H0, n_samples, K)
+    Y = H.copy()
+    t = np.ones(n_samples)
+    iterations = np.zeros(n_samples, dtype=int)
+    active = np.arange(n_samples)
+
+    for i in range(max_iter):
+        if len(active) == 0:
+            break
+        H_active = H[active]
+        Y_active = Y[active]
+        H_new = project_capped_simplex(Y_active - (dot(Y_active, G) - C[active]) / L)
+
+        step = H_new - H_active
+        restart = np.sum((Y_active - H_new) * step, axis=1) > 0.0
+        t_active = t[active]
+        t_new = np.where(restart, 1.0, (1.0 + np.sqrt(1.0 + 4.0 * t_active ** 2)) / 2.0)
+        momentum = np.where(restart, 0.0, (t_active - 1.0) / t_new)
+
+        H[active] = H_new
+        Y[active] = H_new + momentum[:, np.newaxis] * step
+        t[active] = t_new
+        iterations[active] = i + 1
+        active = active[np.max(np.abs(step), axis=1) > tol]
+
+    if len(active) > 0:
+        logger.debug("FISTA did not converge in {} iterations for {} samples".format(max_iter, len(active)))
+
+    return H, iterations
+
+
+def fista_exposures(func, grad, x0, tol=1e-6, max_iter=1000, L0=1.0):
+    """
+    Accelerated projected gradient (FISTA) with backtracking line search over the capped simplex
+    for a smooth objective func with gradient grad, e.g. cosine distance or divergences
+
+    x0 = initial exposures, L0 = initial estimate of Lipschitz constant of the gradient
+    Extrapolated points are projected back onto the feasible set, where divergences are defined
+
+    Returns tuple: exposures and number of iterations
+    """
+    x = project_capped_simplex(x0)[0]
+    y = x.copy()
+    t = 1.0
+    L = L0
+    i = 0
+    for i in range(max_iter):
+        f_y = func(y)
+        g_y = grad(y)
+        while True:
+            x_new = project_capped_simplex(y - g_y / L)[0]
+            d = x_new - y
+            if func(x_new) <= f_y + g_y.dot(d) + 0.5 * L * d.dot(d) or L > 1e16:
+                break
+            L *= 2.0
+
+        if not np.isfinite(func(x_new)):
+            logger.debug("FISTA line search failed")
+            break
+
+        step = x_new - x
+        if (y - x_new).dot(step) > 0.0:
+            t_new, momentum = 1.0, 0.0
+        else:
+            t_new = (1.0 + np.sqrt(1.0 + 4.0 * t ** 2)) / 2.0
+            momentum = (t - 1.0) / t_new
+
+        x = x_new
+        y = project_capped_simplex(x_new + momentum * step)[0]
+        t = t_new
+        # let the step size grow again if the objective is flatter here
+        L *= 0.9
+
+        if np.max(np.abs(step)) <= tol:
+            break
+    else:
+        logger.debug("FISTA did not converge in {} iterations".format(max_iter))
+
+    return x, i + 1
@@ -10,7 +10,6 @@ setuptools.setup(name='mutagene',
                  author_email='alexandr.goncearenco@nih.gov',
                  url='http://www.ncbi.nlm.nih.gov/projects/mutagene/',
                  install_requires=[
-                        'bayesian-optimization',
                         'clustergrammer',
                         'numpy>=1.18',
                         'pandas>=0.25',
@@ -0,0 +1,66 @@
+import os
+
+import numpy as np
+
+from mutagene.io.catalog_cache import read_cached_catalog, read_cached_derived
+from mutagene.io.profile import read_signatures
+
+
+def test_read_cached_catalog(tmp_path):
+    source = tmp_path / "catalog.txt"
+    source.write_text("1 2 3\n4 5 6\n")
+    cache_dir = str(tmp_path / "cache")
+    calls = []
+
+    def reader():
+        calls.append(1)
+        return np.loadtxt(str(source)), ['a', 'b', 'c']
+
+    W, names = read_cached_catalog('test', [str(source)], reader, cache_dir)
+    assert len(calls) == 1
+
+    W_cached, names_cached = read_cached_catalog('test', [str(source)], reader, cache_dir)
+    assert len(calls) == 1
+    assert isinstance(W_cached, np.memmap)
+    assert np.array_equal(W, W_cached) and names == names_cached
+
+    # same content, different mtime: hash is checked, cache is still valid
+    stat = os.stat(str(source))
+    os.utime(str(source), ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    read_cached_catalog('test', [str(source)], reader, cache_dir)
+    assert len(calls) == 1
+
+    source.write_text("1 2 3\n4 5 7\n")
+    W, _ = read_cached_catalog('test', [str(source)], reader, cache_dir)
+    assert len(calls) == 2
+    assert W[1, 2] == 7.0
+
+
+def test_read_signatures_cache(tmp_path, monkeypatch):
+    monkeypatch.setenv('MUTAGENE_CACHE_DIR', str(tmp_path))
+    for name in ('5', '10', '30', '49', '53'):
+        W, signature_names = read_signatures(name, use_cache=False)
+        for _ in range(2):
+            W_cached, signature_names_cached = read_signatures(name)
+            assert np.array_equal(W, W_cached)
+            assert signature_names == signature_names_cached
+
+
+def test_read_cached_derived(tmp_path):
+    cache_dir = str(tmp_path)
+    calls = []
+
+    def compute(W):
+        calls.append(1)
+        return W.T.dot(W)
+
+    W = np.arange(6.0).reshape(3, 2)
+    a = read_cached_derived('test', 'gram', W, compute, cache_dir)
+    a_cached = read_cached_derived('test', 'gram', W, compute, cache_dir)
+    assert len(calls) == 1
+    assert np.array_equal(a, a_cached)
+
+    W[0, 0] = 10.0
+    a = read_cached_derived('test', 'gram', W, compute, cache_dir)
+    assert len(calls) == 2
+    assert np.array_equal(a, W.T.dot(W))
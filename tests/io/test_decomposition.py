@@ -0,0 +1,74 @@
+import io
+import os
+
+import numpy as np
+import pandas as pd
+
+from mutagene.io.decomposition import write_decomposition, DecompositionWriter
+
+
+def test_write_bootstrap_decomposition(tmp_path):
+    signature_names = ['1', '2', '3']
+    samples_results = {'A': (np.array([0.5, 0.3, 0.0]), np.array([50, 30, 0]))}
+    profile = {'A': np.full(96, 100.0 / 96)}
+
+    rng = np.random.RandomState(0)
+    bootstrap_exposures = np.clip(samples_results['A'][0] + rng.normal(0, 0.05, size=(100, 3)), 0.0, 1.0)
+    bootstrap_results = {'A': (bootstrap_exposures, np.round(100 * bootstrap_exposures).astype(int))}
+
+    for method in ('p', 't'):
+        fname = str(tmp_path / "decomposition_{}.txt".format(method))
+        write_decomposition(
+            fname, samples_results, signature_names,
+            bootstrap_method=method, profile=profile,
+            bootstrap_results=bootstrap_results, bootstrap_level=95)
+        df = pd.read_csv(fname, sep="\t", dtype={'signature': str})
+        assert list(df.signature[:2]) == ['1', '2']
+        assert np.all(df.exposure_low <= df.exposure) and np.all(df.exposure <= df.exposure_high)
+
+
+def test_decomposition_writer(tmp_path):
+    signature_names = ['1', '2']
+    samples_results = {sample: (np.array([0.6, 0.2]), np.array([60, 20])) for sample in 'ABC'}
+
+    fname = str(tmp_path / "decomposition.txt")
+    with DecompositionWriter(fname, signature_names, order=['A', 'B', 'C']) as writer:
+        writer.write('B', samples_results['B'])
+        writer.write('C', samples_results['C'])
+        # held back until A is written
+        assert not os.path.exists(fname)
+        writer.write('A', samples_results['A'])
+        assert list(pd.read_csv(fname, sep="\t")['sample']) == ['A', 'A', 'B', 'B', 'C', 'C']
+
+    handle = io.StringIO()
+    writer = DecompositionWriter(handle, signature_names, mutations_threshold=30)
+    writer.write('C', samples_results['C'])
+    writer.write('A', samples_results['A'])
+    writer.close()
+    assert handle.getvalue() == "sample\tsignature\texposure\tmutations\nC\t1\t0.6\t60\nA\t1\t0.6\t60\n"
+
+
+def test_write_cohort_bootstrap_decomposition(tmp_path):
+    signature_names = ['1', '2', '3', '4']
+    samples = ['A', 'B', 'C']
+    rng = np.random.RandomState(0)
+    exposures = rng.dirichlet(np.ones(4), size=3) * 0.9
+    mutations = np.round(100 * exposures).astype(int)
+    bootstrap_exposures = np.clip(exposures[:, np.newaxis] + rng.normal(0, 0.05, size=(3, 50, 4)), 0.0, 1.0)
+    bootstrap_mutations = np.round(100 * bootstrap_exposures).astype(int)
+
+    samples_results = {sample: (exposures[i], mutations[i]) for i, sample in enumerate(samples)}
+    profile = {sample: np.full(96, 100.0 / 96) for sample in samples}
+    bootstrap_results = {sample: (bootstrap_exposures[i], bootstrap_mutations[i]) for i, sample in enumerate(samples)}
+
+    for method in ('p', 't'):
+        # samples x replicates x signatures tensor gives the same table as arrays of each sample
+        tables = []
+        for results in (bootstrap_results, (bootstrap_exposures, bootstrap_mutations)):
+            fname = str(tmp_path / "decomposition.txt")
+            write_decomposition(
+                fname, samples_results, signature_names, bootstrap_method=method, profile=profile,
+                bootstrap_results=results, bootstrap_level=95)
+            tables.append(open(fname).read())
+        assert tables[0] == tables[1]
+        assert len(tables[0].splitlines()) > 3
@@ -0,0 +1,75 @@
+import sqlite3
+
+import numpy as np
+
+from mutagene.io.decomposition_cache import DecompositionCache
+from mutagene.io.profile import read_signatures
+from mutagene.signatures.identify import decompose_multisample_mutational_profile_counts
+from tests.signatures.test_identify import get_profiles
+
+
+def test_decomposition_cache(tmp_path):
+    signature_set = read_signatures('5')
+    profiles = get_profiles(5)
+    profiles = np.vstack([profiles, profiles[:2], np.zeros((1, 96))])
+    fname = str(tmp_path / "decompositions.sqlite")
+
+    exposures, mutations, metrics = decompose_multisample_mutational_profile_counts(profiles, signature_set, 'MLE')
+    for cached in (2, 7):
+        with DecompositionCache(fname) as cache:
+            cached_exposures, cached_mutations, cached_metrics = decompose_multisample_mutational_profile_counts(
+                profiles, signature_set, 'MLE', cache=cache)
+        # repeated profiles are fitted once, all samples are taken from cache in the second run
+        assert np.sum(cached_metrics['Cached']) == cached
+        assert np.all(cached_metrics['Iterations'][cached_metrics['Cached']] == 0)
+        assert np.allclose(cached_exposures, exposures)
+        assert np.array_equal(cached_mutations, mutations)
+        assert np.allclose(cached_metrics['LogLik'], metrics['LogLik'])
+
+    # different options are not taken from cache
+    with DecompositionCache(fname) as cache:
+        _, _, cached_metrics = decompose_multisample_mutational_profile_counts(
+            profiles, signature_set, 'MLE', solver='em', cache=cache)
+        assert np.sum(cached_metrics['Cached']) == 2
+
+
+def test_decomposition_cache_eviction(tmp_path):
+    def get_keys(cache):
+        return {key for key, in cache.connection.execute("SELECT key FROM decompositions")}
+
+    with DecompositionCache(str(tmp_path / "decompositions.sqlite"), max_size=350) as cache:
+        for i in range(10):
+            cache.put({str(i): (np.full(11, i), {'Iterations': i})})
+        assert cache.get_size() <= 350
+        # least recently used results are evicted first
+        assert get_keys(cache) == {'7', '8', '9'}
+        cache.get(['7'])
+        cache.put({'10': (np.zeros(11), {'Iterations': 0})})
+        assert get_keys(cache) == {'7', '9', '10'}
+        h, metrics = cache.get(['9'])['9']
+        assert np.array_equal(h, np.full(11, 9.0)) and metrics == {'Iterations': 9}
+
+
+def test_decomposition_cache_errors(tmp_path):
+    signature_set = read_signatures('5')
+    profiles = get_profiles(3)
+    fname = str(tmp_path / "decompositions.sqlite")
+    exposures, _, _ = decompose_multisample_mutational_profile_counts(profiles, signature_set, 'MLE')
+
+    with DecompositionCache(fname, timeout=0.01) as cache:
+        # database locked by another run: samples are fitted and results are not stored
+        other = sqlite3.connect(fname)
+        other.execute("BEGIN EXCLUSIVE")
+        cached_exposures, _, metrics = decompose_multisample_mutational_profile_counts(
+            profiles, signature_set, 'MLE', cache=cache)
+        assert np.allclose(cached_exposures, exposures) and not np.any(metrics['Cached'])
+        other.rollback()
+        other.close()
+        assert cache.get_size() == 0
+
+    # random starts are only cached with a seed
+    with DecompositionCache(fname) as cache:
+        for random_state, cached in ((None, 0), (1, 0), (1, 3)):
+            _, _, metrics = decompose_multisample_mutational_profile_counts(
+                profiles, signature_set, 'MLE', global_optimization=True, n_starts=3, random_state=random_state, cache=cache)
+            assert np.sum(metrics.get('Cached', 0)) == cached
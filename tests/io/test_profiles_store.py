@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+
+from mutagene.io.profile import read_profile_file
+from mutagene.io.profiles_store import ProfilesStore, import_profiles_directory, write_profiles_store, parse_store_criteria
+from tests.signatures.test_identify import data_path
+
+
+def test_profiles_store(tmp_path):
+    fname = str(tmp_path / "cohort.store")
+    profiles = np.arange(3 * 96).reshape(3, 96)
+    write_profiles_store(fname, ['s1', 's2', 's3'], profiles, metadata={'type': ['A', 'B', 'A'], 'purity': ['0.5', '1', '0.2']})
+
+    store = ProfilesStore(fname)
+    assert isinstance(store.records, np.memmap)
+    assert len(store) == 3 and store.metadata_columns == ['type', 'purity']
+    samples, V = store.get_profiles(where={'type': 'A'})
+    assert samples == ['s1', 's3'] and np.array_equal(V, profiles[[0, 2]])
+    assert np.array_equal(store.get_mutations(['s2']), [profiles[1].sum()])
+    assert np.allclose(store.get_metadata('purity'), [0.5, 1.0, 0.2])
+
+    groups, pooled = store.get_grouped_profiles('type')
+    assert groups == ['A', 'B'] and np.array_equal(pooled, [profiles[0] + profiles[2], profiles[1]])
+
+    with pytest.raises(ValueError):
+        store.get_profiles(['s4'])
+    with pytest.raises(ValueError):
+        store.get_profiles(where={'cancer': 'A'})
+    with pytest.raises(ValueError):
+        parse_store_criteria(['type'])
+    assert parse_store_criteria(['type=A=B']) == {'type': 'A=B'}
+
+
+def test_import_profiles_directory(tmp_path):
+    directory = tmp_path / "cohort"
+    directory.mkdir()
+    samples = ['100', '1000', '1001']
+    for sample in samples:
+        for ext in ('counts', 'mutations'):
+            with open("{}/{}.{}".format(data_path, sample, ext)) as f:
+                (directory / "{}.{}".format(sample, ext)).write_text(f.read())
+    (directory / "100.stats").write_text("N\t10\n")
+
+    fname = str(tmp_path / "cohort.store")
+    assert import_profiles_directory(str(directory), fname, {'1000': {'type': 'A'}}) == 3
+    store = ProfilesStore(fname)
+    assert store.samples == samples
+    assert store.get_mutations().tolist() == [234, 91, 96]
+    assert np.array_equal(store.get_profiles()[1], [read_profile_file("{}/{}.counts".format(data_path, sample)) for sample in samples])
+    assert store.get_metadata('type').tolist() == ['', 'A', '']
+    assert store.get_metadata('N').tolist() == ['10', '', '']
@@ -0,0 +1,124 @@
+from itertools import product
+
+import numpy as np
+import pytest
+
+from mutagene.dna import nucleotides, complementary_nucleotide
+from mutagene.io.profile import read_profile_str, read_signatures_table, write_signatures
+from mutagene.profiles.channels import CHANNELS, INVALID_CHANNEL, encode_channel, encode_channels, get_codes_profiles
+from mutagene.profiles.channels import get_channel_scheme, get_label_scheme
+from mutagene.profiles.profile import get_mutational_profile, get_multisample_mutational_profile
+from mutagene.signatures.identify import decompose_multisample_mutational_profile_counts
+from mutagene.signatures.signature_set import get_dummy_matrix
+
+
+def test_encode_channels():
+    cn = complementary_nucleotide
+    mutations = list(product(nucleotides + "N", repeat=4))
+    for p5, p3, x, y in mutations:
+        code = encode_channel(p5, p3, x, y)
+        if "N" in (p5, p3, x, y) or x == y:
+            assert code == INVALID_CHANNEL
+        elif x in "CT":
+            assert CHANNELS[code] == p5 + p3 + x + y
+        else:
+            assert CHANNELS[code] == cn[p3] + cn[p5] + cn[x] + cn[y]
+
+    codes = encode_channels(*zip(*mutations))
+    assert codes.tolist() == [encode_channel(*mutation) for mutation in mutations]
+
+
+def test_codes_profiles():
+    random_state = np.random.RandomState(0)
+    samples_mutations = {
+        "sample{}".format(i): random_state.randint(INVALID_CHANNEL, 96, size=n).astype(np.int8)
+        for i, n in enumerate([0, 1, 50, 300])}
+    profiles = get_multisample_mutational_profile(samples_mutations, counts=True)
+    assert profiles.shape == (4, 96)
+    assert np.array_equal(profiles, get_codes_profiles(list(samples_mutations.values())))
+
+    for profile, codes in zip(profiles, samples_mutations.values()):
+        # same profile as from counts keyed by channel
+        counts = {}
+        for code in codes[codes != INVALID_CHANNEL]:
+            counts[CHANNELS[code]] = counts.get(CHANNELS[code], 0) + 1
+        assert np.array_equal(get_mutational_profile(counts, counts=True), profile)
+        assert np.array_equal(get_mutational_profile(codes, counts=True), profile)
+
+    frequencies = get_multisample_mutational_profile(samples_mutations)
+    assert np.all(frequencies[0] == 0)
+    assert np.allclose(frequencies[1:].sum(axis=1), 1.0)
+
+
+def get_reference_key(p5, p3, x, y, strand):
+    """ Key of a mutation on the forward strand of a transcript on strand + or - (see ChannelScheme.keys) """
+    cn = complementary_nucleotide
+    if x in "AG":
+        p5, p3 = "".join(cn[n] for n in reversed(p3)), "".join(cn[n] for n in reversed(p5))
+        x, y = cn[x], cn[y]
+        strand = "+" if strand == "-" else "-"
+    return p5 + p3 + x + y, "U" if strand == "+" else "T"
+
+
+def test_channel_schemes():
+    random_state = np.random.RandomState(0)
+    for name, n_channels in (("96", 96), ("192", 192), ("1536", 1536)):
+        scheme = get_channel_scheme(name)
+        assert scheme is get_channel_scheme(n_channels)
+        assert scheme.n_channels == n_channels == len(set(scheme.labels)) == len(set(scheme.keys))
+        assert get_label_scheme(scheme.labels) is scheme
+
+        k = scheme.flank
+        mutations = ["".join(random_state.choice(list(nucleotides), size=2 * k + 2)) for _ in range(500)]
+        p5, p3 = [m[:k] for m in mutations], [m[k:2 * k] for m in mutations]
+        x, y = [m[-2] for m in mutations], [m[-1] for m in mutations]
+        strand = random_state.choice(["+", "-"], size=len(mutations))
+        codes = scheme.encode_array(p5, p3, x, y, strand)
+        assert codes.tolist() == [scheme.encode(*mutation) for mutation in zip(p5, p3, x, y, strand)]
+        for code, mutation in zip(codes, zip(p5, p3, x, y, strand)):
+            if mutation[2] == mutation[3]:
+                assert code == INVALID_CHANNEL
+                continue
+            key, transcript_strand = get_reference_key(*mutation)
+            assert scheme.keys[code] == (transcript_strand if scheme.stranded else "") + key
+
+        names, W = scheme.get_dummy_signatures()
+        assert len(names) == 6 and W.shape == (n_channels, 6)
+        assert np.allclose(W.sum(axis=0), 1.0)
+        assert np.count_nonzero(W, axis=1).tolist() == [1] * n_channels
+
+    assert get_channel_scheme().labels[:2] == ["A[C>A]A", "A[C>G]A"]
+    assert get_channel_scheme("192").labels[96] == "U:A[C>A]A"
+    assert get_channel_scheme("1536").labels[6] == "AA[C>A]AC"
+    assert get_label_scheme(["T:A[C>A]A"]).name == "192"
+    with pytest.raises(ValueError):
+        get_channel_scheme(100)
+    with pytest.raises(ValueError):
+        get_label_scheme(["A[C>A]"])
+
+
+def test_signatures_table(tmp_path):
+    random_state = np.random.RandomState(0)
+    for n_channels in (96, 192, 1536):
+        W = random_state.dirichlet(np.ones(n_channels), size=3).T
+        fname = str(tmp_path / "signatures{}.tsv".format(n_channels))
+        with open(fname, "w") as f:
+            write_signatures(f, W, ["S1", "S2", "S3"])
+        W_read, names = read_signatures_table(fname)
+        assert names == ["S1", "S2", "S3"]
+        assert np.allclose(W_read, W)
+
+        profile_str = "\n".join("{}\t{}".format(label, v) for label, v in zip(get_channel_scheme(n_channels).labels, W[:, 0]))
+        assert np.allclose(read_profile_str(profile_str), W[:, 0])
+
+
+def test_decomposition_192():
+    random_state = np.random.RandomState(0)
+    W = random_state.dirichlet(np.ones(192), size=4).T
+    H = random_state.dirichlet(np.ones(4), size=5)
+    V = np.array([random_state.multinomial(1000, W.dot(h)) for h in H])
+    exposures, mutations, _ = decompose_multisample_mutational_profile_counts(
+        V, (W, ["S1", "S2", "S3", "S4"]), "MLE", solver="em", diagnostics=False)
+    assert exposures.shape == (5, 4)
+    assert np.allclose(exposures, H, atol=0.1)
+    assert get_dummy_matrix(192).shape == (192, 6)
@@ -0,0 +1,123 @@
+import io
+import os
+
+import numpy as np
+import pytest
+
+from mutagene.io.context_window import read_mutations
+from mutagene.motifs import complementary_nucleotide
+from mutagene.profiles.channels import N_CHANNELS, encode_channel, get_channel_scheme
+from mutagene.profiles.profile import calc_profile, calc_profiles
+from mutagene.profiles.profile import get_grouped_profiles, get_grouped_multisample_mutational_profile
+from mutagene.profiles.profile import get_multisample_mutational_profile, get_pooled_multisample_mutational_profile
+
+
+def get_samples_mutations(n, random_state=0):
+    random_state = np.random.RandomState(random_state)
+    return {"sample{}".format(i): random_state.randint(0, N_CHANNELS, size=random_state.randint(0, 100)).astype(np.int8) for i in range(n)}
+
+
+def test_grouped_profiles():
+    samples_mutations = get_samples_mutations(30)
+    profiles = get_multisample_mutational_profile(samples_mutations, counts=True)
+    groups = {sample: "type{}".format(i % 4) for i, sample in enumerate(samples_mutations) if i != 5}
+
+    labels, pooled = get_grouped_multisample_mutational_profile(samples_mutations, groups, counts=True)
+    assert labels == ["type0", "type1", "type2", "type3"]
+    for label, profile in zip(labels, pooled):
+        rows = [i for i, sample in enumerate(samples_mutations) if groups.get(sample) == label]
+        assert np.array_equal(profile, profiles[rows].sum(axis=0))
+
+    _, frequencies = get_grouped_multisample_mutational_profile(samples_mutations, groups)
+    assert np.allclose(frequencies, pooled / pooled.sum(axis=1, keepdims=True))
+
+    assert np.array_equal(
+        get_pooled_multisample_mutational_profile(samples_mutations, counts=True),
+        get_grouped_profiles(profiles, np.zeros(len(profiles)))[1][0])
+
+    labels, pooled = get_grouped_profiles(np.zeros((0, N_CHANNELS)), [])
+    assert labels == [] and pooled.shape == (0, N_CHANNELS)
+    with pytest.raises(ValueError):
+        get_grouped_profiles(profiles, [0, 1])
+
+
+motifs_data_path = os.path.dirname(os.path.realpath(__file__)) + "/../motifs/data"
+
+
+def read_test_genome():
+    sequences = {}
+    with open(motifs_data_path + "/test_genome.fa") as f:
+        for line in f:
+            if line.startswith(">"):
+                chrom = line[1:].strip()
+                sequences[chrom] = ""
+            else:
+                sequences[chrom] += line.strip().upper()
+    return sequences
+
+
+def test_calc_profiles(tmp_path):
+    sequences = read_test_genome()
+    random_state = np.random.RandomState(0)
+    fnames = []
+    expected = np.zeros((3, N_CHANNELS), dtype=int)
+    for i in range(3):
+        lines = ["#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO"]
+        for _ in range(50):
+            chrom = random_state.choice(sorted(sequences))
+            pos = random_state.randint(2, len(sequences[chrom]) - 1)
+            p5, x, p3 = sequences[chrom][pos - 2:pos + 1]
+            y = random_state.choice([n for n in "ACGT" if n != x])
+            lines.append("{}\t{}\t.\t{}\t{}\t.\tPASS\t.".format(chrom, pos, x, y))
+            code = encode_channel(p5, p3, x, y)
+            if code >= 0:
+                expected[i, code] += 1
+        fname = str(tmp_path / "sample{}.vcf".format(i))
+        with open(fname, "w") as f:
+            f.write("\n".join(lines) + "\n")
+        fnames.append(fname)
+
+    genome = motifs_data_path + "/test_genome.2bit"
+    for jobs in (1, 2):
+        profiles, files_stats = calc_profiles(fnames, genome, jobs=jobs)
+        assert np.array_equal(profiles, expected)
+        assert [processing_stats['loaded'] for processing_stats in files_stats] == expected.sum(axis=1).tolist()
+
+    outfile = io.StringIO()
+    matrix = io.StringIO()
+    calc_profile(fnames, outfile, genome, matrix=matrix)
+    lines = matrix.getvalue().splitlines()
+    assert lines[0] == "MutationType\tsample0\tsample1\tsample2"
+    assert [int(line.split()[1]) for line in outfile.getvalue().splitlines()] == expected.sum(axis=0).tolist()
+    assert [list(map(int, line.split()[1:])) for line in lines[1:]] == expected.T.tolist()
+
+
+def test_read_mutations_schemes():
+    sequences = read_test_genome()
+    random_state = np.random.RandomState(1)
+    lines = ["Tumor_Sample_Barcode\tChromosome\tStart_Position\tReference_Allele\tTumor_Seq_Allele1\tTumor_Seq_Allele2\tTranscript_Strand"]
+    mutations = []
+    for _ in range(100):
+        chrom = random_state.choice(sorted(sequences))
+        pos = random_state.randint(3, len(sequences[chrom]) - 2)
+        context = sequences[chrom][pos - 3:pos + 2]
+        x = context[2]
+        y = random_state.choice([n for n in "ACGT" if n != x])
+        strand = random_state.choice(["1", "-1"])
+        lines.append("sample\t{}\t{}\t{}\t{}\t{}\t{}".format(chrom, pos, x, x, y, strand))
+        if x in complementary_nucleotide:
+            # the same mutation with reference allele given on the complementary strand
+            cx, cy = complementary_nucleotide[x], complementary_nucleotide[y]
+            lines.append("comp\t{}\t{}\t{}\t{}\t{}\t{}".format(chrom, pos, cx, cx, cy, strand))
+        mutations.append((context, x, y, "+" if strand == "1" else "-"))
+    maf = "\n".join(lines) + "\n"
+
+    genome = motifs_data_path + "/test_genome.2bit"
+    for name, p5, p3 in (("96", slice(1, 2), slice(3, 4)), ("192", slice(1, 2), slice(3, 4)), ("1536", slice(0, 2), slice(3, 5))):
+        scheme = get_channel_scheme(name)
+        samples_mutations, _, _ = read_mutations("MAF", io.StringIO(maf), genome, window_size=1, scheme=name)
+        expected = [scheme.encode(context[p5], context[p3], x, y, strand) for context, x, y, strand in mutations]
+        assert samples_mutations["sample"].tolist() == [code for code in expected if code >= 0]
+        assert samples_mutations["comp"].tolist() == samples_mutations["sample"].tolist()
+        profile = get_multisample_mutational_profile(samples_mutations, counts=True, scheme=name)
+        assert profile.shape == (2, scheme.n_channels)
@@ -0,0 +1,40 @@
+import numpy as np
+
+from mutagene.io.profile import read_signatures
+from mutagene.signatures.identify import decompose_multisample_mutational_profile_counts
+from mutagene.signatures.bootstrap import bootstrap_multisample_decomposition
+from tests.signatures.test_identify import get_profiles
+
+
+def test_adaptive_bootstrap():
+    W, signature_names = read_signatures('5')
+    profiles = get_profiles(3)
+    samples_profiles = {str(i): profile for i, profile in enumerate(profiles)}
+
+    exposures, mutations, _ = decompose_multisample_mutational_profile_counts(profiles, (W, signature_names), 'MLE')
+    samples_results = {sample: (exposures[i], mutations[i]) for i, sample in enumerate(samples_profiles)}
+
+    np.random.seed(7)
+    results, replicates = bootstrap_multisample_decomposition(
+        samples_profiles, samples_results, (W, signature_names), 'MLE', replicates=40, solver='em')
+    assert all(n == 40 for n in replicates.values())
+    assert all(results[sample][0].shape == (40, 5) for sample in samples_profiles)
+
+    results, replicates = bootstrap_multisample_decomposition(
+        samples_profiles, samples_results, (W, signature_names), 'MLE', replicates=1000, solver='em',
+        adaptive=True, block_size=20, ci_tol=0.01)
+    for sample in samples_profiles:
+        assert replicates[sample] % 20 == 0 and 40 <= replicates[sample] <= 1000
+        assert results[sample][0].shape == (replicates[sample], 5)
+        assert results[sample][1].shape == (replicates[sample], 5)
+
+    finished = {}
+    results, replicates_used = bootstrap_multisample_decomposition(
+        samples_profiles, samples_results, (W, signature_names), 'MLE', replicates=1000, solver='em',
+        adaptive=True, block_size=20, ci_tol=0.01, batch_size=2,
+        callback=lambda sample, result, n: finished.update({sample: (result, n)}))
+    assert results == {}
+    assert set(finished) == set(samples_profiles)
+    for sample, (result, n) in finished.items():
+        assert n == replicates_used[sample]
+        assert result[0].shape == (n, 5)
@@ -0,0 +1,30 @@
+import numpy as np
+
+from mutagene.io.profile import read_signatures
+from mutagene.signatures.identify import decompose_multisample_mutational_profile_counts
+from mutagene.signatures.fisher import get_fisher_intervals, get_multisample_fisher_intervals
+
+
+def test_fisher_intervals():
+    signature_set = read_signatures('5')
+    W = signature_set.W
+    h = np.array([0.6, 0.4, 0.0, 0.0, 0.0])
+    rng = np.random.RandomState(0)
+    V = rng.multinomial(1000, W.dot(h), size=100).astype(float)
+
+    exposures, _, _ = decompose_multisample_mutational_profile_counts(
+        V, signature_set, 'MLE', enable_dummy=False, solver='em', tol=1e-10, max_iter=100000)
+    low, high = get_multisample_fisher_intervals(V, exposures, W, level=95)
+    assert low.shape == exposures.shape
+    assert np.all(low <= exposures + 1e-12) and np.all(exposures <= high + 1e-12)
+    assert np.all(low >= 0.0) and np.all(high <= 1.0)
+
+    # coverage of exposures of signatures in the profile, signatures at the bound have lower bound 0
+    coverage = np.mean((low <= h) & (h <= high), axis=0)
+    assert np.all(coverage[:2] > 0.85)
+    assert np.all(low[:, 2:][exposures[:, 2:] == 0.0] == 0.0)
+
+    # intervals narrow with more mutations
+    v = 10 * V[0]
+    _, high_10 = get_fisher_intervals(v, exposures[0], W)
+    assert np.all(high_10[:2] - exposures[0, :2] < high[0, :2] - exposures[0, :2])
@@ -0,0 +1,236 @@
+import glob
+import os
+import warnings
+
+import numpy as np
+
+from mutagene.io.profile import read_signatures, read_profile_file
+from mutagene.signatures.identify import decompose_mutational_profile_counts
+from mutagene.signatures.identify import decompose_multisample_mutational_profile_counts, get_fit_metrics
+from mutagene.signatures.identify import get_profile_fit_metrics
+
+
+data_path = os.path.dirname(os.path.realpath(__file__)) + "/../../data/ICGC"
+
+
+def get_profiles(n):
+    return np.array([read_profile_file(fname) for fname in sorted(glob.glob(data_path + "/*.counts"))[:n]])
+
+
+def test_multisample_decomposition():
+    W, signature_names = read_signatures('5')
+    profiles = get_profiles(5)
+
+    exposures, mutations, metrics = decompose_multisample_mutational_profile_counts(profiles, (W, signature_names), 'MLE')
+
+    assert exposures.shape == (5, 5)
+    assert mutations.shape == (5, 5)
+    assert metrics['LogLik'].shape == (5, )
+
+    for i, profile in enumerate(profiles):
+        h, _, results = decompose_mutational_profile_counts(profile, (W, signature_names), 'MLE', others_threshold=0.0)
+        assert np.allclose(exposures[i], h[:5])
+        ll = [x['score'] for x in results if x['name'] == 'LogLik'][0]
+        assert np.isclose(metrics['LogLik'][i], ll)
+
+
+def test_fit_metrics_empty():
+    W, signature_names = read_signatures('5')
+    profiles = np.vstack([get_profiles(2), np.zeros((1, 96))])
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        _, _, metrics = decompose_multisample_mutational_profile_counts(profiles, (W, signature_names), 'MLE')
+        # exposures reconstructing none of the observed channels
+        zero_fit = get_fit_metrics(np.zeros((2, 5)), W, profiles[:2], profiles[:2] / profiles[:2].sum(axis=1, keepdims=True))
+    assert all(np.all(np.isfinite(values)) for values in metrics.values() if values.dtype.kind == 'f')
+    assert metrics['FrobeniusZero'][2] == 0.0
+    assert np.all(np.isfinite(zero_fit['FrobeniusZero']))
+
+
+def test_fit_metrics_loglik_zero_channels():
+    # channels 48 and 49 have mutations but are not covered by the fitted signature
+    W = np.zeros((96, 2))
+    W[:48, 0] = 1.0 / 48
+    W[48:, 1] = 1.0 / 48
+    h = np.array([1.0, 0.0])
+    profile = np.zeros(96)
+    profile[[0, 1, 48, 49]] = [5, 3, 4, 2]
+    profile_freq = profile / profile.sum()
+
+    metrics = get_fit_metrics(h, W, profile[np.newaxis], profile_freq[np.newaxis])
+    single = get_profile_fit_metrics(h, W, profile, profile_freq)
+    assert np.isclose(metrics['LogLik'][0], single['LogLik'])
+    assert single['LogLik'] < 8 * np.log(1.0 / 48)
+
+
+def test_initial_guesses():
+    from mutagene.signatures.identify import add_dummy_signatures, get_initial_guess, get_initial_guesses, get_warm_start
+
+    W, _ = read_signatures('5')
+    W = add_dummy_signatures(W)
+    profiles = get_profiles(5)
+    V_freq = profiles / profiles.sum(axis=1, keepdims=True)
+
+    H = get_initial_guesses(W, V_freq, tol=1e-10, max_iter=100000)
+    assert H.shape == (5, W.shape[1])
+    assert np.all(H > 0.0) and np.all(H.sum(axis=1) <= 1.0 + 1e-9)
+    for i, v_freq in enumerate(V_freq):
+        # the initial guess of a sample does not depend on other samples
+        assert np.array_equal(get_initial_guesses(W, v_freq, tol=1e-10, max_iter=100000)[0], H[i])
+        assert np.array_equal(get_initial_guesses(W, V_freq[i:], tol=1e-10, max_iter=100000)[0], H[i])
+
+        # least squares over the capped simplex is NNLS when NNLS exposures sum up to less than 1
+        h0 = get_initial_guess(W, v_freq)
+        if h0.sum() < 1.0 - 1e-6:
+            assert np.allclose(H[i], get_warm_start(h0, 1, W, W.shape[1])[0], atol=1e-5)
+
+
+def test_objective_values():
+    from mutagene.signatures.identify import IDENTIFY_MIN_FUNCTIONS, add_dummy_signatures, get_objective_values
+
+    W, _ = read_signatures('5')
+    W = add_dummy_signatures(W)
+    profiles = get_profiles(3)
+    H = np.random.RandomState(13425).dirichlet(np.ones(W.shape[1]), size=3) * [[0.5], [1.0], [1.5]]
+    for func in set(IDENTIFY_MIN_FUNCTIONS.values()):
+        for V in (profiles, profiles / profiles.sum(axis=1, keepdims=True)):
+            expected = [func(h.copy(), W, v) for h, v in zip(H, V)]
+            assert np.allclose(get_objective_values(func, H, W, V), expected), func.__name__
+            # a single profile shared by all rows
+            expected = [func(h.copy(), W, V[0]) for h in H]
+            assert np.allclose(get_objective_values(func, H, W, V[0]), expected), func.__name__
+
+
+def test_gradients():
+    from scipy.optimize import check_grad
+    from mutagene.signatures.identify import IDENTIFY_MIN_GRADIENTS, add_dummy_signatures
+
+    W, _ = read_signatures('5')
+    W = add_dummy_signatures(W)
+    profile = get_profiles(1)[0]
+
+    x = np.random.RandomState(13425).dirichlet(np.ones(W.shape[1])) * 0.9
+    for func, grad in IDENTIFY_MIN_GRADIENTS.items():
+        for b in (profile, profile / profile.sum()):
+            error = check_grad(lambda y: func(y.copy(), W, b), lambda y: grad(y.copy(), W, b), x)
+            assert error <= 1e-4 * max(1.0, np.linalg.norm(grad(x.copy(), W, b))), func.__name__
+
+
+def test_em_solver():
+    W, signature_names = read_signatures('30')
+    profiles = get_profiles(10)
+
+    slsqp_exposures, _, slsqp_metrics = decompose_multisample_mutational_profile_counts(profiles, (W, signature_names), 'MLE')
+    em_exposures, _, em_metrics = decompose_multisample_mutational_profile_counts(profiles, (W, signature_names), 'MLE', solver='em')
+
+    assert np.all(em_metrics['Iterations'] > 0)
+    # likelihood is convex, both solvers converge to (nearly) the same optimum
+    assert np.all(em_metrics['LogLik'] - slsqp_metrics['LogLik'] > -0.1)
+    assert np.abs(em_exposures - slsqp_exposures).mean() < 0.01
+
+
+def test_parallel_decomposition():
+    from mutagene.signatures.identify import map_decompose_mutational_profile_counts
+
+    W, signature_names = read_signatures('5')
+    profiles = get_profiles(6)
+
+    serial = decompose_multisample_mutational_profile_counts(profiles, (W, signature_names), 'MLE')
+    parallel = decompose_multisample_mutational_profile_counts(profiles, (W, signature_names), 'MLE', jobs=2)
+    assert np.allclose(serial[0], parallel[0])
+    assert np.all(serial[1] == parallel[1])
+
+    results = list(map_decompose_mutational_profile_counts(profiles, (W, signature_names), jobs=2, func='MLE'))
+    assert len(results) == len(profiles)
+    for i, (h, _, _) in enumerate(results):
+        assert np.allclose(h[:5], serial[0][i])
+
+
+def test_bootstrap_warm_start():
+    from mutagene.profiles.profile import get_resampled_profiles
+
+    W, signature_names = read_signatures('5')
+    profile = get_profiles(1)[0]
+    exposures, _, metrics = decompose_multisample_mutational_profile_counts(profile, (W, signature_names), 'MLE')
+
+    np.random.seed(5)
+    replicates = get_resampled_profiles(profile, 20)
+    assert replicates.shape == (20, 96)
+
+    cold, _, cold_metrics = decompose_multisample_mutational_profile_counts(replicates, (W, signature_names), 'MLE')
+    # maximum likelihood of replicates, EM converged tightly
+    _, _, best_metrics = decompose_multisample_mutational_profile_counts(
+        replicates, (W, signature_names), 'MLE', solver='em', tol=1e-12, max_iter=200000)
+    assert np.mean(best_metrics['LogLik'] - cold_metrics['LogLik']) < 0.2
+    for solver in ('slsqp', 'em'):
+        for H0 in (exposures, np.hstack([exposures, metrics['Unexplained']])):
+            warm, _, warm_metrics = decompose_multisample_mutational_profile_counts(
+                replicates, (W, signature_names), 'MLE', solver=solver, H0=H0)
+            assert np.mean(best_metrics['LogLik'] - warm_metrics['LogLik']) < 0.2
+            assert np.abs(warm - cold).mean() < 0.01
+
+
+def test_decomposition_fast_path():
+    W, signature_names = read_signatures('5')
+    profile = get_profiles(1)[0]
+
+    h, _, results = decompose_mutational_profile_counts(profile, (W, signature_names), 'MLE', others_threshold=0.0)
+    assert [x['name'] for x in results[-5:]] == ['LogLik', 'Frobenius', 'FrobeniusZero', 'DivergenceJS', 'DivergenceKL']
+
+    _, _, results_no_diagnostics = decompose_mutational_profile_counts(
+        profile, (W, signature_names), 'MLE', others_threshold=0.0, diagnostics=False)
+    assert list(results_no_diagnostics) == results[:-5]
+
+    exposures, mutations = decompose_mutational_profile_counts(profile, (W, signature_names), 'MLE', summary=False)
+    assert np.allclose(exposures, h[:5])
+    assert list(mutations) == [x['mutations'] for x in sorted(results[:-5], key=lambda x: x['name'])]
+
+    _, _, metrics = decompose_multisample_mutational_profile_counts(profile, (W, signature_names), 'MLE', diagnostics=False)
+    assert 'LogLik' not in metrics and 'Iterations' in metrics
+
+
+def test_global_optimization():
+    W, signature_names = read_signatures('30')
+    profiles = get_profiles(3)
+
+    _, _, local_metrics = decompose_multisample_mutational_profile_counts(profiles, (W, signature_names), 'MLE')
+    exposures, _, metrics = decompose_multisample_mutational_profile_counts(
+        profiles, (W, signature_names), 'MLE', global_optimization=True, n_starts=10, random_state=0)
+
+    assert np.all((metrics['Starts'] >= 3) & (metrics['Starts'] <= 10))
+    # the NNLS start of the local fit is one of the starts, global optimum can only be better
+    assert np.all(metrics['LogLik'] - local_metrics['LogLik'] > -1e-6)
+
+    h, _, results = decompose_mutational_profile_counts(
+        profiles[0], (W, signature_names), 'MLE', global_optimization=True, n_starts=10, random_state=0)
+    assert np.allclose(h[:30], exposures[0])
+
+
+def test_prescreen():
+    W, signature_names = read_signatures('COSMICv3')
+    profiles = get_profiles(5)
+
+    for solver in ('slsqp', 'em'):
+        _, _, metrics = decompose_multisample_mutational_profile_counts(profiles, (W, signature_names), 'MLE', solver=solver)
+        _, _, screened_metrics = decompose_multisample_mutational_profile_counts(
+            profiles, (W, signature_names), 'MLE', solver=solver, prescreen=True, prescreen_replicates=5, random_state=0)
+
+        assert np.all(screened_metrics['Pruned'] > 0)
+        # signatures missed by the screen are added back, the optimum does not change
+        assert np.all(np.abs(screened_metrics['LogLik'] - metrics['LogLik']) < 0.5)
+
+    h, _, _ = decompose_mutational_profile_counts(profiles[0], (W, signature_names), 'MLE', prescreen=True)
+    assert np.isclose(h.sum(), 1.0)
+
+
+def test_prescreen_clusters():
+    signature_set = read_signatures('COSMICv3')
+    profiles = get_profiles(5)
+
+    _, _, metrics = decompose_multisample_mutational_profile_counts(profiles, signature_set, 'MLE')
+    _, _, screened_metrics = decompose_multisample_mutational_profile_counts(profiles, signature_set, 'MLE', prescreen='clusters')
+    assert np.all(screened_metrics['Pruned'] > 0)
+    assert np.all(np.abs(screened_metrics['LogLik'] - metrics['LogLik']) < 0.5)
+
+    h, _, _ = decompose_mutational_profile_counts(profiles[0], signature_set, 'MLE', prescreen='clusters')
+    assert np.isclose(h.sum(), 1.0)
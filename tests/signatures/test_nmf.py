@@ -0,0 +1,49 @@
+import numpy as np
+
+from mutagene.io.profile import read_signatures
+from mutagene.signatures.nmf import nmf, cluster_signatures, extract_signatures
+
+
+def get_cohort(n_samples=100, signatures=(0, 3, 6), seed=0):
+    W, _ = read_signatures('30')
+    W = np.array(W)[:, list(signatures)]
+    random_state = np.random.RandomState(seed)
+    H = random_state.dirichlet(np.ones(W.shape[1]) * 0.5, size=n_samples) * random_state.randint(200, 2000, size=(n_samples, 1))
+    return W, random_state.poisson(H.dot(W.T))
+
+
+def get_best_cosine(W, W_true):
+    cos = (W / np.linalg.norm(W, axis=0)).T.dot(W_true / np.linalg.norm(W_true, axis=0))
+    return cos.max(axis=0)
+
+
+def test_nmf():
+    W_true, V = get_cohort()
+    for objective in ('kl', 'frobenius'):
+        W, H, value, iterations = nmf(V, 3, objective, random_state=1)
+        assert np.allclose(W.sum(axis=0), 1.0)
+        assert np.all(get_best_cosine(W, W_true) > 0.98)
+
+        # updates accumulated over chunks of samples give the same factorization
+        W_chunked, H_chunked, _, _ = nmf(V, 3, objective, random_state=1, max_iter=50, chunk_size=7)
+        W_full, H_full, _, _ = nmf(V, 3, objective, random_state=1, max_iter=50)
+        assert np.allclose(W_chunked, W_full)
+        assert np.allclose(H_chunked, H_full)
+
+
+def test_cluster_signatures():
+    W_true, _ = get_cohort()
+    random_state = np.random.RandomState(2)
+    # restarts find the same signatures in different order
+    Ws = [W_true[:, random_state.permutation(3)] for _ in range(5)]
+    signatures, stability = cluster_signatures(Ws)
+    assert np.all(get_best_cosine(signatures, W_true) > 0.999)
+    assert np.allclose(stability, 1.0)
+
+
+def test_extract_signatures():
+    W_true, V = get_cohort()
+    rank, results = extract_signatures(V, [2, 3, 4], n_restarts=5, random_state=0)
+    assert rank == 3
+    assert np.all(get_best_cosine(results[3]['signatures'], W_true) > 0.98)
+    assert results[2]['objective'] > results[3]['objective']
@@ -0,0 +1,36 @@
+import pickle
+
+import numpy as np
+
+from mutagene.io.decomposition import _get_stats, _get_bootstrap_stats_percentile
+from mutagene.signatures.results import DecompositionResult
+
+
+def test_decomposition_result():
+    calls = []
+
+    def metrics():
+        calls.append(1)
+        return {'LogLik': -10.0, 'Frobenius': 0.1}
+
+    result = DecompositionResult(['a', 'b', 'c'], [0.6, 0.03, 0.37], 100, metrics=metrics, others_threshold=0.05)
+    assert list(result.mutations) == [60, 3, 37]
+    assert result.exposure_dict() == {'a': 0.6, 'b': 0.03, 'c': 0.37}
+    assert len(calls) == 0
+
+    records = list(result)
+    assert len(calls) == 1
+    assert [x['name'] for x in records] == ['a', 'c', 'Other signatures', 'b', 'LogLik', 'Frobenius']
+    assert [x['id'] for x in records] == [1, 2, 100, 101, 201, 202]
+    assert result[-1]['score'] == 0.1
+
+    result = DecompositionResult(['a', 'b'], [0.7, 0.3], 10)
+    assert result.metrics == {}
+    assert len(pickle.loads(pickle.dumps(result))) == 2
+
+    df = _get_stats(result)
+    assert list(df.signature) == ['a', 'b'] and list(df.mutations) == [7, 3]
+
+    replicates = [DecompositionResult(['a', 'b'], [h, 1.0 - h], 10) for h in np.linspace(0.5, 0.9, 5)]
+    df = _get_bootstrap_stats_percentile(replicates, 90)
+    assert np.isclose(df.set_index('signature').exposure['a'], 0.7)
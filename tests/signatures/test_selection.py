@@ -0,0 +1,61 @@
+import glob
+import os
+
+import numpy as np
+
+from mutagene.io.profile import read_signatures, read_profile_file
+from mutagene.signatures.identify import decompose_multisample_mutational_profile_counts, AICc, add_dummy_signatures
+from mutagene.signatures.selection import select_signatures, fit_subsets, get_information_criterion
+
+
+data_path = os.path.dirname(os.path.realpath(__file__)) + "/../../data/ICGC"
+
+
+def get_profiles(n):
+    return np.array([read_profile_file(fname) for fname in sorted(glob.glob(data_path + "/*.counts"))[:n]])
+
+
+def test_information_criterion():
+    W, _ = read_signatures('30')
+    W = add_dummy_signatures(W)
+    profile = get_profiles(1)[0]
+    h = np.random.RandomState(1).dirichlet(np.ones(W.shape[1]))
+    h[:20] = 0.0
+    h /= h.sum()
+
+    loglik = np.sum(profile * np.log(W.dot(h)))
+    k = np.sum(h > 0.0)
+    assert np.isclose(get_information_criterion('AICc', loglik, k, profile.sum()), AICc(h.copy(), W, profile))
+
+
+def test_select_signatures():
+    W, _ = read_signatures('30')
+    W = add_dummy_signatures(W)
+    fixed = np.arange(W.shape[1]) >= 30
+    n = W.shape[1]
+
+    for profile in get_profiles(3):
+        h, iterations, fits = select_signatures(profile, W, 'BIC', fixed=fixed, direction='both')
+        assert iterations > 0 and fits < 2 ** 30
+        score = get_information_criterion('BIC', np.sum(profile * np.log(W.dot(h))), np.sum((h > 0.0) | fixed), profile.sum())
+
+        # no subset differing by a single signature is better
+        mask = (h > 0.0) | fixed
+        masks = np.repeat(mask[np.newaxis], 30, axis=0)
+        masks[np.arange(30), np.arange(30)] ^= True
+        H, loglik, _ = fit_subsets(profile, W, masks, h)
+        for m, ll in zip(masks, loglik):
+            assert get_information_criterion('BIC', ll, m.sum(), profile.sum()) > score - 1e-3
+
+
+def test_stepwise_decomposition():
+    W, signature_names = read_signatures('30')
+    profiles = get_profiles(3)
+
+    exposures, _, metrics = decompose_multisample_mutational_profile_counts(
+        profiles, (W, signature_names), 'AICc', selection='both')
+    _, _, local_metrics = decompose_multisample_mutational_profile_counts(profiles, (W, signature_names), 'AICc')
+
+    assert np.all(metrics['Fits'] > 0)
+    assert np.all(np.sum(exposures > 0.0, axis=1) <= 30)
+    assert np.all(metrics['LogLik'] - local_metrics['LogLik'] > -20.0)
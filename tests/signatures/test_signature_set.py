@@ -0,0 +1,64 @@
+import pickle
+
+import numpy as np
+
+from mutagene.io.profile import read_signatures
+from mutagene.signatures.signature_set import SignatureSet
+from mutagene.signatures.identify import add_dummy_signatures, decompose_mutational_profile_counts
+from tests.signatures.test_identify import get_profiles
+
+
+def test_signature_set():
+    signature_set = read_signatures('5')
+    assert isinstance(signature_set, SignatureSet)
+
+    W, signature_names = signature_set
+    assert W.shape == (96, 5)
+    assert signature_names == ['MGA-1', 'MGA-2', 'MGA-3', 'MGA-4', 'MGA-5']
+    assert np.array_equal(signature_set.get_matrix(True), add_dummy_signatures(W))
+    assert np.array_equal(signature_set.get_matrix(False), W)
+    assert np.allclose(signature_set.norms, np.linalg.norm(W, axis=0))
+    assert len(signature_set.get_constraints_and_bounds(True)[1]) == 11
+
+    assert SignatureSet.from_signatures(signature_set) is signature_set
+    G, L = signature_set.get_gram(False)
+    assert np.allclose(G, W.T.dot(W)) and np.isclose(L, np.linalg.eigvalsh(W.T.dot(W))[-1])
+    assert signature_set.get_gram(False)[0] is G
+
+    # can be sent to worker processes
+    assert np.array_equal(pickle.loads(pickle.dumps(signature_set)).W_dummy, signature_set.W_dummy)
+
+    profile = get_profiles(1)[0]
+    h1, _, results1 = decompose_mutational_profile_counts(profile, signature_set, 'MLE')
+    h2, _, results2 = decompose_mutational_profile_counts(profile, (W, signature_names), 'MLE')
+    assert np.allclose(h1, h2)
+    assert [x['name'] for x in results1] == [x['name'] for x in results2]
+
+
+def test_signature_clusters():
+    signature_set = read_signatures('COSMICv3')
+    assert np.allclose(np.diag(signature_set.similarity), 1.0)
+    assert signature_set.representatives.sum() == len(np.unique(signature_set.clusters))
+    assert signature_set.get_cluster_members('COSMICv3-SBS5') == ['COSMICv3-SBS3', 'COSMICv3-SBS5', 'COSMICv3-SBS40']
+
+    representatives = read_signatures('COSMICv3', only=['representatives'])
+    assert representatives.n_signatures == signature_set.representatives.sum()
+
+    cluster = read_signatures('COSMICv3', only=['cluster:SBS40', 'SBS1'])
+    assert cluster.names == ['COSMICv3-SBS1', 'COSMICv3-SBS3', 'COSMICv3-SBS5', 'COSMICv3-SBS40']
+    indices = [signature_set.names.index(x) for x in cluster.names]
+    assert np.allclose(cluster.similarity, signature_set.similarity[np.ix_(indices, indices)])
+
+
+def test_signature_set_lazy():
+    W, signature_names = read_signatures('5')
+    signature_set = SignatureSet(W, signature_names)
+    profile = get_profiles(1)[0]
+    decompose_mutational_profile_counts(profile, signature_set, 'MLE', solver='em')
+    # Gram matrix is only computed when initial guesses or FISTA need it, clustering when clusters are used
+    assert signature_set._gram == {} and signature_set._linkage is None and signature_set._similarity is None
+
+    decompose_mutational_profile_counts(profile, signature_set, 'MLE')
+    decompose_mutational_profile_counts(profile, signature_set, 'Frobenius', solver='fista')
+    assert list(signature_set._gram) == [True] and signature_set._linkage is None
+    assert signature_set.clusters.shape == (5, ) and signature_set._linkage is not None
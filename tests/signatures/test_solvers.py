@@ -0,0 +1,34 @@
+import numpy as np
+
+from mutagene.io.profile import read_signatures
+from mutagene.signatures.solvers import project_capped_simplex
+from mutagene.signatures.identify import decompose_multisample_mutational_profile_counts
+from tests.signatures.test_identify import get_profiles
+
+
+def test_project_capped_simplex():
+    rng = np.random.RandomState(3)
+    X = rng.normal(0.1, 0.5, size=(200, 8))
+    P = project_capped_simplex(X)
+    assert np.all(P >= 0.0) and np.all(P.sum(axis=1) <= 1.0 + 1e-12)
+
+    # projection is the closest feasible point: no random feasible point is closer
+    feasible = project_capped_simplex(rng.uniform(0, 0.5, size=(1000, 8)))
+    for x, p in zip(X[:20], P[:20]):
+        assert np.linalg.norm(x - p) <= np.min(np.linalg.norm(feasible - x, axis=1)) + 1e-12
+
+    inside = np.array([[0.2, 0.3, 0.1]])
+    assert np.allclose(project_capped_simplex(inside), inside)
+    assert np.allclose(project_capped_simplex(np.array([[2.0, 0.0, -1.0]])), [[1.0, 0.0, 0.0]])
+
+
+def test_fista_solver():
+    W, signature_names = read_signatures('30')
+    profiles = get_profiles(10)
+
+    for method in ('frobenius', 'js'):
+        slsqp_exposures, _, slsqp_metrics = decompose_multisample_mutational_profile_counts(profiles, (W, signature_names), method)
+        fista_exposures, _, fista_metrics = decompose_multisample_mutational_profile_counts(
+            profiles, (W, signature_names), method, solver='fista')
+        assert np.all(fista_metrics['Iterations'] > 0)
+        assert np.abs(fista_exposures - slsqp_exposures).max() < 0.01